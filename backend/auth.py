@@ -1,23 +1,33 @@
+import hmac
+import logging
 import os
+import time
 from datetime import datetime, timezone
-from typing import Annotated
-from passlib.context import CryptContext
+from typing import Annotated, Literal
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException
 from fastapi.security import (
     OAuth2PasswordBearer,
     OAuth2PasswordRequestForm,
 )
 from jose import ExpiredSignatureError, JWTError, jwt
 from pydantic import BaseModel, ValidationError
-from sqlmodel import Session, SQLModel, select
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import Optional
 
 from backend import database as db
+from backend import passwords, user_cache
 from backend.schema import User, UserInDB, UserResponse
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-access_token_duration = 3600  # seconds
+logger = logging.getLogger(__name__)
+
+pwd_context = passwords.context(passwords.rounds())
+# seconds; routes that authenticate from the claims alone only see a
+# revocation once the token expires, so shorten this for quicker revocation
+# once clients renew their tokens with /auth/refresh (the frontend does not)
+access_token_duration = int(os.environ.get("ACCESS_TOKEN_SECONDS", "3600"))
+refresh_token_duration = int(os.environ.get("REFRESH_TOKEN_SECONDS", str(14 * 24 * 3600)))
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 jwt_key = os.environ.get("JWT_KEY", default="insecure-jwt-key-for-dev")
 jwt_alg = "HS256"
@@ -49,6 +59,13 @@ class AccessToken(BaseModel):
     access_token: str
     token_type: str
     expires_in: int
+    refresh_token: Optional[str] = None
+
+
+class RefreshRequest(BaseModel):
+    """Request model to exchange a refresh token."""
+
+    refresh_token: str
 
 
 class Claims(BaseModel):
@@ -56,6 +73,14 @@ class Claims(BaseModel):
 
     sub: str  # id of user
     exp: int  # unix timestamp
+    username: Optional[str] = None
+    ver: int = 0  # token_version of the user when the token was issued
+    typ: Literal["access", "refresh"] = "access"
+
+    @property
+    def id(self) -> int:
+        """Id of the user, so that claims can stand in for it in queries."""
+        return int(self.sub)
 
 
 class AuthException(HTTPException):
@@ -104,15 +129,73 @@ class DuplicateValueException(HTTPException):
             },
         )
 
-def get_current_user(
-    session: Session = Depends(db.get_session),
+def is_admin_token(token: Optional[str]) -> bool:
+    """Whether a token matches ADMIN_TOKEN; always False when that is unset."""
+    admin_token = os.environ.get("ADMIN_TOKEN")
+    if not admin_token or not token:
+        return False
+    return hmac.compare_digest(token.encode(), admin_token.encode())
+
+
+class AdminRequired(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=403,
+            detail={
+                "error": "forbidden",
+                "error_description": "requires a valid X-Admin-Token",
+            },
+        )
+
+
+def require_admin(x_admin_token: Annotated[Optional[str], Header()] = None):
+    """FastAPI dependency that only lets requests with the admin token through."""
+    if not is_admin_token(x_admin_token):
+        raise AdminRequired()
+
+
+async def get_current_user(
+    session: AsyncSession = Depends(db.get_read_session),
     token: str = Depends(oauth2_scheme),
 ) -> UserInDB:
     """FastAPI dependency to get current user from bearer token."""
-    user = _decode_access_token(session, token)
+    user = await _decode_access_token(session, token)
     return user
 
 
+async def get_current_claims(token: str = Depends(oauth2_scheme)) -> Claims:
+    """
+    FastAPI dependency to get the claims of the bearer token.
+
+    Unlike `get_current_user` it does not load the user, so read-only
+    routes authenticate without a database query. A revoked token is
+    rejected once this process knows the user's new token version (always
+    in the process that revoked it, see `user_cache.revoked`), or else
+    when it expires.
+    """
+    return verify_claims(token)
+
+
+def verify_claims(token: str) -> Claims:
+    """
+    The claims of a valid access token, see `get_current_claims`.
+
+    :raise AuthException: if the token is invalid, expired or revoked
+    """
+    try:
+        claims = _decode_claims(token)
+    except ExpiredSignatureError:
+        raise ExpiredToken()
+    except (JWTError, ValidationError, ValueError):
+        raise InvalidToken()
+    if user_cache.revoked.is_revoked(claims.id, claims.ver):
+        raise InvalidToken()
+    user = user_cache.users.get(claims.id)
+    if user is not None and user.token_version != claims.ver:
+        raise InvalidToken()
+    return claims
+
+
 
 # @auth_router.post("/registration", 
 #                     status_code = 201,
@@ -172,92 +255,186 @@ def get_current_user(
 #             raise UserExisted(entity_name= "User", entity_field="email",entity_value= registration.email)
 
 @auth_router.post("/registration", response_model=User)
-def register_new_user(
+async def register_new_user(
     registration: UserRegistration,
     # session: Session = Depends(db.get_session),
-    session: Annotated[Session, Depends(db.get_session)],
+    session: Annotated[AsyncSession, Depends(db.get_session)],
 ):
     """Register new user."""
 
     for field in ["username", "email"]:
         if (
-            session.exec(
+            (await session.exec(
                 select(UserInDB.id).where(
                     getattr(UserInDB, field) == getattr(registration, field)
                 )
-            ).first()
+            )).first()
         ):
             raise DuplicateValueException(
                 field=field,
                 value=getattr(registration, field),
             )
+    # give the connection back to the pool while bcrypt runs
+    await session.commit()
 
-    hashed_password = _hash_password(registration.password)
+    # bcrypt is deliberately slow, keep it off the event loop
+    hashed_password = await passwords.executor.submit(
+        "hash", _hash_password, registration.password,
+    )
     user = UserInDB(
         **registration.model_dump(),
         hashed_password=hashed_password,
     )
     session.add(user)
-    session.commit()
-    session.refresh(user)
+    await session.commit()
     return user
 
 @auth_router.post("/token", response_model=AccessToken)
-def get_access_token(
+async def get_access_token(
     form: OAuth2PasswordRequestForm = Depends(),
-    session: Session = Depends(db.get_session),
+    session: AsyncSession = Depends(db.get_session),
 ):
     """Get access token for user."""
-    user = _get_authenticated_user(session, form)
+    user = await _get_authenticated_user(session, form)
+    return _build_access_token(user)
+
+
+@auth_router.post("/refresh", response_model=AccessToken)
+async def refresh_access_token(
+    refresh: RefreshRequest,
+    session: AsyncSession = Depends(db.get_session),
+):
+    """Exchange a refresh token for a new access and refresh token."""
+    try:
+        claims = _decode_claims(refresh.refresh_token, typ="refresh")
+    except ExpiredSignatureError:
+        raise ExpiredToken()
+    except (JWTError, ValidationError, ValueError):
+        raise InvalidToken()
+
+    # the primary, so that a revocation is seen right away
+    user = await session.get(UserInDB, claims.id)
+    if user is None or user.token_version != claims.ver:
+        raise InvalidToken()
     return _build_access_token(user)
 
 
-def _get_authenticated_user(
-    session: Session,
+@auth_router.post("/revoke", status_code=204)
+async def revoke_tokens(
+    current_user: UserInDB = Depends(get_current_user),
+    session: AsyncSession = Depends(db.get_session),
+) -> None:
+    """Revoke every access and refresh token issued to the current user."""
+    user = await db.revoke_tokens(session, current_user.id)
+    _remember_revocation(user)
+    logger.info("tokens revoked", extra={"user_id": current_user.id})
+
+
+async def _get_authenticated_user(
+    session: AsyncSession,
     form: OAuth2PasswordRequestForm,
 ) -> UserInDB:
-    user = session.exec(
+    user = (await session.exec(
         select(UserInDB).where(UserInDB.username == form.username)
-    ).first()
-    print(user)
+    )).first()
 
-    if user is None or not pwd_context.verify(form.password, user.hashed_password):
+    if user is None:
+        logger.info("login failed")
         raise InvalidCredentials()
+    # give the connection back to the pool while bcrypt runs, only a
+    # rehash needs it again
+    await session.commit()
+
+    valid, new_hash = await passwords.executor.submit(
+        "verify", pwd_context.verify_and_update, form.password, user.hashed_password,
+    )
+    if not valid:
+        logger.info("login failed")
+        raise InvalidCredentials()
+
+    if new_hash is not None:
+        # hashed with another cost (BCRYPT_ROUNDS changed); the plain
+        # password is only available now, so upgrade it in place
+        user.hashed_password = new_hash
+        session.add(user)
+        await session.commit()
+        user_cache.invalidate_user(user.id)
+        logger.info("password rehashed", extra={"user_id": user.id})
 
+    logger.info("login", extra={"user_id": user.id})
     return user
 
 
 def _build_access_token(user: UserInDB) -> AccessToken:
-    expiration = int(datetime.now(timezone.utc).timestamp()) + access_token_duration
-    claims = Claims(sub=str(user.id), exp=expiration)
-    access_token = jwt.encode(claims.model_dump(), key=jwt_key, algorithm=jwt_alg)
+    now = int(datetime.now(timezone.utc).timestamp())
+
+    def encode(typ: str, duration: int) -> str:
+        claims = Claims(
+            sub=str(user.id),
+            exp=now + duration,
+            username=user.username,
+            ver=user.token_version,
+            typ=typ,
+        )
+        return jwt.encode(claims.model_dump(), key=jwt_key, algorithm=jwt_alg)
 
     return AccessToken(
-        access_token=access_token,
+        access_token=encode("access", access_token_duration),
         token_type="Bearer",
         expires_in=access_token_duration,
+        refresh_token=encode("refresh", refresh_token_duration),
     )
 
 
-def _decode_access_token(session: Session, token: str) -> UserInDB:
+def _remember_revocation(user: UserInDB):
+    # until every access token issued before the revocation has expired
+    user_cache.revoked.revoke(user.id, user.token_version, access_token_duration)
+
+
+def _decode_claims(token: str, typ: str = "access") -> Claims:
+    claims = user_cache.claims.get(token)
+    if claims is None:
+        claims = Claims(**jwt.decode(token, key=jwt_key, algorithms=[jwt_alg]))
+        # never outlive the token itself
+        user_cache.claims.set(token, claims, ttl=claims.exp - time.time())
+    elif claims.exp <= time.time():
+        raise ExpiredSignatureError()
+    if claims.typ != typ:
+        raise JWTError(f"expected a {typ} token")
+    return claims
+
+
+async def _decode_access_token(session: AsyncSession, token: str) -> UserInDB:
     try:
-        claims_dict = jwt.decode(token, key=jwt_key, algorithms=[jwt_alg])
-        claims = Claims(**claims_dict)
-        user_id = claims.sub
-        user = session.get(UserInDB, user_id)
+        claims = _decode_claims(token)
+        user_id = claims.id
+        user = user_cache.users.get(user_id)
+        if user is not None:
+            if user.token_version != claims.ver:
+                raise InvalidToken()
+            return user
+
+        user = await session.get(UserInDB, user_id)
+        if user is None and db.is_replica(session):
+            # a user who just registered may not have reached the replica yet
+            user = await db.get_user_from_primary(user_id)
         if user is None:
             raise InvalidToken()
+        user_cache.users.set(user_id, user)
+        if user.token_version != claims.ver:
+            _remember_revocation(user)
+            raise InvalidToken()
         return user
     except ExpiredSignatureError:
         raise ExpiredToken()
     except JWTError:
         raise InvalidToken()
-    except ValidationError():
+    except (ValidationError, ValueError):
         raise InvalidToken()
 
 def _hash_password(password: str) -> str:
     try:
         return pwd_context.hash(password)
-    except Exception as e:
-        print(f"hashing error: {e}")
+    except Exception:
+        logger.exception("password hashing failed")
         raise InvalidToken()
\ No newline at end of file
@@ -0,0 +1,230 @@
+"""Fill the database with synthetic, production shaped data.
+
+Chat sizes and chat activity follow a Zipf distribution: a few chats are
+large and busy, most are small and quiet. Every user has the password
+"password".
+
+Rows are generated in chunks of ids. Each chunk draws from its own random
+generator, seeded with (seed, table, chunk), so a run is reproducible and
+an interrupted run can be resumed: generation restarts at the chunk holding
+the largest id already in the table and conflicting rows are skipped.
+
+usage:
+    python -m backend.data_generator --users 100000 --chats 20000 --messages 50000000
+"""
+import argparse
+import bisect
+import itertools
+import logging
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from sqlalchemy import func, select
+from sqlalchemy.engine import Engine
+
+from backend import db_seeder
+from backend.reconcile import reconcile
+from backend.schema import ChatInDB, MessageInDB, UserChatLinkInDB, UserInDB
+
+logger = logging.getLogger(__name__)
+
+START = datetime(2024, 1, 1)
+
+_words = (
+    "the a to and of in is it you that for on are with was this be have not "
+    "at but we so they can what all if do just one about get like know when "
+    "up out chat message pony express meet today tomorrow lunch coffee code "
+    "deploy review test bug fix ship release plan idea thanks great sounds "
+    "good maybe later weekend project meeting call update question answer"
+).split()
+
+
+@dataclass
+class Shape:
+    users: int = 1000
+    chats: int = 200
+    messages: int = 100_000
+    max_chat_size: int = 200
+    # exponent of the Zipf distributions, larger is more skewed
+    zipf: float = 1.1
+    message_interval_seconds: float = 10.0
+    seed: int = 0
+    chunk_size: int = 10_000
+
+
+def _rng(shape: Shape, table: str, chunk: int) -> random.Random:
+    return random.Random(f"{shape.seed}:{table}:{chunk}")
+
+
+def _zipf_weight(rank: int, shape: Shape) -> float:
+    return 1 / rank ** shape.zipf
+
+
+def chat_size(shape: Shape, chat_id: int) -> int:
+    """Members of a chat; chat 1 is the largest."""
+    size = round(shape.max_chat_size * _zipf_weight(chat_id, shape))
+    return max(2, min(size, shape.users))
+
+
+def chat_members(shape: Shape, chat_id: int) -> list[int]:
+    """The member ids of a chat, the owner first."""
+    return _chat_members(shape.seed, shape.users, chat_size(shape, chat_id), chat_id)
+
+
+@lru_cache(maxsize=100_000)
+def _chat_members(seed: int, users: int, size: int, chat_id: int) -> list[int]:
+    rng = random.Random(f"{seed}:members:{chat_id}")
+    return rng.sample(range(1, users + 1), size)
+
+
+def _users(shape: Shape, ids: range, rng: random.Random, password_hash: str):
+    for user_id in ids:
+        yield {
+            "id": user_id,
+            "username": f"user{user_id}",
+            "email": f"user{user_id}@example.com",
+            "hashed_password": password_hash,
+            "created_at": START - timedelta(days=rng.randint(1, 365)),
+        }
+
+
+def _chats(shape: Shape, ids: range, rng: random.Random):
+    for chat_id in ids:
+        yield {
+            "id": chat_id,
+            "name": f"chat {chat_id}",
+            "owner_id": chat_members(shape, chat_id)[0],
+            "created_at": START - timedelta(minutes=rng.randint(1, 60 * 24 * 30)),
+        }
+
+
+def _links(shape: Shape, chat_ids: range, _rng: random.Random):
+    for chat_id in chat_ids:
+        for user_id in chat_members(shape, chat_id):
+            yield {"user_id": user_id, "chat_id": chat_id}
+
+
+def _messages(shape: Shape, ids: range, rng: random.Random, cum_weights: list[float]):
+    for message_id in ids:
+        chat_id = bisect.bisect(cum_weights, rng.random() * cum_weights[-1]) + 1
+        words = rng.choices(_words, k=rng.randint(1, 30))
+        yield {
+            "id": message_id,
+            "text": " ".join(words),
+            "user_id": rng.choice(chat_members(shape, chat_id)),
+            "chat_id": chat_id,
+            "created_at": START + timedelta(
+                seconds=message_id * shape.message_interval_seconds
+            ),
+        }
+
+
+def _resume_from(engine: Engine, column) -> int:
+    with engine.connect() as conn:
+        return conn.scalar(select(func.coalesce(func.max(column), 0)))
+
+
+def _count(engine: Engine, table) -> int:
+    with engine.connect() as conn:
+        return conn.scalar(select(func.count()).select_from(table))
+
+
+def _fill(engine: Engine, shape: Shape, table, key, total: int, rows) -> int:
+    """
+    Insert rows with ids 1..total in chunks, starting at the last filled chunk.
+
+    :param key: the id column, used to find where a previous run stopped
+    :param rows: `rows(ids, rng)` generates the rows of a chunk
+    :return: the number of rows inserted
+    """
+    insert = db_seeder.insert_ignoring_conflicts(engine, table)
+    first_chunk = max(_resume_from(engine, key) - 1, 0) // shape.chunk_size
+    chunks = range(first_chunk, (total + shape.chunk_size - 1) // shape.chunk_size)
+    prev = _count(engine, table)
+
+    start = time.perf_counter()
+    generated = 0
+    for chunk in chunks:
+        ids = range(
+            chunk * shape.chunk_size + 1,
+            min((chunk + 1) * shape.chunk_size, total) + 1,
+        )
+        batch = list(rows(ids, _rng(shape, table.name, chunk)))
+        with engine.begin() as conn:
+            conn.execute(insert, batch)
+        generated += len(batch)
+        logger.info(
+            "%s: %d/%d, %.0f rows/s",
+            table.name, ids[-1], total, generated / (time.perf_counter() - start),
+        )
+    return _count(engine, table) - prev
+
+
+def generate(engine: Engine, shape: Shape) -> dict[str, int]:
+    """
+    Generate the data described by `shape`, continuing a previous run.
+
+    :return: the number of rows inserted per table
+    """
+    from backend.auth import pwd_context
+
+    password_hash = pwd_context.hash("password")
+    weights = [_zipf_weight(rank, shape) for rank in range(1, shape.chats + 1)]
+    cum_weights = list(itertools.accumulate(weights))
+
+    inserted = {
+        "users": _fill(
+            engine, shape, UserInDB.__table__, UserInDB.id, shape.users,
+            lambda ids, rng: _users(shape, ids, rng, password_hash),
+        ),
+        "chats": _fill(
+            engine, shape, ChatInDB.__table__, ChatInDB.id, shape.chats,
+            lambda ids, rng: _chats(shape, ids, rng),
+        ),
+        "user_chat_links": _fill(
+            engine, shape, UserChatLinkInDB.__table__, UserChatLinkInDB.chat_id,
+            shape.chats, lambda ids, rng: _links(shape, ids, rng),
+        ),
+        "messages": _fill(
+            engine, shape, MessageInDB.__table__, MessageInDB.id, shape.messages,
+            lambda ids, rng: _messages(shape, ids, rng, cum_weights),
+        ),
+    }
+    db_seeder.reset_sequences(engine)
+    reconcile(engine)
+    return inserted
+
+
+def main(argv: list[str] = None):
+    from backend.database import create_db_and_tables, engine
+
+    defaults = Shape()
+    parser = argparse.ArgumentParser(prog="python -m backend.data_generator")
+    parser.add_argument("--users", type=int, default=defaults.users)
+    parser.add_argument("--chats", type=int, default=defaults.chats)
+    parser.add_argument("--messages", type=int, default=defaults.messages)
+    parser.add_argument("--max-chat-size", type=int, default=defaults.max_chat_size)
+    parser.add_argument("--zipf", type=float, default=defaults.zipf)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--chunk-size", type=int, default=defaults.chunk_size)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    create_db_and_tables()
+    shape = Shape(
+        users=args.users,
+        chats=args.chats,
+        messages=args.messages,
+        max_chat_size=args.max_chat_size,
+        zipf=args.zipf,
+        seed=args.seed,
+        chunk_size=args.chunk_size,
+    )
+    print(generate(engine, shape))
+
+
+if __name__ == "__main__":
+    main()
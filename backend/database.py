@@ -1,10 +1,33 @@
 import os
+import base64
+import re
+import itertools
+from typing import Literal
+from sqlalchemy import (
+    column,
+    delete,
+    func,
+    insert,
+    literal_column,
+    table,
+    text,
+    tuple_,
+    update,
+)
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlmodel import Session, SQLModel, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 import json
 from datetime import date
 import datetime
 from uuid import uuid4
+from fastapi import Depends
+from starlette.requests import HTTPConnection
+
+from backend import live, migrations, pool, query_stats, replicas, sqlite, user_cache
 from backend.schema import(
     User,
     UserInDB,
@@ -13,6 +36,7 @@ from backend.schema import(
     MessageInDB,
     ChatUpdate,
     UserUpdate,
+    Message,
     MessageCreate,
     MessageResponse,
     MessageUpdate,
@@ -20,44 +44,158 @@ from backend.schema import(
     MessageInDB
 )
 
-def get_db_url():
+def get_db_url(async_driver: bool = False):
+    """
+    Build the database url.
+
+    :param async_driver: use asyncpg/aiosqlite instead of the blocking drivers
+    """
     if os.environ.get("DB_LOCATION") == "RDS":
         username = os.environ.get("PG_USERNAME")
         password = os.environ.get("PG_PASSWORD")
         endpoint = os.environ.get("PG_ENDPOINT")
         port = os.environ.get("PG_PORT")
-        db_url = f"postgresql://{username}:{password}@{endpoint}:{port}/{username}"
-        echo = False
-        connect_args = {}
+        driver = "postgresql+asyncpg" if async_driver else "postgresql"
+        db_url = f"{driver}://{username}:{password}@{endpoint}:{port}/{username}"
         return db_url
     else:
-        db_url = "sqlite:///backend/pony_express.db"
-        echo = True
-        connect_args = {"check_same_thread": False}
+        driver = "sqlite+aiosqlite" if async_driver else "sqlite"
+        db_url = f"{driver}:///backend/pony_express.db"
         return db_url
 
 
-def get_engine():
-    db_url = get_db_url()
+def _engine_options(async_engine: bool = False, pool_mode: str = None):
     echo = os.environ.get("DB_DEBUG", default="False").lower() in ("true", "1", "t")
     if os.environ.get("DB_LOCATION") == "RDS":
         connect_args = {}
     else:
         connect_args = {"check_same_thread": False}
+    return {
+        "echo": echo,
+        "connect_args": connect_args,
+        **pool.pool_options(async_engine, pool_mode),
+    }
+
 
-    return create_engine(db_url, echo=echo, connect_args=connect_args)
+def _sqlite_tuned() -> bool:
+    return os.environ.get("DB_LOCATION") != "RDS" and sqlite.tuned()
+
+
+def get_engine(pool_mode: str = None):
+    """
+    Blocking engine for migrations, seeding and other command line tools.
+
+    :param pool_mode: overrides DB_POOL_MODE, see backend/pool.py
+    """
+    engine = create_engine(get_db_url(), **_engine_options(pool_mode=pool_mode))
+    if _sqlite_tuned():
+        sqlite.install(engine)
+    return engine
+
+
+def get_async_engine(read_only: bool = False, url: str = None):
+    """
+    Engine used by the request handlers.
+
+    :param read_only: build the reader pool of the tuned SQLite mode
+    :param url: database url, defaults to the primary
+    """
+    options = _engine_options(async_engine=True)
+    if _sqlite_tuned():
+        options["poolclass"] = pool.TimedAsyncAdaptedQueuePool
+        if read_only:
+            options.update(sqlite.reader_pool_options())
+        else:
+            options.update(sqlite.writer_pool_options())
+
+    engine = create_async_engine(url or get_db_url(async_driver=True), **options)
+    if _sqlite_tuned():
+        sqlite.install(engine.sync_engine)
+    return engine
 
 
 engine = get_engine()
+async_engine = get_async_engine()
+# only the tuned SQLite mode separates readers from the single writer
+read_engine = get_async_engine(read_only=True) if _sqlite_tuned() else async_engine
+replica_engines = [
+    get_async_engine(url=url) for url in replicas.replica_urls(async_driver=True)
+]
+write_pins = replicas.WritePins(replicas.pin_seconds())
+for _engine in (engine, async_engine.sync_engine, read_engine.sync_engine,
+                *(replica.sync_engine for replica in replica_engines)):
+    query_stats.install(_engine)
+_next_replica = itertools.count()
+
+
+def pool_status() -> dict:
+    """Occupancy and checkout wait times of the connection pools."""
+    status = {
+        "async": pool.pool_status(async_engine.pool),
+        "sync": pool.pool_status(engine.pool),
+    }
+    if read_engine is not async_engine:
+        status["read"] = pool.pool_status(read_engine.pool)
+    for i, replica in enumerate(replica_engines):
+        status[f"replica_{i}"] = pool.pool_status(replica.pool)
+    return status
 
 
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+    """Bring the database schema up to date, see backend/migrations.py."""
+    migrations.upgrade(engine)
+
+
+async def get_session(request: HTTPConnection):
+    # objects stay usable after commit, so write paths can return what they
+    # just wrote without a refresh round trip
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
+    # WebSockets (no method) do not write
+    method = request.scope.get("method")
+    if replica_engines and method not in (None, "GET", "HEAD", "OPTIONS"):
+        user_id = replicas.request_user_id(request)
+        if user_id is not None:
+            write_pins.pin(user_id)
+
 
+def _read_engine_for(request: HTTPConnection):
+    """Pick a replica, unless the requesting user has just written."""
+    if not replica_engines:
+        return read_engine
+    user_id = replicas.request_user_id(request)
+    if user_id is not None and write_pins.is_pinned(user_id):
+        return async_engine
+    return replica_engines[next(_next_replica) % len(replica_engines)]
+
+
+async def get_read_session(request: HTTPConnection,
+                           write_session: AsyncSession = Depends(get_session)):
+    """
+    Session for handlers that do not write, served by a replica if any.
 
-def get_session():
-    with Session(engine) as session:
+    Without a separate read engine this is the request's `get_session`, so
+    a write route that also authenticates with a read session holds one
+    connection, not two (a lambda mode pool has only one). Sessions connect
+    on their first query, so the unused one costs nothing.
+    """
+    engine = _read_engine_for(request)
+    if engine is async_engine:
+        yield write_session
+        return
+    async with AsyncSession(engine, expire_on_commit=False) as session:
         yield session
+
+
+def is_replica(session: AsyncSession) -> bool:
+    return session.bind in replica_engines
+
+
+async def get_user_from_primary(user_id: int) -> UserInDB:
+    """Look a user up on the primary, e.g. when a replica has not caught up."""
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        return await session.get(UserInDB, user_id)
 from fastapi import FastAPI, Response, status, HTTPException
 
 class EntityNotFoundException(Exception): 
@@ -71,12 +209,76 @@ class IDAlreadyExisted(Exception):
         self.entity_name = entity_name
         self.entity_id = entity_id
 
+# ---------------sorting-------------
+
+SortOrder = Literal["asc", "desc"]
+
+
+def _sorted(query, model, sort: str, order: SortOrder = "asc"):
+    """
+    Add an ORDER BY on `sort` to the query, breaking ties by id.
+
+    :param model: the table model the sort field belongs to
+    :param sort: name of the column to sort by
+    :param order: "asc" or "desc"
+    :return: the ordered query
+    """
+    columns = [getattr(model, sort)]
+    if sort != "id":
+        columns.append(model.id)
+    if order == "desc":
+        columns = [column.desc() for column in columns]
+    return query.order_by(*columns)
+
+
+def users_query(sort: str = "id", order: SortOrder = "asc"):
+    """Query for all users, ordered in SQL."""
+    return _sorted(select(UserInDB), UserInDB, sort, order)
+
+
+def chats_query(user_id: int, sort: str = "name", order: SortOrder = "asc"):
+    """Query for the chats a user is a member of, ordered in SQL."""
+    query = (
+        select(ChatInDB)
+        .join(UserChatLinkInDB, UserChatLinkInDB.chat_id == ChatInDB.id)
+        .where(UserChatLinkInDB.user_id == user_id)
+        .options(selectinload(ChatInDB.owner))
+    )
+    return _sorted(query, ChatInDB, sort, order)
+
+
+def chat_messages_query(chat_id: int, sort: str = "id", order: SortOrder = "asc"):
+    """Query for the messages of a chat, ordered in SQL."""
+    query = (
+        select(MessageInDB)
+        .where(MessageInDB.chat_id == chat_id)
+        .options(selectinload(MessageInDB.user))
+    )
+    return _sorted(query, MessageInDB, sort, order)
+
+
+def chat_users_query(chat_id: int, sort: str = "id", order: SortOrder = "asc"):
+    """Query for the members of a chat, ordered in SQL."""
+    query = (
+        select(UserInDB)
+        .join(UserChatLinkInDB, UserChatLinkInDB.user_id == UserInDB.id)
+        .where(UserChatLinkInDB.chat_id == chat_id)
+    )
+    if sort == "id":
+        # the same order, read from the (chat_id, user_id) index of the links
+        user_id = UserChatLinkInDB.user_id
+        return query.order_by(user_id.desc() if order == "desc" else user_id)
+    return _sorted(query, UserInDB, sort, order)
+
+
 # ---------------users-------------
 
-def get_all_users(session: Session) -> list[UserInDB]:
-    return session.exec(select(UserInDB)).all()
+async def get_all_users(session: AsyncSession,
+                        sort: str = "id",
+                        order: SortOrder = "asc") -> list[UserInDB]:
+    return (await session.exec(users_query(sort, order))).all()
 
-def create_user(session: Session ,user_create: UserCreate) -> User:
+async def create_user(session: AsyncSession ,user_create: UserCreate) -> User:
     """Create a new user in the databse.
         Args:
         user_create (UserCreate): _description_
@@ -86,12 +288,12 @@ def create_user(session: Session ,user_create: UserCreate) -> User:
     """
     user = User(**user_create.model_dump())
     session.add(user)
-    session.commit()
-    session.refresh(user)
+    await session.commit()
+    await session.refresh(user)
     return user
     
 
-def get_user_by_id(session: Session, user_id: int) -> UserInDB:
+async def get_user_by_id(session: AsyncSession, user_id: int) -> UserInDB:
     """
     Retrieve a user from the database.
     
@@ -99,13 +301,13 @@ def get_user_by_id(session: Session, user_id: int) -> UserInDB:
     :return: the retrieved user
     """
     
-    user = session.get(UserInDB, user_id)
+    user = await session.get(UserInDB, user_id)
     if user:
         return user
     raise EntityNotFoundException(entity_name="User", entity_id=user_id)
 
 
-def delete_user(session: Session, user_id: int):
+async def delete_user(session: AsyncSession, user_id: int):
     """
     Delete a user from the database.
     
@@ -113,28 +315,41 @@ def delete_user(session: Session, user_id: int):
     :raise entityNotFoundEException: if no such user exists
     """
     
-    user = get_user_by_id(session, user_id)
-    session.delete(user)
-    session.commit()
+    user = await get_user_by_id(session, user_id)
+    await session.delete(user)
+    await session.commit()
+    user_cache.invalidate_user(user_id)
 
-def get_all_chats(session: Session, current_user: User) -> list[ChatInDB]:
+async def get_all_chats(session: AsyncSession,
+                        current_user: User,
+                        sort: str = "name",
+                        order: SortOrder = "asc") -> list[ChatInDB]:
     """
     Retrieve all chats from the database that current user is included.
     
+    :param sort: field to sort the chats by
+    :param order: "asc" or "desc"
     :return: list of chats
     """
     
-    # chat = session.exec(select(ChatInDB).where(UserChatLinkInDB.chat_id == ChatInDB.id).where(UserChatLinkInDB.user_id == current_user.id)).all()
-    
+    return (await session.exec(chats_query(current_user.id, sort, order))).all()
 
-    print("\n\n\n")
-    print(current_user)
-    print("\n\n\n")
-    
-    
-    return session.exec(select(ChatInDB).where(UserChatLinkInDB.chat_id == ChatInDB.id).where(UserChatLinkInDB.user_id == current_user.id)).all()
 
-def get_chat_by_id(session: Session, chat_id: int, current_user: User)-> ChatInDB:
+async def get_chats_by_user_id(session: AsyncSession,
+                               user_id: int,
+                               sort: str = "name",
+                               order: SortOrder = "asc") -> list[ChatInDB]:
+    """
+    Retrieve the chats of a user.
+
+    :param user_id: id of the user whose chats are retrieved
+    :raise EntityNotFoundException: if no such user exists
+    :return: list of chats
+    """
+    await get_user_by_id(session, user_id)
+    return (await session.exec(chats_query(user_id, sort, order))).all()
+
+async def get_chat_by_id(session: AsyncSession, chat_id: int, current_user: User)-> ChatInDB:
     """
     Retrieve a chat from the database.
     
@@ -144,30 +359,37 @@ def get_chat_by_id(session: Session, chat_id: int, current_user: User)-> ChatInD
     
     # chat = session.exec(select(ChatInDB).where(UserChatLinkInDB.chat_id == ChatInDB.id).where(UserChatLinkInDB.user_id == current_user.id)).all()
     # chat = session.exec(select(UserChatLinkInDB).where((UserChatLinkInDB.chat_id == chat_id) & (UserChatLinkInDB.user_id == current_user.id) )).first()
-    user_in_chat_view(session, chat_id, current_user)
+    await user_in_chat_view(session, chat_id, current_user)
+    return await _get_chat(session, chat_id)
 
-    chat = session.exec(select(ChatInDB).where(ChatInDB.id == chat_id)).first()
+
+async def _get_chat(session: AsyncSession, chat_id: int) -> ChatInDB:
+    """Retrieve a chat with its owner, without a membership check."""
+    chat = (await session.exec(
+        select(ChatInDB)
+        .where(ChatInDB.id == chat_id)
+        .options(joinedload(ChatInDB.owner))
+    )).first()
     if chat:
         return chat
-    else:
-        raise EntityNotFoundException(entity_name="Chat", entity_id= chat_id)
+    raise EntityNotFoundException(entity_name="Chat", entity_id=chat_id)
 
 
-def get_message_by_id(session: Session, message_id: int)-> MessageInDB : 
+async def get_message_by_id(session: AsyncSession, message_id: int)-> MessageInDB : 
     """
     Retrieve a chat from the database.
     
     :param chat_id: id of the chat to be retrieved
     :return: the retrieved chat
     """
-    message = session.get(MessageInDB, message_id)
+    message = await session.get(MessageInDB, message_id)
     if message:
         return message
     raise EntityNotFoundException(entity_name="message", entity_id= message_id)
 
-def chat_name_update(session: Session,
-                     chat_id: int,
-                     chat_update: ChatUpdate ) ->ChatInDB :
+async def chat_name_update(session: AsyncSession,
+                           chat_id: int,
+                           chat_update: ChatUpdate ) ->ChatInDB :
     """
     Update a chat in the database.
     
@@ -176,21 +398,20 @@ def chat_name_update(session: Session,
     :return: the updated chat
     """
     
-    chat = get_chat_by_id(session, chat_id)
+    chat = await _get_chat(session, chat_id)
     for attr, value in chat_update.model_dump(exclude_unset=True).items():
         setattr(chat, attr, value)
 
     session.add(chat)
-    session.commit()
-    session.refresh(chat)
+    await session.commit()
 
     return chat
 
 
 
-def user_update(session: Session,
-                     user: UserInDB,
-                     user_update: UserUpdate ) ->UserInDB :
+async def user_update(session: AsyncSession,
+                           user: UserInDB,
+                           user_update: UserUpdate ) ->UserInDB :
     """
     Update a chat in the database.
     
@@ -199,145 +420,495 @@ def user_update(session: Session,
     :return: the updated chat
     """
     
+    # the caller's user may have been loaded by another (read) session
+    user = await get_user_by_id(session, user.id)
     for attr, value in user_update.model_dump(exclude_unset=True).items():
         setattr(user, attr, value)
 
     session.add(user)
-    session.commit()
-    session.refresh(user)
+    await session.commit()
+    user_cache.invalidate_user(user.id)
+    return user
+
+async def revoke_tokens(session: AsyncSession, user_id: int) -> UserInDB:
+    """
+    Invalidate every token issued to a user by bumping its token version.
+
+    :param user_id: id of the user whose tokens are revoked
+    :return: the updated user
+    """
+
+    user = await get_user_by_id(session, user_id)
+    user.token_version += 1
+    session.add(user)
+    await session.commit()
+    # keep the new version cached, so that this process rejects the old
+    # tokens even on routes that authenticate from the claims alone
+    user_cache.users.set(user.id, user)
     return user
 
-def chat_delete(session: Session, chat_id: int):
+async def chat_delete(session: AsyncSession, chat_id: int):
     """
     Delete a chat in the database.
     
     :parama chat_id: id of the chat to be deleted
     :return: none
     """
-    chat = get_chat_by_id(session, chat_id)
-    session.delete(chat)
-    session.commit()
-    
-def get_messages_by_chat_id(session: Session, chat_id: int) -> list[MessageInDB]:
-    
-    chat = session.exec(select(ChatInDB).where(ChatInDB.id == chat_id)).first()
-    
-    if chat:
-        return chat.messages
-    raise EntityNotFoundException(entity_name="Chat", entity_id=chat_id)
-    
-def get_users_by_chat_id(session: Session, chat_id: int) -> list[UserInDB]:
-    
-    chat = session.exec(select(ChatInDB).where(ChatInDB.id == chat_id)).first()
+    chat = await _get_chat(session, chat_id)
+    await session.delete(chat)
+    await session.commit()
+    
+async def get_messages_by_chat_id(session: AsyncSession,
+                                  chat_id: int,
+                                  sort: str = "id",
+                                  order: SortOrder = "asc") -> list[MessageInDB]:
+    """
+    Retrieve the messages of a chat that is known to exist.
+
+    :param chat_id: id of the chat
+    :param sort: field to sort the messages by
+    :param order: "asc" or "desc"
+    :return: list of messages
+    """
+    return (await session.exec(chat_messages_query(chat_id, sort, order))).all()
     
-    if chat:
-        return chat.users
-    raise EntityNotFoundException(entity_name="Chat", entity_id=chat_id)
+async def get_users_by_chat_id(session: AsyncSession,
+                               chat_id: int,
+                               sort: str = "id",
+                               order: SortOrder = "asc") -> list[UserInDB]:
+    """
+    Retrieve the members of a chat that is known to exist.
+
+    :param chat_id: id of the chat
+    :param sort: field to sort the users by
+    :param order: "asc" or "desc"
+    :return: list of users
+    """
+    return (await session.exec(chat_users_query(chat_id, sort, order))).all()
 
 
-def create_message(session: Session, 
-                   chat_id: int,
-                   message_create: MessageCreate,
-                   current_user: User ) -> MessageInDB:
-    
-    is_valid = user_in_chat_view(session, chat_id, current_user)
-    existed_chat = session.exec(select(ChatInDB).where(ChatInDB.id ==chat_id)).first()
-    if existed_chat:    
-        new_message = MessageInDB(
-            text=message_create.text,
-            user_id=current_user.id,
-            chat_id=chat_id,
-            user=current_user,
-            chat=existed_chat  
+def _encode_cursor(message: MessageInDB) -> str:
+    raw = f"{message.created_at.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime.datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, message_id = raw.rsplit("|", 1)
+        return datetime.datetime.fromisoformat(created_at), int(message_id)
+    except ValueError:
+        raise InvalidCursor(cursor)
+
+
+async def get_messages_page(session: AsyncSession,
+                            chat_id: int,
+                            limit: int,
+                            before: str = None,
+                            after: str = None,
+                            ) -> tuple[list[MessageInDB], str, str]:
+    """
+    Retrieve one page of messages of a chat ordered by (created_at, id).
+
+    The page is selected with a keyset condition and ORDER BY/LIMIT in SQL,
+    so the cost does not depend on how many messages the chat holds.
+    Without a cursor the newest messages are returned.
+
+    :param chat_id: id of the chat whose messages are listed
+    :param limit: maximum number of messages in the page
+    :param before: cursor; only messages older than it are returned
+    :param after: cursor; only messages newer than it are returned
+    :return: the messages in ascending order, the next and the prev cursor
+    """
+    key = tuple_(MessageInDB.created_at, MessageInDB.id)
+    query = (
+        select(MessageInDB)
+        .where(MessageInDB.chat_id == chat_id)
+        .options(selectinload(MessageInDB.user))
+    )
+
+    if after is not None:
+        query = query.where(key > tuple_(*_decode_cursor(after)))
+    if before is not None:
+        query = query.where(key < tuple_(*_decode_cursor(before)))
+
+    # walk away from the cursor, fetching one extra row to learn whether
+    # there is another page in that direction
+    forward = after is not None and before is None
+    if forward:
+        query = query.order_by(MessageInDB.created_at, MessageInDB.id)
+    else:
+        query = query.order_by(MessageInDB.created_at.desc(), MessageInDB.id.desc())
+
+    messages = list((await session.exec(query.limit(limit + 1))).all())
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if not forward:
+        messages.reverse()
+
+    if not messages:
+        return messages, after, before
+
+    # paging forward from a cursor always leaves the cursor row behind us
+    has_older = forward or has_more
+
+    # the next cursor is always handed out so that clients can poll for
+    # messages that arrive after the newest one they have seen
+    next_cursor = _encode_cursor(messages[-1])
+    prev_cursor = _encode_cursor(messages[0]) if has_older else None
+    return messages, next_cursor, prev_cursor
+
+
+_messages_fts = table("messages_fts", column("rowid"), column("rank"), column("messages_fts"))
+
+
+def _fts5_query(q: str) -> str:
+    """Quote every word, so user input cannot use (or break) the FTS5 syntax."""
+    words = re.findall(r"\w+", q)
+    return " ".join(f'"{word}"' for word in words)
+
+
+def _search_condition(session: AsyncSession, q: str):
+    """The match condition and the ORDER BY rank (best first) for a dialect."""
+    if session.bind.dialect.name == "postgresql":
+        document = literal_column(
+            migrations.SEARCH_DOCUMENT.format(column="messages.text")
         )
-        
-        session.add(new_message)
-        session.commit()
-        session.refresh(new_message)
-        return new_message
-    
+        tsquery = func.websearch_to_tsquery("english", q)
+        return document.op("@@")(tsquery), func.ts_rank(document, tsquery).desc()
+
+    return _messages_fts.c.messages_fts.op("MATCH")(_fts5_query(q)), _messages_fts.c.rank
+
+
+async def search_messages(session: AsyncSession,
+                          q: str,
+                          current_user: User,
+                          chat_id: int = None,
+                          limit: int = 50,
+                          offset: int = 0,
+                          ) -> tuple[list[MessageInDB], int]:
+    """
+    Full-text search of message text, best matches first.
+
+    Uses the FTS5 table on SQLite and the GIN expression index on Postgres,
+    see migration 4 in backend/migrations.py.
+
+    :param q: the search terms
+    :param current_user: only chats the user is a member of are searched
+    :param chat_id: restrict the search to one chat
+    :param limit: maximum number of messages returned
+    :param offset: number of matches to skip
+    :return: the messages and the offset of the next page, if there is one
+    """
+    if chat_id is not None:
+        await get_chat_by_id(session, chat_id, current_user)
+        scope = MessageInDB.chat_id == chat_id
     else:
-        raise EntityNotFoundException(entity_name="Chat", entity_id= chat_id)
-    
-def update_message(session: Session,
-                   chat_id: int,
-                   message_id: int,
-                   message_update: MessageUpdate,
-                   current_user: User,
-                   )-> MessageResponse:
-    
+        scope = MessageInDB.chat_id.in_(
+            select(UserChatLinkInDB.chat_id)
+            .where(UserChatLinkInDB.user_id == current_user.id)
+        )
+
+    if session.bind.dialect.name != "postgresql" and not _fts5_query(q):
+        return [], None
+
+    match, rank = _search_condition(session, q)
+    query = (
+        select(MessageInDB)
+        .where(scope, match)
+        .order_by(rank, MessageInDB.id)
+        .options(selectinload(MessageInDB.user))
+        .offset(offset)
+        .limit(limit + 1)
+    )
+    if session.bind.dialect.name != "postgresql":
+        query = query.join(_messages_fts, _messages_fts.c.rowid == MessageInDB.id)
+
+    messages = list((await session.exec(query)).all())
+    next_offset = offset + limit if len(messages) > limit else None
+    return messages[:limit], next_offset
+
+
+def _membership(chat_id: int, user_id: int):
+    """Subquery matching the link of a user to a chat."""
+    return select(UserChatLinkInDB.user_id).where(
+        (UserChatLinkInDB.chat_id == chat_id) & (UserChatLinkInDB.user_id == user_id)
+    )
+
+
+async def _raise_write_error(session: AsyncSession,
+                             chat_id: int,
+                             current_user: User,
+                             message_id: int = None):
     """
-    Update a message in the database.
-    
-    :param chat_id: id of the chat to be updated
-    :param chat_update_name: attributes to be updated on the chat
-    :return: the updated chat
+    Work out why a guarded write matched no row and raise the matching error.
+
+    This only runs on the failure path, so successful writes stay at one
+    statement while clients still get the same 403 and 404 responses.
     """
-    
-    #   chat with chat_id must exist, the message with message_id must exis
-    get_chat_by_id(session, chat_id, current_user)
-    get_message_by_id(session, message_id)
-    
-    #   to check if user is message owner
-    isValid_message = session.exec(select(MessageInDB).where((MessageInDB.user_id == current_user.id) & (MessageInDB.id ==message_id))).first()
-
-    print("\n\n\n")
-
-    if isValid_message:
-        for attr, value in message_update.model_dump(exclude_unset=True).items():
-            setattr(isValid_message, attr, value)
-        session.add(isValid_message)
-        session.commit()
-        session.refresh(isValid_message)
-        return isValid_message
+    chat_exists = select(ChatInDB.id).where(ChatInDB.id == chat_id).exists()
+    message_exists = select(MessageInDB.id).where(
+        (MessageInDB.id == message_id) & (MessageInDB.chat_id == chat_id)
+    ).exists()
+    is_member, has_chat, has_message = (await session.exec(select(
+        _membership(chat_id, current_user.id).exists(),
+        chat_exists,
+        message_exists,
+    ))).one()
+
+    if not is_member:
+        raise InvalidView()
+    if not has_chat:
+        raise EntityNotFoundException(entity_name="Chat", entity_id=chat_id)
+    if message_id is not None and not has_message:
+        raise EntityNotFoundException(entity_name="message", entity_id=message_id)
+
+    # If the access token is valid, but the current user is not the 
+    # user of the message, the response has HTTP status code 403 
+    raise InvalidUser()
+
+
+async def create_message(session: AsyncSession, 
+                         chat_id: int,
+                         message_create: MessageCreate,
+                         current_user: User ) -> MessageInDB:
+    """
+    Create a message in a chat the current user is a member of.
+
+    Bumping the chat's message counter doubles as the permission check:
+    the UPDATE only matches when the chat exists and the user is a member.
+
+    :param chat_id: id of the chat to post in
+    :param message_create: the message to create
+    :return: the created message
+    """
+    bumped = (await session.exec(
+        update(ChatInDB)
+        .where(
+            (ChatInDB.id == chat_id)
+            & _membership(chat_id, current_user.id).exists()
+        )
+        .values(message_count=ChatInDB.message_count + 1)
+        .returning(ChatInDB.id)
+    )).first()
+    if bumped is None:
+        await _raise_write_error(session, chat_id, current_user)
+
+    new_message = MessageInDB(
+        text=message_create.text,
+        user_id=current_user.id,
+        chat_id=chat_id,
+    )
+    session.add(new_message)
+    await session.commit()
+    # the author is the caller; attach it without a lazy load
+    set_committed_value(new_message, "user", current_user)
+    _publish(chat_id, "message.created", new_message)
+    return new_message
+    
+# batches at least this large are streamed with COPY on Postgres
+COPY_THRESHOLD = 1000
+
+
+async def create_messages(session: AsyncSession,
+                          chat_id: int,
+                          message_creates: list[MessageCreate],
+                          current_user: User) -> list[MessageInDB]:
+    """
+    Create many messages in a chat in one transaction.
+
+    Membership is checked once by the guarded counter update, as in
+    create_message. The rows are written with multi-row INSERT ... RETURNING
+    statements, or with COPY on Postgres for large batches.
+
+    :param chat_id: id of the chat to post in
+    :param message_creates: the messages to create, in order
+    :return: the created messages, in the order they were given
+    """
+    bumped = (await session.exec(
+        update(ChatInDB)
+        .where(
+            (ChatInDB.id == chat_id)
+            & _membership(chat_id, current_user.id).exists()
+        )
+        .values(message_count=ChatInDB.message_count + len(message_creates))
+        .returning(ChatInDB.id)
+    )).first()
+    if bumped is None:
+        await _raise_write_error(session, chat_id, current_user)
+
+    now = datetime.datetime.now()
+    rows = [
+        {"text": message.text, "user_id": current_user.id,
+         "chat_id": chat_id, "created_at": now}
+        for message in message_creates
+    ]
+    if session.bind.dialect.name == "postgresql" and len(rows) >= COPY_THRESHOLD:
+        messages = await _copy_messages(session, rows)
     else:
-        
-        #If the access token is valid, but the current user is not the 
-        # user of the message, the response has HTTP status code 403 
-        # and the body has the following format.
-        
-        raise InvalidUser()
-    
-def delete_message(session: Session,
-                   chat_id: int,
-                   message_id: int,
-                   current_user: User):
+        result = await session.exec(
+            insert(MessageInDB).returning(MessageInDB), params=rows,
+        )
+        # ids are handed out in VALUES order, RETURNING order is unspecified
+        messages = sorted(result.scalars(), key=lambda message: message.id)
+    await session.commit()
+
+    for message in messages:
+        set_committed_value(message, "user", current_user)
+    # one event for the batch: an event per message would overflow the send
+    # queue of every connection (LIVE_QUEUE_SIZE) and drop them all
+    _publish(chat_id, "messages.created", messages)
+    return messages
+
+
+async def _copy_messages(session: AsyncSession, rows: list[dict]) -> list[MessageInDB]:
+    """Write rows with COPY, taking their ids from the sequence up front."""
+    ids = (await session.exec(
+        select(func.nextval(func.pg_get_serial_sequence("messages", "id")))
+        .select_from(func.generate_series(1, len(rows)))
+    )).all()
+
+    columns = ["id", "text", "user_id", "chat_id", "created_at"]
+    records = [
+        (message_id, row["text"], row["user_id"], row["chat_id"], row["created_at"])
+        for message_id, row in zip(ids, rows)
+    ]
+    # COPY runs on the session's connection, inside its transaction
+    connection = await (await session.connection()).get_raw_connection()
+    await connection.driver_connection.copy_records_to_table(
+        "messages", records=records, columns=columns,
+    )
+    return [MessageInDB(**dict(zip(columns, record))) for record in records]
+
+
+async def update_message(session: AsyncSession,
+                         chat_id: int,
+                         message_id: int,
+                         message_update: MessageUpdate,
+                         current_user: User,
+                         )-> MessageInDB:
     
-    #   to check if chat is exisiting
-    chat = get_chat_by_id(session,chat_id, current_user)
-    #   to check if emssage is exisiting
-    message = get_message_by_id(session, message_id)
+    """
+    Update a message in the database.
+
+    The ownership, chat and membership checks are part of the UPDATE itself.
     
-    isValid_message = session.exec(select(MessageInDB).where((MessageInDB.user_id == current_user.id) & (MessageInDB.id ==message_id))).first()
+    :param chat_id: id of the chat the message belongs to
+    :param message_id: id of the message to be updated
+    :param message_update: attributes to be updated on the message
+    :return: the updated message
+    """
+    message = (await session.exec(
+        update(MessageInDB)
+        .where(
+            (MessageInDB.id == message_id)
+            & (MessageInDB.chat_id == chat_id)
+            & (MessageInDB.user_id == current_user.id)
+            & _membership(chat_id, current_user.id).exists()
+        )
+        .values(**message_update.model_dump(exclude_unset=True))
+        .returning(MessageInDB)
+    )).scalar_one_or_none()
+    if message is None:
+        await _raise_write_error(session, chat_id, current_user, message_id)
+
+    await session.commit()
+    set_committed_value(message, "user", current_user)
+    _publish(chat_id, "message.updated", message)
+    return message
+    
+async def delete_message(session: AsyncSession,
+                         chat_id: int,
+                         message_id: int,
+                         current_user: User):
+    """
+    Delete a message in the database.
 
-    if isValid_message:
-        session.delete(message)
-        session.commit()
-    else:
-        #If the access token is valid, but the current user is not the 
-        # user of the message, the response has HTTP status code 403 
-        # and the body has the following format.
-        raise InvalidUser()
+    The ownership, chat and membership checks are part of the DELETE itself.
 
+    :param chat_id: id of the chat the message belongs to
+    :param message_id: id of the message to be deleted
+    """
+    deleted = (await session.exec(
+        delete(MessageInDB)
+        .where(
+            (MessageInDB.id == message_id)
+            & (MessageInDB.chat_id == chat_id)
+            & (MessageInDB.user_id == current_user.id)
+            & _membership(chat_id, current_user.id).exists()
+        )
+        .returning(MessageInDB.id)
+    )).first()
+    if deleted is None:
+        await _raise_write_error(session, chat_id, current_user, message_id)
+
+    await _add_to_counter(session, chat_id, ChatInDB.message_count, -1)
+    await session.commit()
+    _publish(chat_id, "message.deleted", {"id": message_id, "chat_id": chat_id})
+
+
+def _publish(chat_id: int, type: str, message):
+    """
+    Push a message event to the chat's live connections, see backend/live.py.
+
+    :param message: a message, the id and chat_id of a deleted one, or a
+        list of messages for "messages.created"
+    """
+    if not live.hub.has_subscribers(chat_id):
+        return
+    if isinstance(message, list):
+        live.hub.publish(chat_id, {"type": type, "messages": [
+            Message.model_validate(m).model_dump(mode="json") for m in message
+        ]})
+        return
+    if isinstance(message, MessageInDB):
+        message = Message.model_validate(message).model_dump(mode="json")
+    live.hub.publish(chat_id, {"type": type, "message": message})
+
+
+# ---------------counters-------------
+
+async def _add_to_counter(session: AsyncSession, chat_id: int, counter, delta: int):
+    """Adjust a denormalized chat counter inside the caller's transaction."""
+    await session.exec(
+        update(ChatInDB)
+        .where(ChatInDB.id == chat_id)
+        .values({counter: counter + delta})
+    )
+
+
+def reconcile_chat_counters(session: Session) -> int:
+    """
+    Recompute the counters of every chat from the messages and links tables.
+
+    This is a maintenance task run from the command line, so it takes a
+    blocking session rather than the request handlers' async one.
 
-def user_in_chat_view(session: Session,
-                     chat_id: int,
-                     current_user: User):
+    :return: the number of chats whose counters had drifted
+    """
+    result = session.connection().execute(text(migrations.RECONCILE_CHAT_COUNTERS))
+    session.commit()
+    return result.rowcount
+
+
+async def user_in_chat_view(session: AsyncSession,
+                           chat_id: int,
+                           current_user: User):
     """To check if user is in the chat or not"""        
-    is_valid = session.exec(select(UserChatLinkInDB).where((UserChatLinkInDB.user_id == current_user.id) & (UserChatLinkInDB.chat_id == chat_id))).first()
+    is_valid = (await session.exec(select(UserChatLinkInDB).where((UserChatLinkInDB.user_id == current_user.id) & (UserChatLinkInDB.chat_id == chat_id)))).first()
     
     if is_valid:
         return is_valid
     else:
         raise InvalidView()
 
-def message_owner(session: Session,
-                  message_id: int,
-                  current_user: User):
+async def message_owner(session: AsyncSession,
+                        message_id: int,
+                        current_user: User):
     """To check if user is owner of message"""
-    return session.exec(select(MessageInDB).
-                        where((MessageInDB.user_id == current_user.id) 
-                              & (MessageInDB.id == message_id)))
+    return await session.exec(select(MessageInDB).
+                              where((MessageInDB.user_id == current_user.id) 
+                                    & (MessageInDB.id == message_id)))
 
 class PermissionException(HTTPException):
     def __init__(self, error: str, description: str):
@@ -357,6 +928,17 @@ class InvalidUser(PermissionException):
             description="requires permission to edit message",
         )
         
+class InvalidCursor(HTTPException):
+    def __init__(self, cursor: str):
+        super().__init__(
+            status_code=422,
+            detail={
+                "type": "invalid_cursor",
+                "cursor": cursor,
+            },
+        )
+
+
 class InvalidView(PermissionException):
     def __init__(self):
         super().__init__(
@@ -1,136 +1,151 @@
-import json
-
-from sqlalchemy import func
-from sqlmodel import Session, create_engine, select
-
-from backend.schema import *
-from backend.database import engine
+"""Copy the seed data into the application database.
 
-SQLModel.metadata.create_all(engine)
+Rows are streamed from the source database in chunks of SEED_CHUNK_SIZE
+(default 5000) and written with INSERT ... ON CONFLICT DO NOTHING, so memory
+use does not grow with the size of the tables and seeding can be re-run:
+rows that are already present (same key or unique value) are skipped.
+Primary keys are copied as they are, so foreign keys stay valid.
 
-local_engine = create_engine(
-    "sqlite:///backend/initial.db",
-    connect_args={"check_same_thread": False},
-)
+Tables are copied in foreign key order; messages and memberships only
+depend on users and chats and are copied in parallel on Postgres, on an
+unpooled engine of the application database.
 
+The source defaults to backend/initial.db and can be changed with
+SEED_SOURCE_URL.
 
-def upsert_all(session, cls, local_models) -> int:
-    models = session.exec(select(cls)).all()
-    model_lookup = {model.id: model for model in models}
-    count = 0
-    for local_model in local_models:
-        if model_lookup.get(local_model.id) is None:
-            session.add(cls(**{
-                key: value
-                for key, value in local_model.model_dump().items()
-                if key != "id"
-            }))
-            count += 1
-    session.commit()
-    return count
-
+usage:
+    python -m backend.db_seeder
+"""
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-def upsert_links(session, local_models) -> int:
-    links = session.exec(select(UserChatLinkInDB)).all()
-    link_lookup = {(link.user_id, link.chat_id): link for link in links}
-    count = 0
-    for local_model in local_models:
-        if link_lookup.get((local_model.user_id, local_model.chat_id)) is None:
-            session.add(UserChatLinkInDB(**local_model.model_dump()))
-            count += 1
-    session.commit()
-    return count
+from sqlalchemy import Table, create_engine, func, inspect, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
 
+from backend import database as db
+from backend.reconcile import reconcile
+from backend.schema import ChatInDB, MessageInDB, UserChatLinkInDB, UserInDB
 
-def get_count(session, model):
-    if model == UserChatLinkInDB:
-        return session.scalar(select(func.count(model.user_id)))
-    return session.scalar(select(func.count(model.id)))
+logger = logging.getLogger(__name__)
 
+# tables that can be copied at the same time, in foreign key order
+STAGES = [
+    [UserInDB.__table__],
+    [ChatInDB.__table__],
+    [MessageInDB.__table__, UserChatLinkInDB.__table__],
+]
 
-def add_users() -> dict[str, int]:
-    with Session(local_engine) as local_session:
-        users = local_session.exec(select(UserInDB)).all()
-        local_count = len(users)
 
-    with Session(engine) as session:
-        prev_count = get_count(session, UserInDB)
-        additions = upsert_all(session, UserInDB, users)
-        count = get_count(session, UserInDB)
+def chunk_size() -> int:
+    return int(os.environ.get("SEED_CHUNK_SIZE", "5000"))
 
-    return {
-        "local": local_count,
-        "prev": prev_count,
-        "additions": additions,
-        "final": count,
-    }
 
+def source_engine() -> Engine:
+    url = os.environ.get("SEED_SOURCE_URL", "sqlite:///backend/initial.db")
+    return create_engine(url)
 
-def add_chats() -> dict[str, int]:
-    with Session(local_engine) as local_session:
-        chats = local_session.exec(select(ChatInDB)).all()
-        local_count = len(chats)
 
-    with Session(engine) as session:
-        prev_count = get_count(session, ChatInDB)
-        additions = upsert_all(session, ChatInDB, chats)
-        count = get_count(session, ChatInDB)
+def insert_ignoring_conflicts(target: Engine, table: Table):
+    dialect = postgresql if target.dialect.name == "postgresql" else sqlite
+    return dialect.insert(table).on_conflict_do_nothing()
 
-    return {
-        "local": local_count,
-        "prev": prev_count,
-        "additions": additions,
-        "final": count,
-    }
 
+def _count(conn, table: Table) -> int:
+    return conn.scalar(select(func.count()).select_from(table))
 
-def add_messages() -> dict[str, int]:
-    with Session(local_engine) as local_session:
-        messages = local_session.exec(select(MessageInDB)).all()
-        local_count = len(messages)
 
-    with Session(engine) as session:
-        prev_count = get_count(session, MessageInDB)
-        additions = upsert_all(session, MessageInDB, messages)
-        count = get_count(session, MessageInDB)
+def copy_table(source: Engine, target: Engine, table: Table) -> dict[str, int]:
+    """
+    Stream one table from the source into the target database.
 
-    return {
-        "local": local_count,
-        "prev": prev_count,
-        "additions": additions,
-        "final": count,
-    }
+    :param table: the target table; only columns the source also has are copied
+    :return: row counts and throughput of the copy
+    """
+    # e.g. the chat counters do not exist in backend/initial.db
+    source_columns = {column["name"] for column in inspect(source).get_columns(table.name)}
+    columns = [column for column in table.columns if column.name in source_columns]
+    query = select(*columns)
+    insert = insert_ignoring_conflicts(target, table)
 
+    start = time.perf_counter()
+    local = 0
+    with target.connect() as conn:
+        prev = _count(conn, table)
 
-def add_user_chat_links() -> dict[str, int]:
-    with Session(local_engine) as local_session:
-        links = local_session.exec(select(UserChatLinkInDB)).all()
-        local_count = len(links)
+    with source.connect() as source_conn, target.connect() as conn:
+        result = source_conn.execution_options(
+            stream_results=True, yield_per=chunk_size(),
+        ).execute(query)
+        for rows in result.partitions():
+            conn.execute(insert, [row._asdict() for row in rows])
+            conn.commit()
+            local += len(rows)
+            elapsed = time.perf_counter() - start
+            logger.info(
+                "%s: %d rows copied, %.0f rows/s", table.name, local, local / elapsed,
+            )
 
-    with Session(engine) as session:
-        prev_count = get_count(session, UserChatLinkInDB)
-        additions = upsert_links(session, links)
-        count = get_count(session, UserChatLinkInDB)
+        final = _count(conn, table)
 
+    elapsed = time.perf_counter() - start
     return {
-        "local": local_count,
-        "prev": prev_count,
-        "additions": additions,
-        "final": count,
+        "local": local,
+        "prev": prev,
+        "additions": final - prev,
+        "final": final,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(local / elapsed) if elapsed else 0,
     }
 
 
-def seed_database():
-    user_count = add_users()
-    chat_count = add_chats()
-    message_count = add_messages()
-    link_count = add_user_chat_links()
+def reset_sequences(target: Engine):
+    """Move the id sequences past the copied ids (Postgres only)."""
+    if target.dialect.name != "postgresql":
+        return
+    with target.begin() as conn:
+        for table in ("users", "chats", "messages"):
+            conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"coalesce(max(id), 0) + 1, false) FROM {table}"
+            ))
+
+
+def seed_database(source: Engine = None, target: Engine = None) -> dict:
+    """
+    Copy every table from the source into the target database.
+
+    :param source: defaults to `source_engine()`
+    :param target: defaults to the application database
+    """
+    source = source or source_engine()
+    if target is None:
+        db.create_db_and_tables()
+        # the parallel copies each need a connection, a lambda mode pool has one
+        target = db.get_engine(pool_mode="null")
+
+    # SQLite has a single writer, parallel copies would only wait on its lock
+    workers = 1 if target.dialect.name == "sqlite" else None
+    counts = {}
+    for stage in STAGES:
+        with ThreadPoolExecutor(max_workers=workers or len(stage)) as pool:
+            copies = {
+                table.name: pool.submit(copy_table, source, target, table)
+                for table in stage
+            }
+            for name, copy in copies.items():
+                counts[name] = copy.result()
+    reset_sequences(target)
 
     return {
-        "user_count": user_count,
-        "chat_count": chat_count,
-        "message_count": message_count,
-        "link_count": link_count,
+        "user_count": counts["users"],
+        "chat_count": counts["chats"],
+        "message_count": counts["messages"],
+        "link_count": counts["user_chat_links"],
+        "reconcile": reconcile(target),
     }
 
 
@@ -149,5 +164,5 @@ def lambda_handler(event, context):
 
 
 if __name__ == "__main__":
-    seed_database()
-
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(seed_database(), indent=2))
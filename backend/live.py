@@ -0,0 +1,209 @@
+"""Live delivery of message events over WebSockets.
+
+Members of a chat connect to `/chats/{chat_id}/ws`, send their access
+token as the first message within LIVE_AUTH_TIMEOUT_SECONDS (default 10):
+
+    {"token": "<access token>"}
+
+and then receive every message created, edited or deleted in it as JSON:
+
+    {"type": "ready"}
+    {"type": "message.created", "message": {...}}
+    {"type": "message.updated", "message": {...}}
+    {"type": "message.deleted", "message": {"id": 1, "chat_id": 2}}
+    {"type": "messages.created", "messages": [{...}, ...]}
+    {"type": "ping"}
+
+"ready" comes first, once events are being delivered; messages created
+before it are not pushed and have to be fetched. A batch
+(`POST /chats/{chat_id}/messages/batch`) is a single "messages.created"
+event, so it takes one place in the send queue. A ping is sent after
+LIVE_HEARTBEAT_SECONDS (default 30) without events, so proxies keep the
+connection open and dead peers are noticed. Every connection has a send
+queue of LIVE_QUEUE_SIZE events (default 100); a client that falls that
+far behind is disconnected with code 1013 and has to reconnect and
+re-fetch the messages, instead of holding events in the server's memory.
+The connection is closed with code 1008 when the token is missing or
+invalid, the user is not a member, or the token expires. (Browsers cannot
+set headers on WebSockets, and a token in the query string would end up
+in access logs.)
+
+The hub lives in the process: events only reach clients connected to the
+process that handled the write. Serve WebSockets from a long-running
+server (uvicorn); API Gateway/Lambda through Mangum does not support them.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from backend import metrics
+
+logger = logging.getLogger(__name__)
+
+# close codes
+POLICY_VIOLATION = 1008
+TRY_AGAIN_LATER = 1013
+
+dropped = metrics.Counter(
+    "live_connections_dropped_total", "WebSocket clients disconnected for falling behind.",
+)
+
+
+def heartbeat_seconds() -> float:
+    return float(os.environ.get("LIVE_HEARTBEAT_SECONDS", "30"))
+
+
+def queue_size() -> int:
+    return int(os.environ.get("LIVE_QUEUE_SIZE", "100"))
+
+
+def auth_timeout_seconds() -> float:
+    return float(os.environ.get("LIVE_AUTH_TIMEOUT_SECONDS", "10"))
+
+
+async def receive_token(websocket: WebSocket) -> str:
+    """
+    The access token of an accepted connection, sent as its first message.
+
+    :return: the token, or "" if none arrived in time or the message is malformed
+    :raise WebSocketDisconnect: if the client goes away first
+    """
+    try:
+        message = await asyncio.wait_for(websocket.receive_text(), auth_timeout_seconds())
+        token = json.loads(message)["token"]
+    except (asyncio.TimeoutError, ValueError, KeyError, TypeError):
+        return ""
+    return token if isinstance(token, str) else ""
+
+
+class Subscription:
+    """The send queue of one connection."""
+
+    def __init__(self, chat_id: int, maxsize: int):
+        self.chat_id = chat_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.loop = asyncio.get_running_loop()
+        self.overflowed = False
+
+    def deliver(self, event: dict):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # wake the sender up with the sentinel, it closes the connection
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+            dropped.inc(())
+
+
+class Hub:
+    def __init__(self):
+        self._subscriptions: dict[int, set[Subscription]] = {}
+
+    def subscribe(self, chat_id: int, maxsize: int) -> Subscription:
+        subscription = Subscription(chat_id, maxsize)
+        self._subscriptions.setdefault(chat_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscriptions = self._subscriptions.get(subscription.chat_id, set())
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            self._subscriptions.pop(subscription.chat_id, None)
+
+    def has_subscribers(self, chat_id: int) -> bool:
+        return chat_id in self._subscriptions
+
+    def publish(self, chat_id: int, event: dict):
+        """Queue an event for every connection to the chat; never blocks."""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        for subscription in list(self._subscriptions.get(chat_id, ())):
+            if subscription.loop is running:
+                subscription.deliver(event)
+            else:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+
+    @property
+    def connections(self) -> int:
+        return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+
+hub = Hub()
+
+
+async def _send_events(websocket: WebSocket, subscription: Subscription, expires_at: int):
+    heartbeat = heartbeat_seconds()
+    while True:
+        timeout = min(heartbeat, expires_at - time.time())
+        if timeout <= 0:
+            await websocket.close(POLICY_VIOLATION, "token expired")
+            return
+        try:
+            event = await asyncio.wait_for(subscription.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            if time.time() < expires_at:
+                await websocket.send_json({"type": "ping"})
+            continue
+        if event is None:
+            await websocket.close(TRY_AGAIN_LATER, "send queue full")
+            return
+        await websocket.send_json(event)
+
+
+async def _receive_until_closed(websocket: WebSocket):
+    # clients have nothing to say (pongs are welcome), but reading is how
+    # the disconnect is noticed
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+
+
+async def serve(websocket: WebSocket, chat_id: int, expires_at: int):
+    """
+    Stream the events of a chat to an accepted connection until it closes.
+
+    :param expires_at: unix time the connection's access token expires
+    """
+    subscription = hub.subscribe(chat_id, queue_size())
+    subscription.deliver({"type": "ready"})
+    tasks = [
+        asyncio.ensure_future(_send_events(websocket, subscription, expires_at)),
+        asyncio.ensure_future(_receive_until_closed(websocket)),
+    ]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        hub.unsubscribe(subscription)
+    for result in results:
+        # sending to a client that has just gone away is expected
+        if isinstance(result, Exception) and not isinstance(
+            result, (WebSocketDisconnect, RuntimeError)
+        ):
+            logger.error("live connection failed", exc_info=result)
+
+
+def metric_lines() -> list[str]:
+    return [
+        "# HELP live_connections Open WebSocket connections.",
+        "# TYPE live_connections gauge",
+        f"live_connections {hub.connections}",
+        *dropped.render(()),
+    ]
+
+
+metrics.register(metric_lines)
@@ -0,0 +1,163 @@
+"""Structured, non-blocking logging.
+
+Records of the `backend` loggers go through a QueueHandler: the request
+handlers only put the record on an in-memory queue and a background
+QueueListener thread formats and writes it, so no request waits on stdout
+(or CloudWatch). Every record carries the id of the request it was logged
+for, taken from the X-Request-ID header or generated, and echoed back in
+the response.
+
+Configured from the environment:
+
+    LOG_LEVEL         level of the backend loggers (default INFO)
+    LOG_FORMAT        "json" (default) or "text"
+    LOG_SAMPLE_RATES  fraction of access log lines kept per route template,
+                      e.g. "/chats/{chat_id}/messages=0.1,/metrics=0";
+                      errors (status >= 500) are always logged
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+
+from backend import metrics
+
+request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+
+access_logger = logging.getLogger("backend.access")
+
+# attributes every LogRecord has; anything else was passed in `extra`
+_standard_attributes = set(vars(logging.makeLogRecord({}))) | {"message", "request_id"}
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp records with the current request id before they are queued."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        entry.update(
+            (key, value) for key, value in vars(record).items()
+            if key not in _standard_attributes
+        )
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # like QueueHandler.prepare, but leave the formatting (and the
+        # traceback) to the formatter of the listener
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def sample_rates() -> dict[str, float]:
+    rates = {}
+    for item in os.environ.get("LOG_SAMPLE_RATES", "").split(","):
+        route, _, rate = item.strip().rpartition("=")
+        if route:
+            rates[route] = float(rate)
+    return rates
+
+
+def configure():
+    """Route the backend loggers through the queue; safe to call twice."""
+    global _listener
+    if _listener is not None:
+        return
+
+    if os.environ.get("LOG_FORMAT", "json").lower() == "text":
+        formatter = logging.Formatter(
+            "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"
+        )
+    else:
+        formatter = JsonFormatter()
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    handler = _QueueHandler(records)
+    handler.addFilter(RequestIdFilter())
+
+    logger = logging.getLogger("backend")
+    logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+class RequestLoggingMiddleware:
+    """ASGI middleware that assigns request ids and writes the access log."""
+
+    def __init__(self, app):
+        self.app = app
+        self.sample_rates = sample_rates()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope["headers"]).get(b"x-request-id")
+        current = incoming.decode("latin-1")[:64] if incoming else uuid.uuid4().hex
+        token = request_id.set(current)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-request-id", current.encode("latin-1")),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            route = metrics.route_template(scope)
+            rate = self.sample_rates.get(route, 1.0)
+            if status >= 500 or rate >= 1.0 or random.random() < rate:
+                access_logger.info("request", extra={
+                    "method": scope["method"],
+                    "route": route,
+                    "path": scope["path"],
+                    "status": status,
+                    "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+                })
+            request_id.reset(token)
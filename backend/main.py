@@ -1,7 +1,7 @@
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi import Depends, FastAPI, Request
+from fastapi.responses import JSONResponse, HTMLResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from backend.routers.users import users_router
@@ -9,8 +9,12 @@ from backend.routers.chats import chats_router
 from backend.auth import auth_router
 
 
-from backend.auth import UserExisted
+from backend.auth import UserExisted, require_admin
 from backend.database import create_db_and_tables, EntityNotFoundException
+from backend.metrics import MetricsMiddleware
+from backend.profiling import ProfilingMiddleware
+from backend.query_stats import QueryStatsMiddleware
+from backend import log, metrics
 
 from mangum import Mangum
 
@@ -20,6 +24,8 @@ async def lifespan(app: FastAPI):
     create_db_and_tables()
     yield
 
+log.configure()
+
 app = FastAPI(
     title="Pony Express",
     description="API for managing fosters and adoptions.",
@@ -32,13 +38,18 @@ app.include_router(users_router)
 app.include_router(chats_router)
 app.include_router(auth_router)
 
+app.add_middleware(QueryStatsMiddleware)
+app.add_middleware(MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:5173", "https://main.d3eififu6izf2.amplifyapp.com"], 
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-DB-Queries", "X-DB-Time", "X-Request-ID", "X-Profile-Path"],
 )
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(log.RequestLoggingMiddleware)
 
 
 # decorator version
@@ -110,6 +121,12 @@ def default() -> str:
         """,
     )
 
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(require_admin)])
+def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
 lambda_handler = Mangum(app)
 
 # app.add_exception_handler(IDAlreadyExisted, handle_entity_not_found)
\ No newline at end of file
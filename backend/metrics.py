@@ -0,0 +1,219 @@
+"""Request metrics in the Prometheus text format.
+
+`MetricsMiddleware` records, per route template (`/chats/{chat_id}`, not
+the concrete path), request counts by status, a latency histogram and
+request/response size histograms, plus the number of requests in flight.
+`render()` adds the connection pool stats and is served at /metrics.
+
+Everything is recorded on the event loop thread, so the hot path is a few
+dict lookups and additions without locks.
+"""
+import bisect
+import time
+
+from backend import database as db
+from backend import user_cache
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000)
+
+# label used for requests that matched no route, to bound cardinality
+UNMATCHED = "unmatched"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # labels -> [count per bucket..., count, sum]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, labels: tuple, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self, label_names: tuple) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            base = _labels(label_names, labels)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series):
+                cumulative += count
+                lines.append(
+                    f'{self.name}_bucket{{{base},le="{bound}"}} {cumulative}'
+                )
+            lines.append(f"{self.name}_sum{{{base}}} {series[-1]}")
+            lines.append(f"{self.name}_count{{{base}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, labels: tuple, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self, label_names: tuple) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{{{_labels(label_names, labels)}}} {value}")
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+requests_total = Counter("http_requests_total", "HTTP requests by route and status.")
+request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency.", LATENCY_BUCKETS,
+)
+request_size = Histogram(
+    "http_request_size_bytes", "HTTP request body sizes.", SIZE_BUCKETS,
+)
+response_size = Histogram(
+    "http_response_size_bytes", "HTTP response body sizes.", SIZE_BUCKETS,
+)
+in_flight = 0
+
+_route_labels = ("method", "route")
+_status_labels = ("method", "route", "status")
+
+
+def route_template(scope) -> str:
+    """The path template of the route that handled a request."""
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return UNMATCHED
+    return _endpoint_paths(scope["app"]).get(endpoint, UNMATCHED)
+
+
+_paths_by_app: dict[int, dict] = {}
+
+
+def _endpoint_paths(app) -> dict:
+    paths = _paths_by_app.get(id(app))
+    if paths is None:
+        paths = _paths_by_app[id(app)] = {
+            route.endpoint: route.path
+            for route in getattr(app, "routes", [])
+            if hasattr(route, "endpoint")
+        }
+    return paths
+
+
+class MetricsMiddleware:
+    """ASGI middleware that records the metrics of every HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        global in_flight
+        in_flight += 1
+        start = time.perf_counter()
+        status = 500
+        sent = 0
+
+        async def send_and_measure(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_measure)
+        finally:
+            in_flight -= 1
+            labels = (scope["method"], route_template(scope))
+            requests_total.inc((*labels, status))
+            request_duration.observe(labels, time.perf_counter() - start)
+            response_size.observe(labels, sent)
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    # the header is the client's, it may be anything
+                    if value.isdigit():
+                        request_size.observe(labels, int(value))
+                    break
+
+
+def _pool_lines() -> list[str]:
+    # (key in pool_status, metric name, type, help)
+    series = [
+        ("size", "db_pool_size", "gauge", "Connections kept open by the pool."),
+        ("checked_in", "db_pool_checked_in", "gauge", "Idle connections in the pool."),
+        ("in_use", "db_pool_in_use", "gauge", "Connections checked out of the pool."),
+        ("overflow", "db_pool_overflow", "gauge", "Connections open beyond the pool size."),
+        ("checkouts", "db_pool_checkouts_total", "counter", "Connections handed out."),
+        ("timeouts", "db_pool_timeouts_total", "counter", "Checkouts that timed out."),
+        ("wait_seconds_total", "db_pool_wait_seconds_total", "counter",
+         "Time spent waiting for a connection."),
+        ("wait_seconds_max", "db_pool_wait_seconds_max", "gauge",
+         "Longest wait for a connection."),
+    ]
+    pools = db.pool_status()
+    lines = []
+    for key, name, type, help in series:
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {type}"]
+        for pool_name, status in pools.items():
+            if key in status:
+                lines.append(f'{name}{{pool="{pool_name}"}} {status[key]}')
+    return lines
+
+
+def _cache_lines() -> list[str]:
+    lines = []
+    for name, help in (("hits", "Cache lookups served from memory."),
+                       ("misses", "Cache lookups that went to the source.")):
+        metric = f"auth_cache_{name}_total"
+        lines += [f"# HELP {metric} {help}", f"# TYPE {metric} counter"]
+        for cache_name, cache in (("users", user_cache.users),
+                                  ("claims", user_cache.claims)):
+            lines.append(f'{metric}{{cache="{cache_name}"}} {getattr(cache, name)}')
+    return lines
+
+
+_collectors = []
+
+
+def register(collector):
+    """
+    Add lines to /metrics.
+
+    :param collector: function returning the lines of its metrics
+    """
+    _collectors.append(collector)
+
+
+def render() -> str:
+    lines = [
+        "# HELP http_requests_in_flight HTTP requests being served.",
+        "# TYPE http_requests_in_flight gauge",
+        f"http_requests_in_flight {in_flight}",
+        *requests_total.render(_status_labels),
+        *request_duration.render(_route_labels),
+        *request_size.render(_route_labels),
+        *response_size.render(_route_labels),
+        *_pool_lines(),
+        *_cache_lines(),
+    ]
+    for collector in _collectors:
+        lines += collector()
+    return "\n".join(lines) + "\n"
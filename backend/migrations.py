@@ -0,0 +1,394 @@
+"""Versioned schema migrations.
+
+Every migration has an integer version, an upgrade and a downgrade step.
+Applied versions are recorded in the `schema_migrations` table, so running
+`upgrade` is a no-op on an up-to-date database.
+
+The baseline migration creates the tables from the current models, which
+means a fresh database may already contain what later migrations add.
+Migrations therefore have to be idempotent (IF NOT EXISTS, column checks).
+
+Migrations that are not transactional run on an autocommit connection,
+which lets Postgres build indexes with CREATE INDEX CONCURRENTLY while the
+application keeps reading and writing the table.
+
+usage:
+    python -m backend.migrations upgrade [--to VERSION]
+    python -m backend.migrations downgrade --to VERSION
+    python -m backend.migrations current
+"""
+import argparse
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    inspect,
+    text,
+)
+from sqlalchemy.engine import Connection, Engine
+from sqlmodel import SQLModel
+
+from backend import schema  # noqa: F401 registers the table models
+
+# arbitrary key for the Postgres advisory lock held while migrating
+LOCK_KEY = 7_201_931
+
+# the document the Postgres search index is built on; queries must use the
+# same expression (see database.search_messages) for the index to apply
+SEARCH_DOCUMENT = "to_tsvector('english', coalesce({column}, ''))"
+
+# recomputes the chat counters, touching only the chats that drifted; also
+# used by database.reconcile_chat_counters
+RECONCILE_CHAT_COUNTERS = """
+UPDATE chats SET
+    message_count = counts.messages,
+    member_count = counts.members
+FROM (
+    SELECT chats.id AS chat_id,
+        (SELECT count(*) FROM messages WHERE messages.chat_id = chats.id) AS messages,
+        (
+            SELECT count(*) FROM user_chat_links
+            WHERE user_chat_links.chat_id = chats.id
+        ) AS members
+    FROM chats
+) AS counts
+WHERE counts.chat_id = chats.id
+    AND (chats.message_count != counts.messages OR chats.member_count != counts.members)
+"""
+
+version_table = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+    downgrade: Callable[[Connection], None]
+    transactional: bool = True
+
+
+# ------------------------------------- #
+#               helpers                 #
+# ------------------------------------- #
+
+def _is_postgres(conn: Connection) -> bool:
+    return conn.dialect.name == "postgresql"
+
+
+def _create_index(conn: Connection, name: str, table: str, columns: list[str]):
+    concurrently = "CONCURRENTLY " if _is_postgres(conn) else ""
+    conn.execute(text(
+        f"CREATE INDEX {concurrently}IF NOT EXISTS {name} "
+        f"ON {table} ({', '.join(columns)})"
+    ))
+
+
+def _drop_index(conn: Connection, name: str):
+    concurrently = "CONCURRENTLY " if _is_postgres(conn) else ""
+    conn.execute(text(f"DROP INDEX {concurrently}IF EXISTS {name}"))
+
+
+# ------------------------------------- #
+#              migrations               #
+# ------------------------------------- #
+
+_baseline_tables = ["users", "chats", "user_chat_links", "messages"]
+
+
+def _baseline_upgrade(conn: Connection):
+    tables = [SQLModel.metadata.tables[name] for name in _baseline_tables]
+    SQLModel.metadata.create_all(conn, tables=tables)
+
+
+def _baseline_downgrade(conn: Connection):
+    tables = [SQLModel.metadata.tables[name] for name in _baseline_tables]
+    SQLModel.metadata.drop_all(conn, tables=tables)
+
+
+_hot_path_indexes = [
+    ("ix_messages_chat_id_created_at_id", "messages", ["chat_id", "created_at", "id"]),
+    ("ix_messages_user_id", "messages", ["user_id"]),
+    ("ix_user_chat_links_chat_id_user_id", "user_chat_links", ["chat_id", "user_id"]),
+]
+
+
+# the default listings (GET /users, /chats, /chats/{id}/messages and
+# /chats/{id}/users) read in index order instead of sorting
+_listing_indexes = [
+    ("ix_messages_chat_id_id", "messages", ["chat_id", "id"]),
+    ("ix_users_created_at_id", "users", ["created_at", "id"]),
+    ("ix_chats_name_id", "chats", ["name", "id"]),
+]
+
+
+def _indexes_upgrade(conn: Connection, indexes=_hot_path_indexes):
+    for name, table, columns in indexes:
+        _create_index(conn, name, table, columns)
+
+
+def _indexes_downgrade(conn: Connection, indexes=_hot_path_indexes):
+    for name, _table, _columns in indexes:
+        _drop_index(conn, name)
+
+
+def _listing_indexes_upgrade(conn: Connection):
+    _indexes_upgrade(conn, _listing_indexes)
+
+
+def _listing_indexes_downgrade(conn: Connection):
+    _indexes_downgrade(conn, _listing_indexes)
+
+
+_chat_counters = ["message_count", "member_count"]
+
+
+def _counters_upgrade(conn: Connection):
+    existing = {column["name"] for column in inspect(conn).get_columns("chats")}
+    for column in _chat_counters:
+        if column not in existing:
+            conn.execute(text(
+                f"ALTER TABLE chats ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0"
+            ))
+    conn.execute(text(RECONCILE_CHAT_COUNTERS))
+
+
+def _counters_downgrade(conn: Connection):
+    for column in _chat_counters:
+        conn.execute(text(f"ALTER TABLE chats DROP COLUMN {column}"))
+
+
+_sqlite_search = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+    "text, content='messages', content_rowid='id', tokenize='porter unicode61')",
+    # the external content table is kept in sync by triggers, so every write
+    # path (ORM or bulk statements) updates the index
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, text) "
+    "VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF text ON messages "
+    "BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    "INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text); END",
+    "INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')",
+]
+
+_postgres_search = [
+    # an expression index: a stored generated column would rewrite the
+    # table under an ACCESS EXCLUSIVE lock, while this is built concurrently
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_search "
+    f"ON messages USING gin (({SEARCH_DOCUMENT.format(column='text')}))",
+]
+
+
+def _search_upgrade(conn: Connection):
+    statements = _postgres_search if _is_postgres(conn) else _sqlite_search
+    for statement in statements:
+        conn.execute(text(statement))
+
+
+def _search_downgrade(conn: Connection):
+    if _is_postgres(conn):
+        _drop_index(conn, "ix_messages_search")
+        # the column the first version of this migration added
+        conn.execute(text("ALTER TABLE messages DROP COLUMN IF EXISTS search"))
+        return
+    for trigger in ("insert", "delete", "update"):
+        conn.execute(text(f"DROP TRIGGER IF EXISTS messages_fts_{trigger}"))
+    conn.execute(text("DROP TABLE IF EXISTS messages_fts"))
+
+
+def _token_version_upgrade(conn: Connection):
+    existing = {column["name"] for column in inspect(conn).get_columns("users")}
+    if "token_version" not in existing:
+        conn.execute(text(
+            "ALTER TABLE users ADD COLUMN token_version INTEGER NOT NULL DEFAULT 0"
+        ))
+
+
+def _token_version_downgrade(conn: Connection):
+    conn.execute(text("ALTER TABLE users DROP COLUMN token_version"))
+
+
+migrations = [
+    Migration(1, "baseline", _baseline_upgrade, _baseline_downgrade),
+    Migration(
+        2,
+        "hot path indexes",
+        _indexes_upgrade,
+        _indexes_downgrade,
+        transactional=False,
+    ),
+    Migration(3, "chat counters", _counters_upgrade, _counters_downgrade),
+    Migration(
+        4,
+        "message search",
+        _search_upgrade,
+        _search_downgrade,
+        transactional=False,
+    ),
+    Migration(5, "token version", _token_version_upgrade, _token_version_downgrade),
+    Migration(
+        6,
+        "listing order indexes",
+        _listing_indexes_upgrade,
+        _listing_indexes_downgrade,
+        transactional=False,
+    ),
+]
+
+
+# ------------------------------------- #
+#                runner                 #
+# ------------------------------------- #
+
+def _applied_versions(conn: Connection) -> list[int]:
+    version_table.create(conn, checkfirst=True)
+    rows = conn.execute(version_table.select().order_by(version_table.c.version))
+    versions = [row.version for row in rows]
+    conn.commit()
+    return versions
+
+
+def applied_versions(engine: Engine) -> list[int]:
+    """Return the applied versions in ascending order."""
+    with engine.connect() as conn:
+        return _applied_versions(conn)
+
+
+def current_version(engine: Engine) -> int:
+    versions = applied_versions(engine)
+    return versions[-1] if versions else 0
+
+
+def _run(conn: Connection, migration: Migration, step: str):
+    action = getattr(migration, step)
+    if migration.transactional:
+        with conn.begin():
+            action(conn)
+            _record(conn, migration, step)
+    else:
+        conn.execution_options(isolation_level="AUTOCOMMIT")
+        try:
+            action(conn)
+        finally:
+            # ends SQLAlchemy's transaction; autocommit has nothing to undo
+            conn.rollback()
+            conn.execution_options(isolation_level=conn.default_isolation_level)
+        with conn.begin():
+            _record(conn, migration, step)
+
+
+def _record(conn: Connection, migration: Migration, step: str):
+    if step == "upgrade":
+        conn.execute(version_table.insert().values(
+            version=migration.version,
+            name=migration.name,
+            applied_at=datetime.now(),
+        ))
+    else:
+        conn.execute(version_table.delete().where(
+            version_table.c.version == migration.version
+        ))
+
+
+@contextmanager
+def _migrating(engine: Engine):
+    """
+    The one connection a migration run uses, locked against concurrent
+    runs (e.g. cold starting lambdas).
+
+    Everything runs on the connection that holds the lock, so migrating
+    fits a lambda mode pool, which allows a single checkout.
+    """
+    with engine.connect() as conn:
+        if engine.dialect.name != "postgresql":
+            yield conn
+            return
+
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": LOCK_KEY})
+        conn.commit()
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": LOCK_KEY})
+            conn.commit()
+
+
+def upgrade(engine: Engine, target: int = None) -> list[int]:
+    """
+    Apply all pending migrations up to and including `target`.
+
+    :param target: version to migrate to, defaults to the latest
+    :return: the versions that were applied
+    """
+    with _migrating(engine) as conn:
+        applied = set(_applied_versions(conn))
+        done = []
+        for migration in migrations:
+            if target is not None and migration.version > target:
+                break
+            if migration.version not in applied:
+                _run(conn, migration, "upgrade")
+                done.append(migration.version)
+        return done
+
+
+def downgrade(engine: Engine, target: int) -> list[int]:
+    """
+    Revert applied migrations newer than `target`, newest first.
+
+    :param target: version to migrate to, 0 reverts everything
+    :return: the versions that were reverted
+    """
+    with _migrating(engine) as conn:
+        applied = set(_applied_versions(conn))
+        done = []
+        for migration in reversed(migrations):
+            if migration.version <= target:
+                break
+            if migration.version in applied:
+                _run(conn, migration, "downgrade")
+                done.append(migration.version)
+        return done
+
+
+def main(argv: list[str] = None):
+    from backend.database import engine
+
+    parser = argparse.ArgumentParser(prog="python -m backend.migrations")
+    commands = parser.add_subparsers(dest="command", required=True)
+    upgrade_parser = commands.add_parser("upgrade", help="apply pending migrations")
+    upgrade_parser.add_argument("--to", type=int, default=None)
+    downgrade_parser = commands.add_parser("downgrade", help="revert migrations")
+    downgrade_parser.add_argument("--to", type=int, required=True)
+    commands.add_parser("current", help="print the current version")
+    args = parser.parse_args(argv)
+
+    if args.command == "upgrade":
+        print(f"applied: {upgrade(engine, args.to)}")
+    elif args.command == "downgrade":
+        print(f"reverted: {downgrade(engine, args.to)}")
+    print(f"current version: {current_version(engine)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Bounded executor for bcrypt hashing and verification.
+
+bcrypt is deliberately slow. Password work runs on its own small thread
+pool (bcrypt releases the GIL) instead of Starlette's shared threadpool,
+so a burst of logins queues here and cannot starve the threads that other
+endpoints use. At most PASSWORD_WORKERS operations run at a time and
+PASSWORD_QUEUE_SIZE more may wait; beyond that requests are rejected
+with 503 and a Retry-After header.
+
+The bcrypt cost is BCRYPT_ROUNDS. Hashes with a different cost still
+verify and are rehashed at the new cost on the next successful login, so
+the cost can be moved either way without password resets. To pick it for
+the hardware the service runs on:
+
+    python -m backend.passwords --target-ms 250
+
+    PASSWORD_WORKERS     default: number of CPUs
+    PASSWORD_QUEUE_SIZE  default: 4 per worker
+    BCRYPT_ROUNDS        default: 12
+"""
+import argparse
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+from passlib.hash import bcrypt
+
+from backend import metrics
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+duration = metrics.Histogram(
+    "password_operation_duration_seconds",
+    "Password hashing/verification latency, including the wait for a worker.",
+    LATENCY_BUCKETS,
+)
+rejected = metrics.Counter(
+    "password_operations_rejected_total", "Password operations refused with 503.",
+)
+
+
+class PasswordWorkersBusy(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=503,
+            detail={
+                "error": "temporarily_unavailable",
+                "error_description": "too many password operations in progress",
+            },
+            headers={"Retry-After": "1"},
+        )
+
+
+def workers() -> int:
+    return int(os.environ.get("PASSWORD_WORKERS", os.cpu_count() or 1))
+
+
+def queue_size() -> int:
+    return int(os.environ.get("PASSWORD_QUEUE_SIZE", 4 * workers()))
+
+
+def rounds() -> int:
+    return int(os.environ.get("BCRYPT_ROUNDS", "12"))
+
+
+def context(cost: int) -> CryptContext:
+    """A CryptContext that hashes with `cost` and flags any other cost for update."""
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__rounds=cost,
+        bcrypt__min_rounds=cost,
+        bcrypt__max_rounds=cost,
+    )
+
+
+def calibrate(target_seconds: float, password: str = "calibration") -> list[tuple[int, float]]:
+    """
+    Time bcrypt verification at increasing costs on this machine.
+
+    :param target_seconds: stop after the first cost slower than this
+    :return: (rounds, seconds) pairs, cheapest first
+    """
+    timings = []
+    for cost in range(bcrypt.min_rounds, bcrypt.max_rounds + 1):
+        hashed = bcrypt.using(rounds=cost).hash(password)
+        start = time.perf_counter()
+        bcrypt.verify(password, hashed)
+        timings.append((cost, time.perf_counter() - start))
+        if timings[-1][1] > target_seconds:
+            break
+    return timings
+
+
+def recommended_rounds(timings: list[tuple[int, float]], target_seconds: float) -> int:
+    """The highest cost that verifies within the target (at least the minimum)."""
+    within = [cost for cost, seconds in timings if seconds <= target_seconds]
+    return max(within, default=bcrypt.min_rounds)
+
+
+class PasswordExecutor:
+    def __init__(self, max_workers: int, max_queued: int):
+        self.max_workers = max_workers
+        self.capacity = max_workers + max_queued
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="password",
+        )
+        self._lock = threading.Lock()
+        self.pending = 0
+
+    async def submit(self, operation: str, function, *args):
+        """
+        Run `function(*args)` on a password worker.
+
+        :param operation: label of the latency histogram, e.g. "hash"
+        :raise PasswordWorkersBusy: if the workers and the queue are full
+        """
+        with self._lock:
+            if self.pending >= self.capacity:
+                rejected.inc((operation,))
+                raise PasswordWorkersBusy()
+            self.pending += 1
+
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, function, *args)
+        finally:
+            with self._lock:
+                self.pending -= 1
+            duration.observe((operation,), time.perf_counter() - start)
+
+
+executor = PasswordExecutor(workers(), queue_size())
+
+
+def metric_lines() -> list[str]:
+    return [
+        "# HELP password_operations_pending Password operations running or queued.",
+        "# TYPE password_operations_pending gauge",
+        f"password_operations_pending {executor.pending}",
+        *duration.render(("operation",)),
+        *rejected.render(("operation",)),
+    ]
+
+
+metrics.register(metric_lines)
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m backend.passwords",
+        description="Pick BCRYPT_ROUNDS for a target verify latency on this machine.",
+    )
+    parser.add_argument("--target-ms", type=float, default=250)
+    args = parser.parse_args(argv)
+
+    target = args.target_ms / 1000
+    timings = calibrate(target)
+    for cost, seconds in timings:
+        print(f"rounds={cost:2d}  verify={seconds * 1000:9.1f} ms")
+    print(f"BCRYPT_ROUNDS={recommended_rounds(timings, target)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Connection pool configuration and telemetry.
+
+The pool is configured from the environment:
+
+    DB_POOL_MODE      "default", "lambda" or "null"
+    DB_POOL_SIZE      connections kept open (default 5)
+    DB_MAX_OVERFLOW   extra connections allowed under load (default 10)
+    DB_POOL_TIMEOUT   seconds to wait for a connection (default 30)
+    DB_POOL_RECYCLE   seconds after which a connection is replaced
+    DB_POOL_PRE_PING  test connections before handing them out
+
+In "lambda" mode a warm invocation reuses the module level engine, so the
+pool is kept to a single connection per instance (each instance serves one
+request at a time) and connections are pinged and recycled because the
+instance may have been frozen for a while. That allows exactly one
+checkout per engine at a time: a request, a migration run or any other
+unit of work must not hold a second connection while it has one (a
+second checkout waits DB_POOL_TIMEOUT and fails). Migrations run on a
+single connection; the seeder copies tables in parallel on its own
+unpooled engine.
+
+"null" disables pooling entirely, e.g. behind an external pooler such as
+RDS Proxy or pgbouncer.
+"""
+import os
+import threading
+import time
+
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+_defaults = {
+    "default": {
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_timeout": 30,
+        "pool_recycle": -1,
+        "pool_pre_ping": False,
+    },
+    "lambda": {
+        "pool_size": 1,
+        "max_overflow": 0,
+        "pool_timeout": 10,
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+    },
+}
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ("true", "1", "t")
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return default if value is None else int(value)
+
+
+class PoolStats:
+    """Running totals of how long callers waited for a connection."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record(self, waited: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+
+class _TimedPoolMixin:
+    """Measure the time spent waiting in the pool for a free connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            self.stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - start)
+        return connection
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_options(async_engine: bool = False, mode: str = None) -> dict:
+    """
+    Engine keyword arguments for the pool described by the environment.
+
+    :param async_engine: whether the options are for an AsyncEngine
+    :param mode: overrides DB_POOL_MODE
+    """
+    mode = (mode or os.environ.get("DB_POOL_MODE", "default")).lower()
+    if mode == "null":
+        return {"poolclass": NullPool}
+
+    defaults = _defaults.get(mode, _defaults["default"])
+    return {
+        "poolclass": TimedAsyncAdaptedQueuePool if async_engine else TimedQueuePool,
+        "pool_size": _env_int("DB_POOL_SIZE", defaults["pool_size"]),
+        "max_overflow": _env_int("DB_MAX_OVERFLOW", defaults["max_overflow"]),
+        "pool_timeout": _env_int("DB_POOL_TIMEOUT", defaults["pool_timeout"]),
+        "pool_recycle": _env_int("DB_POOL_RECYCLE", defaults["pool_recycle"]),
+        "pool_pre_ping": _env_bool("DB_POOL_PRE_PING", defaults["pool_pre_ping"]),
+    }
+
+
+def pool_status(pool) -> dict:
+    """
+    Snapshot of a pool's occupancy and wait times.
+
+    :param pool: the `engine.pool` (or `async_engine.pool`) to describe
+    """
+    if not isinstance(pool, QueuePool):
+        return {"class": type(pool).__name__}
+
+    status = {
+        "class": type(pool).__name__,
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "in_use": pool.checkedout(),
+        # negative while the pool has not yet opened `size` connections
+        "overflow": max(pool.overflow(), 0),
+    }
+    stats = getattr(pool, "stats", None)
+    if stats is not None:
+        status.update({
+            "checkouts": stats.checkouts,
+            "timeouts": stats.timeouts,
+            "wait_seconds_total": round(stats.wait_seconds, 6),
+            "wait_seconds_max": round(stats.max_wait_seconds, 6),
+        })
+    return status
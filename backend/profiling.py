@@ -0,0 +1,129 @@
+"""Opt-in profiling of single requests.
+
+A request is profiled when it asks for it with the `X-Profile` header or
+the `profile` query parameter and carries the admin token (ADMIN_TOKEN) in
+`X-Admin-Token`; without ADMIN_TOKEN profiling is disabled.
+
+    X-Profile: file     write <request id>.prof (cProfile stats, e.g. for
+                        snakeviz) and <request id>.sql.json (statements
+                        with timings) to PROFILE_DIR and name them in the
+                        X-Profile-Path response header
+    X-Profile: inline   replace the response with a text report of the
+                        slowest functions and the statements
+
+cProfile is deterministic and slows the request down. It records every
+call on the event loop thread while the request runs, which includes
+other requests being served concurrently, and misses work done in the
+threadpool (e.g. bcrypt). Only one request is profiled at a time; one that
+asks while another is being profiled is served without a profile.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import tempfile
+import threading
+import uuid
+from pathlib import Path
+from urllib.parse import parse_qs
+
+from backend import log, query_stats
+from backend.auth import is_admin_token
+
+MODES = ("file", "inline")
+
+# cProfile refuses to run two profilers at once
+_profiling = threading.Lock()
+
+
+def profile_dir() -> Path:
+    default = Path(tempfile.gettempdir()) / "pony_express_profiles"
+    return Path(os.environ.get("PROFILE_DIR", default))
+
+
+def requested_mode(scope) -> str | None:
+    """The profiling mode an admin asked for, or None."""
+    headers = dict(scope["headers"])
+    mode = headers.get(b"x-profile", b"").decode("latin-1").lower()
+    if not mode:
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        mode = query.get("profile", [""])[0].lower()
+    if mode not in MODES:
+        return None
+    token = headers.get(b"x-admin-token", b"").decode("latin-1")
+    return mode if is_admin_token(token) else None
+
+
+def report(profiler: cProfile.Profile, statements: list[dict], limit: int = 40) -> str:
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+    out.write(f"\n{len(statements)} SQL statements, "
+              f"{sum(s['ms'] for s in statements):.3f} ms\n")
+    for statement in statements:
+        out.write(f"\n[{statement['ms']} ms] {statement['statement']}\n")
+    return out.getvalue()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles requests that ask for it."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        mode = requested_mode(scope) if scope["type"] == "http" else None
+        if mode is None or not _profiling.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self._profile(mode, scope, receive, send)
+        finally:
+            _profiling.release()
+
+    async def _profile(self, mode: str, scope, receive, send):
+        # the request id comes from the client, keep it from naming a path
+        name = re.sub(r"[^A-Za-z0-9_-]", "", log.request_id.get() or "")
+        name = name or uuid.uuid4().hex
+        profiler = cProfile.Profile()
+        held = []
+
+        async def send_profiled(message):
+            if mode == "inline":
+                # the report replaces the response once the profile is done
+                held.append(message)
+                return
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-profile-path", str(profile_dir() / name).encode()),
+                ]
+            await send(message)
+
+        with query_stats.record_statements() as statements:
+            profiler.enable()
+            try:
+                await self.app(scope, receive, send_profiled)
+            finally:
+                profiler.disable()
+
+        if mode == "file":
+            directory = profile_dir()
+            directory.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(directory / f"{name}.prof")
+            (directory / f"{name}.sql.json").write_text(json.dumps(statements, indent=2))
+            return
+
+        body = report(profiler, statements).encode()
+        status = next(m["status"] for m in held if m["type"] == "http.response.start")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"text/plain; charset=utf-8"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
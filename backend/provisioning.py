@@ -0,0 +1,296 @@
+"""Register many users at once, e.g. when onboarding an organization.
+
+The input is JSONL, one registration per line in the format of
+`POST /auth/registration`:
+
+    {"username": "ripley", "email": "ripley@example.com", "password": "..."}
+
+Rows are handled in batches of PROVISIONING_BATCH_SIZE (default 1000):
+usernames and emails are checked against the users table with one query
+per batch, the passwords are hashed in parallel and the new users are
+written with one INSERT ... RETURNING and committed. A row that is invalid
+or duplicates an existing user (or an earlier row) is reported with its
+line number, in the shape of DuplicateValueException for duplicates; the
+other rows are still registered.
+
+`POST /users/bulk` (admin only) hashes on the password workers that logins
+use (see backend.passwords), one password per task and on at most half of
+the workers, so that an import cannot crowd logins out; it waits instead of
+failing when their queue is full. The command line hashes on a process
+pool:
+
+    python -m backend.provisioning users.jsonl [--workers N]
+"""
+import argparse
+import asyncio
+import codecs
+import datetime
+import json
+import os
+import sys
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import AsyncIterable, Iterable
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from backend import passwords
+from backend.auth import DuplicateValueException, UserRegistration, pwd_context
+from backend.schema import (
+    BulkRegistrationCollection,
+    BulkRegistrationError,
+    UserInDB,
+)
+
+# rows and bytes accepted by one request to POST /users/bulk
+MAX_ROWS = 10_000
+MAX_BYTES = 1024 * MAX_ROWS
+
+# passwords hashed per task handed to a process pool
+HASH_CHUNK = 25
+
+# wait before resubmitting to password workers that are busy with logins
+BUSY_RETRY_SECONDS = 0.1
+
+_FIELDS = ("username", "email")
+
+class TooManyRows(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=413,
+            detail=f"at most {MAX_ROWS} registrations and {MAX_BYTES} bytes per request",
+        )
+
+
+class InvalidEncoding(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=422, detail="the body is not valid UTF-8")
+
+
+def batch_size() -> int:
+    return int(os.environ.get("PROVISIONING_BATCH_SIZE", "1000"))
+
+
+def hash_passwords(plain: list[str]) -> list[str]:
+    # module level, so that process pools can pickle it
+    return [pwd_context.hash(password) for password in plain]
+
+
+async def read_lines(chunks: AsyncIterable[bytes]) -> list[str]:
+    """
+    Split a streamed UTF-8 body into lines, without holding more than
+    MAX_BYTES of it.
+
+    :raise TooManyRows: as soon as the body exceeds MAX_ROWS or MAX_BYTES
+    :raise InvalidEncoding: if the body is not UTF-8
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    lines, partial, received = [], "", 0
+    try:
+        async for chunk in chunks:
+            received += len(chunk)
+            if received > MAX_BYTES:
+                raise TooManyRows()
+            *complete, partial = (partial + decoder.decode(chunk)).split("\n")
+            lines += complete
+            if len(lines) > MAX_ROWS:
+                raise TooManyRows()
+        partial += decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        raise InvalidEncoding()
+    if partial:
+        lines.append(partial)
+    if len(lines) > MAX_ROWS:
+        raise TooManyRows()
+    return lines
+
+
+def _duplicate(field: str, value: str) -> dict:
+    return DuplicateValueException(field=field, value=value).detail
+
+
+def parse(lines: Iterable[str]):
+    """
+    Validate JSONL registrations.
+
+    :return: (line number, registration) pairs and the errors of the other lines
+    """
+    registrations, errors = [], []
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            registrations.append((number, UserRegistration.model_validate_json(line)))
+        except ValidationError as e:
+            errors.append(BulkRegistrationError(line=number, detail={
+                "type": "invalid_registration",
+                "errors": json.loads(e.json(include_url=False)),
+            }))
+    return registrations, errors
+
+
+async def _existing(session: AsyncSession, batch) -> dict[str, set]:
+    """The usernames and emails of the batch that are taken, in one query."""
+    values = {
+        field: [getattr(registration, field) for _, registration in batch]
+        for field in _FIELDS
+    }
+    rows = (await session.exec(
+        select(UserInDB.username, UserInDB.email).where(or_(
+            UserInDB.username.in_(values["username"]),
+            UserInDB.email.in_(values["email"]),
+        ))
+    )).all()
+    return {
+        "username": {row.username for row in rows},
+        "email": {row.email for row in rows},
+    }
+
+
+def _taken(registration: UserRegistration, existing: dict[str, set]) -> str | None:
+    return next(
+        (field for field in _FIELDS if getattr(registration, field) in existing[field]),
+        None,
+    )
+
+
+def _insert(session: AsyncSession):
+    dialect = postgresql if session.bind.dialect.name == "postgresql" else sqlite
+    # a user registered since the check is skipped instead of failing the batch
+    return dialect.insert(UserInDB).on_conflict_do_nothing().returning(UserInDB)
+
+
+async def _hash_on_password_workers(plain: list[str]) -> list[str]:
+    slots = asyncio.Semaphore(max(1, passwords.executor.max_workers // 2))
+
+    async def hash_one(password: str) -> str:
+        async with slots:
+            while True:
+                try:
+                    [hashed] = await passwords.executor.submit(
+                        "bulk_hash", hash_passwords, [password],
+                    )
+                    return hashed
+                except passwords.PasswordWorkersBusy:
+                    await asyncio.sleep(BUSY_RETRY_SECONDS)
+
+    return list(await asyncio.gather(*(hash_one(password) for password in plain)))
+
+
+async def _hash_all(executor: Executor | None, batch) -> list[str]:
+    plain = [registration.password for _, registration in batch]
+    if executor is None:
+        return await _hash_on_password_workers(plain)
+    loop = asyncio.get_running_loop()
+    # in chunks, so that a process pool does not pay a round trip per password
+    chunks = await asyncio.gather(*(
+        loop.run_in_executor(executor, hash_passwords, plain[i:i + HASH_CHUNK])
+        for i in range(0, len(plain), HASH_CHUNK)
+    ))
+    return [hashed for chunk in chunks for hashed in chunk]
+
+
+async def register_users(session: AsyncSession,
+                         lines: Iterable[str],
+                         executor: Executor = None,
+                         size: int = None) -> BulkRegistrationCollection:
+    """
+    Register the users of a JSONL batch.
+
+    :param lines: one JSON registration per line
+    :param executor: pool the passwords are hashed on, the password workers by default
+    :param size: rows per query and transaction, PROVISIONING_BATCH_SIZE by default
+    :return: the registered users and the errors of the rejected lines
+    """
+    size = size or batch_size()
+    registrations, errors = parse(lines)
+
+    # duplicates within the input: the first occurrence wins
+    seen = {field: set() for field in _FIELDS}
+    unique = []
+    for number, registration in registrations:
+        for field in _FIELDS:
+            value = getattr(registration, field)
+            if value in seen[field]:
+                errors.append(BulkRegistrationError(
+                    line=number, detail=_duplicate(field, value),
+                ))
+                break
+        else:
+            for field in _FIELDS:
+                seen[field].add(getattr(registration, field))
+            unique.append((number, registration))
+
+    users = []
+    for start in range(0, len(unique), size):
+        batch = []
+        existing = await _existing(session, unique[start:start + size])
+        for number, registration in unique[start:start + size]:
+            taken = _taken(registration, existing)
+            if taken is None:
+                batch.append((number, registration))
+            else:
+                errors.append(BulkRegistrationError(
+                    line=number,
+                    detail=_duplicate(taken, getattr(registration, taken)),
+                ))
+        if not batch:
+            continue
+
+        hashed = await _hash_all(executor, batch)
+        now = datetime.datetime.now()
+        rows = [
+            {**registration.model_dump(exclude={"password"}),
+             "hashed_password": hashed_password, "created_at": now}
+            for (_, registration), hashed_password in zip(batch, hashed)
+        ]
+        created = (await session.exec(_insert(session), params=rows)).scalars().all()
+        await session.commit()
+
+        users += created
+        if len(created) < len(batch):
+            registered = {user.username for user in created}
+            skipped = [row for row in batch if row[1].username not in registered]
+            existing = await _existing(session, skipped)
+            for number, registration in skipped:
+                taken = _taken(registration, existing) or "username"
+                errors.append(BulkRegistrationError(
+                    line=number,
+                    detail=_duplicate(taken, getattr(registration, taken)),
+                ))
+
+    users.sort(key=lambda user: user.id)
+    errors.sort(key=lambda error: error.line)
+    return BulkRegistrationCollection(
+        meta={"count": len(users), "error_count": len(errors)},
+        users=users,
+        errors=errors,
+    )
+
+
+async def _register_file(path: str, workers: int) -> BulkRegistrationCollection:
+    from backend import database as db
+
+    db.create_db_and_tables()
+    with open(path) as lines, ProcessPoolExecutor(max_workers=workers) as executor:
+        async with AsyncSession(db.async_engine, expire_on_commit=False) as session:
+            return await register_users(session, lines, executor)
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(prog="python -m backend.provisioning")
+    parser.add_argument("path", help="JSONL file, one registration per line")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(_register_file(args.path, args.workers))
+    print(report.model_dump_json(indent=2))
+    return 1 if report.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
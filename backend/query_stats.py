@@ -0,0 +1,104 @@
+"""Count the SQL statements and database time of each request.
+
+Engine events add every statement to the `QueryStats` of the current
+context; `QueryStatsMiddleware` opens one per request. With
+DB_QUERY_HEADERS=1 the totals are returned as response headers:
+
+    X-DB-Queries   number of statements executed
+    X-DB-Time      time spent in the database driver, in milliseconds
+"""
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+@dataclass
+class QueryStats:
+    queries: int = 0
+    seconds: float = 0.0
+
+
+_current: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+_statements: ContextVar[list | None] = ContextVar("query_statements", default=None)
+
+
+def headers_enabled() -> bool:
+    return os.environ.get("DB_QUERY_HEADERS", default="False").lower() in ("true", "1", "t")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.seconds += elapsed
+    statements = _statements.get()
+    if statements is not None:
+        statements.append({"statement": statement, "ms": round(elapsed * 1000, 3)})
+
+
+def install(engine: Engine):
+    """
+    Count the statements of an engine; installing twice has no effect.
+
+    :param engine: a sync Engine, or the `sync_engine` of an AsyncEngine
+    """
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+@contextmanager
+def count_queries():
+    """Collect the statements executed inside the block."""
+    stats = QueryStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def record_statements():
+    """Collect the text and duration of every statement executed in the block."""
+    statements = []
+    token = _statements.set(statements)
+    try:
+        yield statements
+    finally:
+        _statements.reset(token)
+
+
+class QueryStatsMiddleware:
+    """ASGI middleware that counts the statements of every HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        expose = headers_enabled()
+        with count_queries() as stats:
+            async def send_with_headers(message):
+                if expose and message["type"] == "http.response.start":
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (b"x-db-queries", str(stats.queries).encode()),
+                        (b"x-db-time", f"{stats.seconds * 1000:.3f}".encode()),
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, send_with_headers)
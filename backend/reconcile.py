@@ -0,0 +1,41 @@
+"""Repair the denormalized chat counters.
+
+The counters on `chats` are kept up to date by backend/database.py; this
+recomputes them from the source tables after bulk loads or manual edits.
+
+usage:
+    python -m backend.reconcile
+"""
+import json
+
+from sqlalchemy.engine import Engine
+from sqlmodel import Session
+
+from backend import database as db
+
+
+def reconcile(engine: Engine = None) -> dict[str, int]:
+    """
+    Recompute every chat's counters.
+
+    :param engine: defaults to the application database
+    """
+    with Session(engine or db.engine) as session:
+        return {"repaired_chats": db.reconcile_chat_counters(session)}
+
+
+def lambda_handler(event, context):
+    try:
+        return {
+            "statusCode": 200,
+            "body": json.dumps(reconcile()),
+        }
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": str(e)}),
+        }
+
+
+if __name__ == "__main__":
+    print(reconcile())
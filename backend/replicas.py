@@ -0,0 +1,83 @@
+"""Read replica routing.
+
+Read replicas are configured with PG_REPLICA_ENDPOINTS, a comma separated
+list of hosts (optionally host:port) that share the credentials and the
+database of the primary (PG_USERNAME, PG_PASSWORD, PG_PORT).
+
+Replicas lag behind the primary, so a user who just wrote something is
+pinned to the primary for DB_REPLICA_PIN_SECONDS (default 5) and reads
+their own writes. Pins are kept in process memory: with several app
+instances a pinned user may still hit a replica through another instance
+within the window.
+"""
+import os
+import time
+
+from starlette.requests import HTTPConnection
+from jose import JWTError, jwt
+
+
+def replica_urls(async_driver: bool = False) -> list[str]:
+    """
+    Build the urls of the configured read replicas.
+
+    :param async_driver: use asyncpg instead of the blocking driver
+    """
+    if os.environ.get("DB_LOCATION") != "RDS":
+        return []
+
+    endpoints = os.environ.get("PG_REPLICA_ENDPOINTS", "")
+    username = os.environ.get("PG_USERNAME")
+    password = os.environ.get("PG_PASSWORD")
+    default_port = os.environ.get("PG_PORT")
+    driver = "postgresql+asyncpg" if async_driver else "postgresql"
+
+    urls = []
+    for endpoint in filter(None, (e.strip() for e in endpoints.split(","))):
+        host, _, port = endpoint.partition(":")
+        urls.append(
+            f"{driver}://{username}:{password}@{host}:{port or default_port}/{username}"
+        )
+    return urls
+
+
+def pin_seconds() -> float:
+    return float(os.environ.get("DB_REPLICA_PIN_SECONDS", "5"))
+
+
+class WritePins:
+    """Users that wrote recently and must read from the primary."""
+
+    def __init__(self, seconds: float, clock=time.monotonic):
+        self.seconds = seconds
+        self._clock = clock
+        self._until: dict[int, float] = {}
+
+    def pin(self, user_id: int):
+        now = self._clock()
+        self._until[user_id] = now + self.seconds
+        # drop expired pins once in a while, so the dict stays small
+        if len(self._until) > 1024:
+            self._until = {
+                user: until for user, until in self._until.items() if until > now
+            }
+
+    def is_pinned(self, user_id: int) -> bool:
+        until = self._until.get(user_id)
+        return until is not None and until > self._clock()
+
+
+def request_user_id(request: HTTPConnection) -> int | None:
+    """
+    The user id of the request's bearer token, if any.
+
+    The signature is not verified: the id is only used to route reads, the
+    route's own dependencies still authenticate the request.
+    """
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return int(jwt.get_unverified_claims(token)["sub"])
+    except (JWTError, KeyError, TypeError, ValueError):
+        return None
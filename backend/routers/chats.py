@@ -1,6 +1,8 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import (
+    APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect,
+)
 from fastapi.responses import JSONResponse
-from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import Optional
 from typing import Annotated
 
@@ -8,7 +10,9 @@ from backend.schema import (
     ChatCollection,
     ChatResponse,
     ChatUpdate,
+    MessageBatchCreate,
     MessageCollection,
+    MessageSearchCollection,
     UserCollection,
     MessageCreate,
     MessageResponse,
@@ -19,7 +23,8 @@ from backend.schema import (
 )
 from typing import Literal
 from backend import database as db
-from backend.auth import get_current_user
+from backend import live
+from backend.auth import Claims, get_current_claims, get_current_user, verify_claims
 
 chats_router = APIRouter(prefix="/chats", tags=["Chats"])
 
@@ -29,79 +34,110 @@ chats_router = APIRouter(prefix="/chats", tags=["Chats"])
                 response_model = ChatCollection,
                 description= " returns a list of chats sorted by name alongside some metadata.", 
 )
-def get_chats(
-            sort: Literal["id", "name", "user_ids", "owner_id", "created_at"] = "name",
-            session: Session = Depends(db.get_session),
-            current_user: UserInDB = Depends(get_current_user), 
+async def get_chats(
+            sort: Literal["id", "name", "owner_id", "created_at"] = "name",
+            order: db.SortOrder = "asc",
+            session: AsyncSession = Depends(db.get_read_session),
+            current_user: Claims = Depends(get_current_claims), 
             ):
     
-    sort_key = lambda user: getattr(user, sort)
-    chats = db.get_all_chats(session, current_user)
+    chats = await db.get_all_chats(session, current_user, sort, order)
     
     return ChatCollection(
         meta= {"count": len(chats)},
-        chats = sorted(chats, key=sort_key)
+        chats = chats
+    )
+
+@chats_router.get("/messages/search",
+                  response_model = MessageSearchCollection,
+                  response_model_exclude_none = True,
+                  description = "full-text search of the messages in the current "
+                  "user's chats, best matches first")
+async def search_messages(
+            q: Annotated[str, Query(min_length=1)],
+            limit: Annotated[int, Query(ge=1, le=200)] = 50,
+            offset: Annotated[int, Query(ge=0)] = 0,
+            current_user: Claims = Depends(get_current_claims),
+            session: AsyncSession = Depends(db.get_read_session),):
+
+    messages, next_offset = await db.search_messages(
+        session, q, current_user, limit=limit, offset=offset,
+    )
+    return MessageSearchCollection(
+        meta={"count": len(messages), "next_offset": next_offset},
+        messages=messages,
+    )
+
+
+@chats_router.get("/{chat_id}/messages/search",
+                  response_model = MessageSearchCollection,
+                  response_model_exclude_none = True,
+                  description = "full-text search of the messages of a chat, "
+                  "best matches first")
+async def search_chat_messages(
+            chat_id: int,
+            q: Annotated[str, Query(min_length=1)],
+            limit: Annotated[int, Query(ge=1, le=200)] = 50,
+            offset: Annotated[int, Query(ge=0)] = 0,
+            current_user: Claims = Depends(get_current_claims),
+            session: AsyncSession = Depends(db.get_read_session),):
+
+    messages, next_offset = await db.search_messages(
+        session, q, current_user, chat_id=chat_id, limit=limit, offset=offset,
+    )
+    return MessageSearchCollection(
+        meta={"count": len(messages), "next_offset": next_offset},
+        messages=messages,
     )
 
+
+@chats_router.websocket("/{chat_id}/ws")
+async def chat_events(
+            websocket: WebSocket,
+            chat_id: int,
+            session: AsyncSession = Depends(db.get_read_session),):
+    """Push the chat's message events to a member, see backend/live.py."""
+    await websocket.accept()
+    try:
+        claims = verify_claims(await live.receive_token(websocket))
+        await db.get_chat_by_id(session, chat_id, claims)
+    except WebSocketDisconnect:
+        return
+    except (HTTPException, db.EntityNotFoundException):
+        await websocket.close(live.POLICY_VIOLATION)
+        return
+    finally:
+        # the connection may stay open for hours, give back the pooled one
+        await session.close()
+
+    await live.serve(websocket, chat_id, claims.exp)
+
+
 #   The GET /chats/{chat_id} will be enhanced with new functionality, see below.
 
 @chats_router.get("/{chat_id}", 
                   response_model = ChatUpdatedCollection,
                   description = "return chat information message_count & user_count",
                   response_model_exclude_none= True)
-def get_chat_by_id(chat_id: int,
-                   current_user: UserInDB = Depends(get_current_user), 
-                   include: Annotated[list[str] | None, Query()] = None,
-                   session: Session = Depends(db.get_session)):
-    
-    chat = db.get_chat_by_id(session, chat_id, current_user)
-    print(include)
-    if include:
-        
-        if "messages" in include and "users" in include:
-            users = db.get_users_by_chat_id(session, chat_id)
-            messages = db.get_messages_by_chat_id(session, chat_id)
-
-            return ChatUpdatedCollection(
-                meta = ChatMeta(
-                    message_count = len(chat.messages),
-                    user_count = len(chat.users),
-                    ),
-                chat = chat,
-                users = users,
-                messages = messages,
-            )
-        
-        elif "messages" in include:
-            messages = db.get_messages_by_chat_id(session, chat_id)
-            return ChatUpdatedCollection(
-                meta = ChatMeta(
-                    message_count = len(chat.messages),
-                    user_count = len(chat.users),
-                    ),
-                chat = chat,
-                messages = messages,
-            )
-        elif "users" in include:
-            users = db.get_users_by_chat_id(session, chat_id)
-            return ChatUpdatedCollection(
-                meta = ChatMeta(
-                    message_count = len(chat.messages),
-                    user_count = len(chat.users),
-                    ),
-                chat = chat,
-                users = users,
-            )
-        else:
-            pass
+async def get_chat_by_id(chat_id: int,
+                         current_user: Claims = Depends(get_current_claims), 
+                         include: Annotated[list[str] | None, Query()] = None,
+                         session: AsyncSession = Depends(db.get_read_session)):
     
+    chat = await db.get_chat_by_id(session, chat_id, current_user)
+    include = include or []
+
     return ChatUpdatedCollection(
         meta = ChatMeta(
-            message_count = len(chat.messages),
-            user_count = len(chat.users),
+            message_count = chat.message_count,
+            user_count = chat.member_count,
             ),
         chat = chat,
-
+        users = await db.get_users_by_chat_id(session, chat_id) if "users" in include else None,
+        messages = (
+            await db.get_messages_by_chat_id(session, chat_id)
+            if "messages" in include else None
+        ),
     )
 
 # PUT /chats/{chat_id} updates a chat for a given id. 
@@ -110,11 +146,11 @@ def get_chat_by_id(chat_id: int,
 @chats_router.put("/{chat_id}", 
                   response_model = ChatResponse,
                   description = "update chat" )
-def update_chat(chat_id: int, 
-                chat_update: ChatUpdate,
-                session: Session = Depends(db.get_session),):
+async def update_chat(chat_id: int, 
+                      chat_update: ChatUpdate,
+                      session: AsyncSession = Depends(db.get_session),):
 
-    updated_chat = db.chat_name_update(session, chat_id, chat_update)
+    updated_chat = await db.chat_name_update(session, chat_id, chat_update)
     return ChatResponse(chat = updated_chat)
 
 
@@ -125,74 +161,106 @@ def update_chat(chat_id: int,
     """
 @chats_router.get("/{chat_id}/messages", 
                   response_model = MessageCollection,
-                  description = "get list of chats by given chat_id" 
+                  response_model_exclude_none = True,
+                  description = "get list of chats by given chat_id. "
+                  "Passing limit, before or after switches to cursor pagination "
+                  "ordered by created_at." 
 )
-def get_messages(
+async def get_messages(
             chat_id: int,
-            current_user: UserInDB = Depends(get_current_user), 
+            current_user: Claims = Depends(get_current_claims), 
             sort: Literal["id", "text", "chat_id"  , "created_at"] = "id",
-            session: Session = Depends(db.get_session),):
+            order: db.SortOrder = "asc",
+            limit: Annotated[int | None, Query(ge=1, le=200)] = None,
+            before: Optional[str] = None,
+            after: Optional[str] = None,
+            session: AsyncSession = Depends(db.get_read_session),):
     
-    sort_key = lambda messages: getattr(messages, sort)
-    chat = db.get_chat_by_id(session, chat_id, current_user)
+    await db.get_chat_by_id(session, chat_id, current_user)
+
+    if limit is not None or before is not None or after is not None:
+        messages, next_cursor, prev_cursor = await db.get_messages_page(
+            session, chat_id, limit or 50, before=before, after=after,
+        )
+        return MessageCollection(
+            meta={
+                "count": len(messages),
+                "next_cursor": next_cursor,
+                "prev_cursor": prev_cursor,
+            },
+            messages = messages,
+        )
 
-    messages = chat.messages
+    messages = await db.get_messages_by_chat_id(session, chat_id, sort, order)
 
     return  MessageCollection(
         meta={"count": len(messages)},
-        messages = sorted(messages, key=sort_key)
+        messages = messages
     )
     
     
 @chats_router.get("/{chat_id}/users", 
                   response_model =UserCollection,
                   description = "return list of users by given chat id" )
-def get_all_users_by_chat_id(
+async def get_all_users_by_chat_id(
     chat_id: int,
-    current_user: UserInDB = Depends(get_current_user),
+    current_user: Claims = Depends(get_current_claims),
     sort: Literal["id", "created_at"] = "id",
-    session: Session = Depends(db.get_session)
+    order: db.SortOrder = "asc",
+    session: AsyncSession = Depends(db.get_read_session)
 ):  
-    # get chat -> get user_ids -> return users
-    chat = db.get_chat_by_id(session, chat_id, current_user)
-    sort_key = lambda user: getattr(user, sort)
-    users = chat.users
+    # check the chat is visible -> return its users
+    await db.get_chat_by_id(session, chat_id, current_user)
+    users = await db.get_users_by_chat_id(session, chat_id, sort, order)
     
     return UserCollection(
         meta= {"count": len(users)},
-        users = sorted(users, key=sort_key)
+        users = users
     )
     
 @chats_router.post("/{chat_id}/messages",
                    response_model = MessageResponse ,
                    status_code = 201,)
-def create_message(
+async def create_message(
         chat_id: int,
         message_create: MessageCreate,
         current_user: UserInDB = Depends(get_current_user), 
-        session: Session = Depends(db.get_session)):
-    return MessageResponse(message = db.create_message(session, chat_id , message_create, current_user))
+        session: AsyncSession = Depends(db.get_session)):
+    return MessageResponse(message = await db.create_message(session, chat_id , message_create, current_user))
+
+@chats_router.post("/{chat_id}/messages/batch",
+                   response_model = MessageCollection,
+                   response_model_exclude_none = True,
+                   status_code = 201,
+                   description = "create many messages at once, in order")
+async def create_messages(
+        chat_id: int,
+        batch: MessageBatchCreate,
+        current_user: UserInDB = Depends(get_current_user),
+        session: AsyncSession = Depends(db.get_session)):
+    messages = await db.create_messages(session, chat_id, batch.messages, current_user)
+    return MessageCollection(meta={"count": len(messages)}, messages=messages)
 
 @chats_router.put("/{chat_id}/messages/{message_id}",
                   response_model= MessageResponse,
                   status_code=200,
                   description= "update message")
-def edit_message(message_id: int,
-                 chat_id: int,
-                 message_update: MessageUpdate,
-                 current_User: UserInDB = Depends(get_current_user), 
-                 session: Session = Depends(db.get_session)):
-    updated_message = db.update_message(session, chat_id ,message_id, message_update, current_User)
+async def edit_message(message_id: int,
+                       chat_id: int,
+                       message_update: MessageUpdate,
+                       current_User: UserInDB = Depends(get_current_user), 
+                       session: AsyncSession = Depends(db.get_session)):
+    updated_message = await db.update_message(session, chat_id ,message_id, message_update, current_User)
     return MessageResponse(message = updated_message)
 
 
 @chats_router.delete("/{chat_id}/messages/{message_id}",
                   status_code=204,
                   description= "delete message")
-def delete_message(message_id: int,
-                   chat_id: int,
-                   current_user: UserInDB = Depends(get_current_user),
-                   session: Session = Depends(db.get_session)) -> None:
-    delete_message = db.delete_message(session, chat_id, message_id, current_user)
+async def delete_message(message_id: int,
+                         chat_id: int,
+                         current_user: UserInDB = Depends(get_current_user),
+                         session: AsyncSession = Depends(db.get_session)) -> None:
+    delete_message = await db.delete_message(session, chat_id, message_id, current_user)
 
 
@@ -1,16 +1,18 @@
 from datetime import date
 from typing import Literal
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import JSONResponse
 
-from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 #   before we add some routes, we need to define some data models.
 #   entities.py
 
 from backend import database as db
+from backend import provisioning
 from backend.schema import (
+    BulkRegistrationCollection,
     UserCollection,
     UserResponse,
     User,
@@ -19,7 +21,7 @@ from backend.schema import (
     UserUpdate,
     
 )
-from backend.auth import get_current_user
+from backend.auth import get_current_user, require_admin
 
 
 #   define router,
@@ -34,18 +36,35 @@ users_router = APIRouter(prefix="/users", tags=["Users"])
 @users_router.get("",
                   description = "return a list of users",
                   response_model = UserCollection)
-def get_users(
+async def get_users(
         sort: Literal["id", "created_at"] = "id",
-        session: Session = Depends(db.get_session)):
-    
-    sort_key = lambda user: getattr(user, sort)
+        order: db.SortOrder = "asc",
+        session: AsyncSession = Depends(db.get_read_session)):
 
-    users = db.get_all_users(session)
+    users = await db.get_all_users(session, sort, order)
     return  UserCollection(
         meta={"count": len(users)},
-        users = sorted(users, key=sort_key)
+        users = users
     )
 
+@users_router.post("/bulk",
+                   description = "register the users of a JSONL body, one "
+                   "registration per line; admin only",
+                   response_model = BulkRegistrationCollection,
+                   dependencies = [Depends(require_admin)])
+async def register_users(
+        request: Request,
+        session: AsyncSession = Depends(db.get_session)):
+
+    try:
+        length = int(request.headers.get("content-length", 0))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid Content-Length")
+    if length > provisioning.MAX_BYTES:
+        raise provisioning.TooManyRows()
+    lines = await provisioning.read_lines(request.stream())
+    return await provisioning.register_users(session, lines)
+
 #The POST /users route should be deleted. This will be replaced by the POST /auth/registration route below.
 # @users_router.post("", 
 #                    description = "users creates a new user",
@@ -61,7 +80,7 @@ def get_users(
     the response adheres to the format:
 """
 @users_router.get("/me", response_model=UserResponse)
-def get_self(user: UserInDB = Depends(get_current_user)):
+async def get_self(user: UserInDB = Depends(get_current_user)):
     """Get current user."""
     return UserResponse(user=user)
 
@@ -70,10 +89,10 @@ def get_self(user: UserInDB = Depends(get_current_user)):
 @users_router.get("/{user_id}", 
                   response_model = UserResponse, 
                   description = "return users by given id")
-def get_user(user_id: int, session: Session = Depends(db.get_session)):
+async def get_user(user_id: int, session: AsyncSession = Depends(db.get_read_session)):
 
     return UserResponse(
-        user=db.get_user_by_id(session, user_id),
+        user=await db.get_user_by_id(session, user_id),
     )
 
 # GET /users/{user_id}/chats
@@ -81,16 +100,15 @@ def get_user(user_id: int, session: Session = Depends(db.get_session)):
                   response_model = ChatCollection,
                   description = "return a list of chats for a given user id",
                   )
-def get_user_chats(user_id: int,
-                   sort: Literal["id", "name", "created_at"] = "name",
-                   session: Session = Depends(db.get_session)):
-    
-    user = db.get_user_by_id(session, user_id)
-    
-    chats = user.chats
+async def get_user_chats(user_id: int,
+                         sort: Literal["id", "name", "created_at"] = "name",
+                         order: db.SortOrder = "asc",
+                         session: AsyncSession = Depends(db.get_read_session)):
+
+    chats = await db.get_chats_by_user_id(session, user_id, sort, order)
     return  ChatCollection(
         meta={"count": len(chats)},
-        chats = sorted(chats, key=lambda chat: chat.name),
+        chats = chats,
         
     )   
 
@@ -102,13 +120,13 @@ def get_user_chats(user_id: int,
 @users_router.put("/me", 
                   response_model=UserResponse,
                   description="update chat")
-def update_user(
+async def update_user(
     user_update: UserUpdate,
     user: UserInDB = Depends(get_current_user), 
-    session: Session = Depends(db.get_session),
+    session: AsyncSession = Depends(db.get_session),
 ):
 
-    updated_user = db.user_update(session, user, user_update)
+    updated_user = await db.user_update(session, user, user_update)
     return UserResponse(user=updated_user)
 
 
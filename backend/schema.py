@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
+from sqlalchemy import Index
 from sqlmodel import Field, Relationship, SQLModel
 from typing import Optional, List
 
@@ -16,6 +17,11 @@ class UserChatLinkInDB(SQLModel, table=True):
     """Database model for many-to-many relation of users to chats."""
 
     __tablename__ = "user_chat_links"
+    __table_args__ = (
+        # the primary key covers (user_id, chat_id); this serves chat -> users
+        Index("ix_user_chat_links_chat_id_user_id", "chat_id", "user_id"),
+    )
+
     user_id: int = Field(foreign_key="users.id", primary_key=True)
     chat_id: int = Field(foreign_key="chats.id", primary_key=True)
 
@@ -23,12 +29,17 @@ class UserInDB(SQLModel, table=True):
     """Database model for user."""
 
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_created_at_id", "created_at", "id"),
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
     username: str = Field(unique=True, index=True)
     email: str = Field(unique=True)
     hashed_password: str
     created_at: Optional[datetime] = Field(default_factory=datetime.now)
+    # bumped to revoke every token issued to the user so far
+    token_version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
 
     chats: list["ChatInDB"] = Relationship(
         back_populates="users",
@@ -39,11 +50,18 @@ class ChatInDB(SQLModel, table=True):
     """Database model for chat."""
 
     __tablename__ = "chats"
+    __table_args__ = (
+        Index("ix_chats_name_id", "name", "id"),
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
     owner_id: int = Field(foreign_key="users.id")
     created_at: Optional[datetime] = Field(default_factory=datetime.now)
+    # denormalized counters, maintained by backend/database.py and
+    # repaired by backend/reconcile.py
+    message_count: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    member_count: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
 
     owner: UserInDB = Relationship()
     users: list[UserInDB] = Relationship(
@@ -57,10 +75,16 @@ class MessageInDB(SQLModel, table=True):
     """Database model for message."""
 
     __tablename__ = "messages"
+    __table_args__ = (
+        # message listings filter by chat and page on (created_at, id)
+        Index("ix_messages_chat_id_created_at_id", "chat_id", "created_at", "id"),
+        # ... or list by id, the default order
+        Index("ix_messages_chat_id_id", "chat_id", "id"),
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
     text: str
-    user_id: int = Field(foreign_key="users.id")
+    user_id: int = Field(foreign_key="users.id", index=True)
     chat_id: int = Field(foreign_key="chats.id")
     created_at: Optional[datetime] = Field(default_factory=datetime.now)
 
@@ -92,6 +116,10 @@ class UserDetail(BaseModel):
 class MessageCreate(BaseModel):
     text: str
 
+class MessageBatchCreate(BaseModel):
+    """Request body for posting many messages at once."""
+    messages: list[MessageCreate] = Field(min_length=1, max_length=5000)
+
 class ChatUpdate(BaseModel):
     name: str = None
     text: str
@@ -129,6 +157,18 @@ class UserResponse2(BaseModel):
 class UserCollection(BaseModel):
     meta: Meta
     users: list[User]
+
+class BulkRegistrationMeta(Meta):
+    error_count: int
+
+class BulkRegistrationError(BaseModel):
+    line: int  # 1-based line of the JSONL input
+    detail: dict
+
+class BulkRegistrationCollection(BaseModel):
+    meta: BulkRegistrationMeta
+    users: list[User]
+    errors: list[BulkRegistrationError]
 # ------------------------------------- #
 #              Chat API                 #
 # ------------------------------------- #
@@ -169,10 +209,27 @@ class MessageUpdate(BaseModel):
 
 
 
+class MessageMeta(Meta):
+    """Metadata for a page of messages.
+
+    The cursors are opaque; pass `prev_cursor` as `before` to page towards
+    older messages and `next_cursor` as `after` to poll for newer ones.
+    """
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+
 class MessageCollection(BaseModel):
-    meta: Meta
+    meta: MessageMeta
     messages: list[Message]
     
+class MessageSearchMeta(Meta):
+    next_offset: Optional[int] = None
+
+class MessageSearchCollection(BaseModel):
+    meta: MessageSearchMeta
+    messages: list[Message]
+
 class MessageResponse(BaseModel):
     message: Message
         
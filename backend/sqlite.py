@@ -0,0 +1,62 @@
+"""Tuned SQLite mode for small single node deployments.
+
+Enabled with SQLITE_TUNED=1. Every connection is set up with
+
+    journal_mode=WAL       readers no longer block behind the writer
+    synchronous=NORMAL     fsync at checkpoints instead of every commit
+    busy_timeout           wait for locks instead of failing immediately
+    mmap_size, cache_size  serve hot pages from memory
+
+and writes go through a pool of exactly one connection, so writers queue
+in the application instead of fighting over the database lock, while reads
+use a separate pool (see backend/database.py).
+
+The sizes can be overridden with SQLITE_BUSY_TIMEOUT_MS, SQLITE_MMAP_SIZE,
+SQLITE_CACHE_SIZE_KB and SQLITE_READ_POOL_SIZE.
+"""
+import os
+
+from sqlalchemy import event
+
+
+def tuned() -> bool:
+    return os.environ.get("SQLITE_TUNED", default="False").lower() in ("true", "1", "t")
+
+
+def pragmas() -> dict[str, str]:
+    """The pragmas applied to every connection, in order."""
+    return {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"),
+        "mmap_size": os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)),
+        # a negative cache_size is in KiB rather than pages
+        "cache_size": f"-{os.environ.get('SQLITE_CACHE_SIZE_KB', '65536')}",
+        "temp_store": "MEMORY",
+    }
+
+
+def writer_pool_options() -> dict:
+    """A single connection, so that writes are serialized in the pool."""
+    return {"pool_size": 1, "max_overflow": 0}
+
+
+def reader_pool_options() -> dict:
+    size = int(os.environ.get("SQLITE_READ_POOL_SIZE", "8"))
+    return {"pool_size": size, "max_overflow": 0}
+
+
+def install(engine):
+    """
+    Apply the pragmas whenever the engine opens a connection.
+
+    :param engine: a sync Engine, or the `sync_engine` of an AsyncEngine
+    """
+    settings = pragmas()
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, _connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in settings.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
@@ -0,0 +1,130 @@
+"""In-process caches for request authentication.
+
+`users` maps user ids to the user records loaded by `get_current_user`,
+and `claims` maps access tokens to their decoded claims, so that a request
+from a recently seen user authenticates without touching the database.
+
+Entries expire after USER_CACHE_TTL_SECONDS (default 60; 0 disables the
+caches) and the least recently used ones are evicted beyond USER_CACHE_SIZE
+(default 10000). `user_update` and `delete_user` invalidate the user in
+this process; other processes (e.g. other Lambda instances) may serve the
+old record until it expires.
+
+`revoked` keeps the token version of users whose tokens were revoked (or
+seen revoked in the database) for as long as the old access tokens live.
+It is neither size bounded nor tied to USER_CACHE_TTL_SECONDS, so a revoked
+token stays rejected when the user's cache entry is gone.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """A bounded LRU mapping whose entries expire."""
+
+    def __init__(self, maxsize: int, ttl: float, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > self._clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl: float = None):
+        """
+        Store a value.
+
+        :param ttl: seconds the entry lives, capped at the cache's ttl
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, self._clock() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RevokedVersions:
+    """User ids mapped to their current token version, until a deadline."""
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._versions: dict[int, tuple[int, float]] = {}
+        self._lock = threading.Lock()
+
+    def revoke(self, user_id: int, version: int, lifetime: float):
+        """
+        Reject tokens of a user older than `version`.
+
+        :param lifetime: seconds to remember it, the access token duration
+        """
+        now = self._clock()
+        with self._lock:
+            # forget what has expired, so the map only holds recent revocations
+            for key in [k for k, (_, until) in self._versions.items() if until <= now]:
+                del self._versions[key]
+            known = self._versions.get(user_id)
+            if known is None or known[0] <= version:
+                self._versions[user_id] = (version, now + lifetime)
+
+    def is_revoked(self, user_id: int, version: int) -> bool:
+        entry = self._versions.get(user_id)
+        return entry is not None and entry[1] > self._clock() and version < entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._versions.clear()
+
+    def __len__(self) -> int:
+        return len(self._versions)
+
+
+def _ttl() -> float:
+    return float(os.environ.get("USER_CACHE_TTL_SECONDS", "60"))
+
+
+def _size() -> int:
+    return int(os.environ.get("USER_CACHE_SIZE", "10000"))
+
+
+users = TTLCache(_size(), _ttl())
+claims = TTLCache(_size(), _ttl())
+revoked = RevokedVersions()
+
+
+def invalidate_user(user_id: int):
+    users.invalidate(user_id)
+
+
+def clear():
+    users.clear()
+    claims.clear()
+    revoked.clear()
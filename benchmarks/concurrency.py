@@ -0,0 +1,169 @@
+"""Concurrent throughput of the async request path.
+
+Compares the async `GET /chats/{chat_id}/messages` handler against a
+blocking baseline that mirrors the old `def` handlers: a sync Session on
+Starlette's threadpool, which admits 40 requests at a time.
+
+SQLite answers in microseconds, which hides what the threadpool costs
+against a networked database. `--db-latency-ms` adds a delay to every
+statement inside the driver's own thread (not on the event loop), the way
+a round trip to RDS would.
+
+usage:
+    python -m benchmarks.concurrency --concurrency 200 --db-latency-ms 5
+"""
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import Session, SQLModel, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from backend import database as db
+from backend.auth import _build_access_token
+from backend.main import app
+from backend.schema import (
+    ChatInDB,
+    MessageCollection,
+    MessageInDB,
+    UserChatLinkInDB,
+    UserInDB,
+)
+
+
+def _seed(engine, members: int, messages: int) -> tuple[int, UserInDB]:
+    SQLModel.metadata.create_all(engine)
+    with Session(engine, expire_on_commit=False) as session:
+        users = [
+            UserInDB(username=f"user{i}", email=f"user{i}@example.com",
+                     hashed_password="x")
+            for i in range(members)
+        ]
+        session.add_all(users)
+        session.commit()
+        chat = ChatInDB(name="bench", owner_id=users[0].id)
+        session.add(chat)
+        session.commit()
+        session.add_all(
+            UserChatLinkInDB(user_id=user.id, chat_id=chat.id) for user in users
+        )
+        session.add_all(
+            MessageInDB(text=f"message {i}", user_id=users[i % members].id,
+                        chat_id=chat.id)
+            for i in range(messages)
+        )
+        session.commit()
+        return chat.id, users[0]
+
+
+def _add_latency(engine, latency: float):
+    def _sleep(_statement):
+        time.sleep(latency)
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, _record):
+        if hasattr(dbapi_connection, "run_async"):
+            dbapi_connection.run_async(
+                lambda connection: connection.set_trace_callback(_sleep)
+            )
+        else:
+            dbapi_connection.set_trace_callback(_sleep)
+
+
+def _blocking_app(engine) -> FastAPI:
+    """The messages route as it was before the async rewrite."""
+    blocking = FastAPI()
+
+    def get_session():
+        with Session(engine, expire_on_commit=False) as session:
+            yield session
+
+    @blocking.get("/chats/{chat_id}/messages", response_model=MessageCollection)
+    def get_messages(chat_id: int, user_id: int, limit: int = 50,
+                     session: Session = Depends(get_session)):
+        session.get(UserInDB, user_id)
+        session.exec(select(UserChatLinkInDB).where(
+            (UserChatLinkInDB.user_id == user_id)
+            & (UserChatLinkInDB.chat_id == chat_id)
+        )).first()
+        messages = session.exec(
+            db.chat_messages_query(chat_id, "id", "desc").limit(limit)
+        ).all()
+        return MessageCollection(meta={"count": len(messages)}, messages=messages)
+
+    return blocking
+
+
+async def _drive(target: FastAPI, url: str, headers: dict,
+                 concurrency: int, requests: int) -> dict:
+    transport = httpx.ASGITransport(app=target)
+    latencies = []
+    remaining = iter(range(requests))
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            for _ in remaining:
+                start = time.perf_counter()
+                response = await client.get(url, headers=headers)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests/s": round(requests / elapsed, 1),
+        "p50 ms": round(statistics.median(latencies) * 1000, 1),
+        "p99 ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 1),
+    }
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.concurrency")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--db-latency-ms", type=float, default=5.0)
+    args = parser.parse_args(argv)
+
+    path = Path(tempfile.mkdtemp()) / "bench.db"
+    pool = {"pool_size": args.concurrency, "max_overflow": 0}
+    engine = create_engine(f"sqlite:///{path}",
+                           connect_args={"check_same_thread": False}, **pool)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}", **pool)
+    chat_id, user = _seed(engine, members=10, messages=args.messages)
+    for target in (engine, async_engine.sync_engine):
+        _add_latency(target, args.db_latency_ms / 1000)
+
+    async def get_session():
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            yield session
+
+    app.dependency_overrides[db.get_session] = get_session
+    app.dependency_overrides[db.get_read_session] = get_session
+    token = _build_access_token(user).access_token
+    runs = {
+        "async": (app, f"/chats/{chat_id}/messages?limit=50",
+                  {"Authorization": f"Bearer {token}"}),
+        "blocking": (_blocking_app(engine),
+                     f"/chats/{chat_id}/messages?limit=50&user_id={user.id}", {}),
+    }
+    for name, (target, url, headers) in runs.items():
+        result = asyncio.run(
+            _drive(target, url, headers, args.concurrency, args.requests)
+        )
+        print(f"{name:>8}: {result}")
+    app.dependency_overrides.clear()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""Microbenchmarks of the database and auth hot paths.
+
+Every function is timed against generated databases of several sizes (see
+backend/data_generator.py; the databases are cached in --data-dir). The
+median time per call is appended to a history file, and the run fails
+when a function is more than --threshold slower than the median of its
+last --baseline runs of the same size.
+
+usage:
+    python -m benchmarks.hot_paths --sizes small,medium
+    python -m benchmarks.hot_paths --no-save    # compare only
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from backend import auth, data_generator, migrations, user_cache
+from backend import database as db
+from backend.schema import (
+    Chat,
+    ChatCollection,
+    ChatInDB,
+    MessageCollection,
+    MessageCreate,
+    MessageInDB,
+    MessageUpdate,
+    UserInDB,
+)
+
+SIZES = {
+    "small": data_generator.Shape(users=200, chats=50, messages=5_000),
+    "medium": data_generator.Shape(users=2_000, chats=500, messages=100_000),
+    "large": data_generator.Shape(users=20_000, chats=2_000, messages=1_000_000),
+}
+
+DEFAULT_HISTORY = Path(__file__).parent / ".history.jsonl"
+
+
+def _database(data_dir: Path, size: str) -> Path:
+    """Generate the database of a size, or reuse the one from an earlier run."""
+    path = data_dir / f"hot_paths_{size}.db"
+    engine = create_engine(f"sqlite:///{path}")
+    migrations.upgrade(engine)
+    data_generator.generate(engine, SIZES[size])
+    engine.dispose()
+    return path
+
+
+async def _time(call, repeat: int, warmup: int = 3) -> dict[str, float]:
+    for _ in range(warmup):
+        await call()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await call()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "median_ms": round(statistics.median(timings) * 1000, 4),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1] * 1000, 4),
+    }
+
+
+async def _run_size(path: Path, repeat: int) -> dict[str, dict]:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+
+    async def in_session(operation):
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            return await operation(session)
+
+    # the owner of the largest (and busiest) chat
+    chat_id = 1
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        chat = await session.get(ChatInDB, chat_id)
+        user = await session.get(UserInDB, chat.owner_id)
+        message = (await session.exec(
+            select(MessageInDB).where(
+                (MessageInDB.chat_id == chat_id) & (MessageInDB.user_id == user.id)
+            ).limit(1)
+        )).first()
+        if message is None:
+            message = await db.create_message(
+                session, chat_id, MessageCreate(text="benchmark"), user,
+            )
+        chats = await db.get_all_chats(session, user)
+        messages = (await db.get_messages_page(session, chat_id, 50))[0]
+    token = auth._build_access_token(user).access_token
+
+    async def sync(function, *args):
+        function(*args)
+
+    async def uncached(operation):
+        # time the database path, not a lookup in the authentication cache
+        user_cache.clear()
+        return await in_session(operation)
+
+    benchmarks = {
+        "get_all_chats": lambda: in_session(
+            lambda session: db.get_all_chats(session, user)
+        ),
+        "get_chat_by_id": lambda: in_session(
+            lambda session: db.get_chat_by_id(session, chat_id, user)
+        ),
+        "create_message": lambda: in_session(
+            lambda session: db.create_message(
+                session, chat_id, MessageCreate(text="benchmark"), user,
+            )
+        ),
+        "update_message": lambda: in_session(
+            lambda session: db.update_message(
+                session, chat_id, message.id, MessageUpdate(text="edited"), user,
+            )
+        ),
+        "user_in_chat_view": lambda: in_session(
+            lambda session: db.user_in_chat_view(session, chat_id, user)
+        ),
+        "_decode_access_token": lambda: uncached(
+            lambda session: auth._decode_access_token(session, token)
+        ),
+        "_decode_access_token_cached": lambda: in_session(
+            lambda session: auth._decode_access_token(session, token)
+        ),
+        "_build_access_token": lambda: sync(auth._build_access_token, user),
+        "serialize_chats": lambda: sync(
+            lambda: ChatCollection(
+                meta={"count": len(chats)},
+                chats=[Chat.model_validate(chat) for chat in chats],
+            ).model_dump_json()
+        ),
+        "serialize_messages": lambda: sync(
+            lambda: MessageCollection(
+                meta={"count": len(messages)}, messages=messages,
+            ).model_dump_json()
+        ),
+    }
+
+    results = {}
+    for name, call in benchmarks.items():
+        results[name] = await _time(call, repeat)
+        print(f"  {name:<28} {results[name]}")
+    await engine.dispose()
+    return results
+
+
+def load_history(path: Path) -> list[dict]:
+    if not path.exists():
+        return []
+    with path.open() as history:
+        return [json.loads(line) for line in history if line.strip()]
+
+
+def regressions(history: list[dict], results: dict[str, dict[str, dict]],
+                threshold: float, baseline: int) -> list[str]:
+    """
+    Compare results with the median of the last `baseline` runs.
+
+    :param results: median/p95 timings by size and function
+    :param threshold: allowed slowdown, 0.25 allows 25%
+    :return: a description of every regression
+    """
+    found = []
+    for size, timings in results.items():
+        for name, timing in timings.items():
+            previous = [
+                run["results"][size][name]["median_ms"]
+                for run in history
+                if name in run["results"].get(size, {})
+            ][-baseline:]
+            if not previous:
+                continue
+            reference = statistics.median(previous)
+            if timing["median_ms"] > reference * (1 + threshold):
+                found.append(
+                    f"{size}/{name}: {timing['median_ms']} ms, "
+                    f"baseline {reference} ms ({timing['median_ms'] / reference - 1:+.0%})"
+                )
+    return found
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.hot_paths")
+    parser.add_argument("--sizes", default="small,medium")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--threshold", type=float, default=0.25)
+    parser.add_argument("--baseline", type=int, default=5,
+                        help="number of earlier runs to compare against")
+    parser.add_argument("--history", type=Path, default=DEFAULT_HISTORY)
+    parser.add_argument("--data-dir", type=Path,
+                        default=Path(tempfile.gettempdir()) / "pony_express_bench")
+    parser.add_argument("--no-save", action="store_true",
+                        help="do not append this run to the history")
+    args = parser.parse_args(argv)
+
+    args.data_dir.mkdir(parents=True, exist_ok=True)
+    results = {}
+    for size in args.sizes.split(","):
+        print(f"{size}:")
+        results[size] = asyncio.run(
+            _run_size(_database(args.data_dir, size), args.repeat)
+        )
+
+    history = load_history(args.history)
+    found = regressions(history, results, args.threshold, args.baseline)
+    if not args.no_save:
+        with args.history.open("a") as out:
+            out.write(json.dumps({
+                "at": datetime.now().isoformat(timespec="seconds"),
+                "commit": _commit(),
+                "results": results,
+            }) + "\n")
+
+    for regression in found:
+        print(f"REGRESSION {regression}")
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
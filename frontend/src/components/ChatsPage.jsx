@@ -1,8 +1,8 @@
-import React, { useState } from "react";
+import React, { useEffect, useState } from "react";
 import { useQuery, useMutation, useQueryClient } from "react-query";
 import { Link, Navigate, useNavigate, useParams } from "react-router-dom";
 import NewMessage from "./NewMessage";
-import { useApi, useUser } from "../hooks";
+import { useApi, useAuth, useUser } from "../hooks";
 import MessageMenu from "./MessageMenu";
 import EditMessage from "./EditMessage";
 const h3ClassName =
@@ -42,6 +42,78 @@ function ChatCard({ chat, active }) {
   );
 }
 
+// reconnect delays of the live messages, doubling from the first to the last
+const reconnectMinMs = 1000;
+const reconnectMaxMs = 30000;
+// closed for a missing, invalid or expired token: reconnecting cannot help
+const policyViolation = 1008;
+
+// keep the cached messages of the open chat up to date from its WebSocket
+function useLiveMessages(chatId) {
+  const api = useApi();
+  const { token } = useAuth();
+  const queryClient = useQueryClient();
+
+  useEffect(() => {
+    if (!chatId) {
+      return;
+    }
+    let socket;
+    let timer;
+    let delay = reconnectMinMs;
+    let reconnected = false;
+
+    const connect = () => {
+      socket = api.socket(`/chats/${chatId}/ws`);
+      socket.onmessage = (event) => {
+        const { type, message, messages: batch } = JSON.parse(event.data);
+        if (type === "ready") {
+          delay = reconnectMinMs;
+          if (reconnected) {
+            // re-fetch what was missed while disconnected
+            queryClient.invalidateQueries(["chats", chatId]);
+          }
+          return;
+        }
+        if (!type.startsWith("message")) {
+          return; // ping
+        }
+        // a batch arrives as one "messages.created" event
+        const changed = batch ?? [message];
+        queryClient.setQueryData(["chats", chatId], (data) => {
+          if (!data?.messages) {
+            return data;
+          }
+          const ids = new Set(changed.map((m) => m.id));
+          let messages = data.messages.filter((m) => !ids.has(m.id));
+          if (type !== "message.deleted") {
+            messages = [...messages, ...changed].sort((a, b) => a.id - b.id);
+          }
+          return { ...data, meta: { ...data.meta, count: messages.length }, messages };
+        });
+      };
+      // server restart or dropped for falling behind; a new token (after
+      // logging in again) reconnects through the effect's dependencies
+      socket.onclose = (event) => {
+        if (event.code === policyViolation) {
+          queryClient.invalidateQueries(["chats", chatId]);
+          return;
+        }
+        reconnected = true;
+        timer = setTimeout(connect, delay);
+        delay = Math.min(delay * 2, reconnectMaxMs);
+      };
+    };
+
+    connect();
+    return () => {
+      clearTimeout(timer);
+      socket.onclose = null;
+      socket.close();
+    };
+  }, [chatId, token]);
+}
+
 function MessageQuery() {
   // getting chatId
   const api = useApi();
@@ -62,6 +134,7 @@ function MessageQuery() {
           })
         : undefined,
   });
+  useLiveMessages(chatId);
   if (!chatId) {
     return <MessageContainer messages={[]} />;
   }
@@ -51,7 +51,15 @@ const api = (token) => {
       },
     });
 
-  return { get, post, postForm, remove, put};
+  // socket("/chats/1/ws") ~> live events; browsers cannot set headers on
+  // WebSockets and query strings are logged, so the token is the first message
+  const socket = (url) => {
+    const ws = new WebSocket(baseUrl.replace(/^http/, "ws") + url);
+    ws.addEventListener("open", () => ws.send(JSON.stringify({ token })));
+    return ws;
+  };
+
+  return { get, post, postForm, remove, put, socket };
 };
 
 export default api;
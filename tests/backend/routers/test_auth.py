@@ -0,0 +1,66 @@
+from backend import user_cache
+from backend.auth import _build_access_token
+
+
+def test_read_routes_authenticate_from_the_claims(
+    client, chat_factory, statements, auth_headers,
+):
+    chat_id, (user,) = chat_factory(["ripley"], message_count=2)
+    headers = auth_headers(user)
+
+    statements.clear()
+    response = client.get(f"/chats/{chat_id}/messages", headers=headers)
+    assert response.status_code == 200
+    # the message authors are loaded, but not the bearer token's user
+    assert not any("users.id = ?" in s for s in statements)
+
+
+def test_refresh_token_pair(client, chat_factory):
+    _chat_id, (user,) = chat_factory(["ripley"])
+    tokens = _build_access_token(user)
+    assert tokens.refresh_token is not None
+
+    response = client.post("/auth/refresh", json={"refresh_token": tokens.refresh_token})
+    assert response.status_code == 200
+    refreshed = response.json()
+    me = client.get(
+        "/users/me", headers={"Authorization": f"Bearer {refreshed['access_token']}"},
+    )
+    assert me.json()["user"]["username"] == "ripley"
+
+    # an access token is not a refresh token, and the other way around
+    response = client.post("/auth/refresh", json={"refresh_token": tokens.access_token})
+    assert response.status_code == 401
+    response = client.get(
+        "/users/me", headers={"Authorization": f"Bearer {tokens.refresh_token}"},
+    )
+    assert response.status_code == 401
+
+
+def test_revoke_invalidates_every_token(client, chat_factory):
+    chat_id, (user,) = chat_factory(["ripley"])
+    tokens = _build_access_token(user)
+    headers = {"Authorization": f"Bearer {tokens.access_token}"}
+    assert client.get(f"/chats/{chat_id}", headers=headers).status_code == 200
+
+    assert client.post("/auth/revoke", headers=headers).status_code == 204
+
+    assert client.get(f"/chats/{chat_id}", headers=headers).status_code == 401
+    response = client.post("/auth/refresh", json={"refresh_token": tokens.refresh_token})
+    assert response.status_code == 401
+    # a cold cache falls back to the database, which has the new version too
+    user_cache.clear()
+    assert client.get("/users/me", headers=headers).status_code == 401
+
+
+def test_revocation_outlives_the_user_cache(client, chat_factory, auth_headers):
+    chat_id, (user,) = chat_factory(["ripley"])
+    headers = auth_headers(user)
+
+    assert client.post("/auth/revoke", headers=headers).status_code == 204
+    # e.g. expired after USER_CACHE_TTL_SECONDS or evicted
+    user_cache.users.clear()
+    user_cache.claims.clear()
+
+    assert client.get(f"/chats/{chat_id}", headers=headers).status_code == 401
+    assert client.get(f"/chats/{chat_id}/messages", headers=headers).status_code == 401
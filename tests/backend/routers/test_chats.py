@@ -0,0 +1,291 @@
+import pytest
+
+from backend import database as db
+
+
+def test_messages_cursor_pagination(client, chat_factory, auth_headers):
+    chat_id, (user, _) = chat_factory(["ripley", "bishop"], message_count=7)
+    headers = auth_headers(user)
+
+    response = client.get(f"/chats/{chat_id}/messages?limit=3", headers=headers)
+    assert response.status_code == 200
+    page = response.json()
+    assert [m["text"] for m in page["messages"]] == [
+        "message 4", "message 5", "message 6",
+    ]
+    assert page["meta"]["count"] == 3
+
+    seen = page["messages"]
+    while "prev_cursor" in page["meta"]:
+        response = client.get(
+            f"/chats/{chat_id}/messages",
+            params={"limit": 3, "before": page["meta"]["prev_cursor"]},
+            headers=headers,
+        )
+        page = response.json()
+        seen = page["messages"] + seen
+
+    assert [m["text"] for m in seen] == [f"message {i}" for i in range(7)]
+
+
+def test_messages_cursor_polling(client, chat_factory, auth_headers):
+    chat_id, (user,) = chat_factory(["ripley"], message_count=2)
+    headers = auth_headers(user)
+
+    page = client.get(f"/chats/{chat_id}/messages?limit=10", headers=headers).json()
+    cursor = page["meta"]["next_cursor"]
+
+    response = client.get(
+        f"/chats/{chat_id}/messages", params={"after": cursor}, headers=headers,
+    )
+    assert response.json()["messages"] == []
+    assert response.json()["meta"]["next_cursor"] == cursor
+
+    client.post(f"/chats/{chat_id}/messages", json={"text": "new"}, headers=headers)
+    response = client.get(
+        f"/chats/{chat_id}/messages", params={"after": cursor}, headers=headers,
+    )
+    assert [m["text"] for m in response.json()["messages"]] == ["new"]
+
+
+def test_messages_invalid_cursor(client, chat_factory, auth_headers):
+    chat_id, (user,) = chat_factory(["ripley"], message_count=1)
+
+    response = client.get(
+        f"/chats/{chat_id}/messages?before=garbage", headers=auth_headers(user),
+    )
+    assert response.status_code == 422
+    assert response.json()["detail"]["type"] == "invalid_cursor"
+
+
+def test_sort_order_is_applied(client, chat_factory, auth_headers):
+    chat_id, (user, _) = chat_factory(["ripley", "bishop"], message_count=4)
+    headers = auth_headers(user)
+
+    response = client.get(
+        f"/chats/{chat_id}/messages?sort=created_at&order=desc", headers=headers,
+    )
+    texts = [m["text"] for m in response.json()["messages"]]
+    assert texts == ["message 3", "message 2", "message 1", "message 0"]
+
+    response = client.get(f"/chats/{chat_id}/users?order=desc", headers=headers)
+    users = response.json()["users"]
+    assert [u["username"] for u in users] == ["bishop", "ripley"]
+
+    response = client.get(f"/users/{user.id}/chats?sort=id")
+    assert [c["id"] for c in response.json()["chats"]] == [chat_id]
+
+
+@pytest.mark.parametrize("path", ["/chats", "/chats/{chat_id}/messages"])
+def test_query_count_does_not_grow_with_rows(
+    client, chat_factory, statements, auth_headers, path,
+):
+    counts = []
+    for size in (2, 20):
+        members = [f"user{size}_{i}" for i in range(size)]
+        chat_id, users = chat_factory(members, message_count=size)
+        headers = auth_headers(users[0])
+
+        statements.clear()
+        response = client.get(path.format(chat_id=chat_id), headers=headers)
+        assert response.status_code == 200
+        counts.append(len(statements))
+
+    assert counts[0] == counts[1]
+
+
+def test_chat_meta_counters(client, session, chat_factory, auth_headers):
+    chat_id, (user, _) = chat_factory(["ripley", "bishop"], message_count=3)
+    headers = auth_headers(user)
+
+    # the factory inserts rows directly, bypassing the counters
+    assert db.reconcile_chat_counters(session) == 1
+    assert db.reconcile_chat_counters(session) == 0
+
+    response = client.post(
+        f"/chats/{chat_id}/messages", json={"text": "hi"}, headers=headers,
+    )
+    message_id = response.json()["message"]["id"]
+    meta = client.get(f"/chats/{chat_id}", headers=headers).json()["meta"]
+    assert meta == {"message_count": 4, "user_count": 2}
+
+    client.delete(f"/chats/{chat_id}/messages/{message_id}", headers=headers)
+    meta = client.get(f"/chats/{chat_id}", headers=headers).json()["meta"]
+    assert meta == {"message_count": 3, "user_count": 2}
+
+
+def test_message_write_permissions(client, chat_factory, auth_headers):
+    chat_id, (owner, member) = chat_factory(["ripley", "bishop"])
+    other_chat_id, (outsider,) = chat_factory(["burke"])
+    message_id = client.post(
+        f"/chats/{chat_id}/messages", json={"text": "hi"}, headers=auth_headers(owner),
+    ).json()["message"]["id"]
+    url = f"/chats/{chat_id}/messages/{message_id}"
+
+    response = client.put(url, json={"text": "x"}, headers=auth_headers(member))
+    assert response.status_code == 403
+    assert response.json()["detail"]["error_description"] == (
+        "requires permission to edit message"
+    )
+
+    response = client.delete(url, headers=auth_headers(outsider))
+    assert response.status_code == 403
+    assert response.json()["detail"]["error_description"] == (
+        "requires permission to view chat"
+    )
+
+    response = client.post(
+        f"/chats/{chat_id}/messages", json={"text": "x"}, headers=auth_headers(outsider),
+    )
+    assert response.status_code == 403
+
+    response = client.put(
+        f"/chats/{chat_id}/messages/9999", json={"text": "x"}, headers=auth_headers(owner),
+    )
+    assert response.status_code == 404
+    assert response.json()["detail"]["entity_name"] == "message"
+
+    response = client.put(url, json={"text": "edited"}, headers=auth_headers(owner))
+    assert response.status_code == 200
+    assert response.json()["message"]["text"] == "edited"
+    assert response.json()["message"]["user"]["username"] == "ripley"
+
+    assert client.delete(url, headers=auth_headers(owner)).status_code == 204
+    assert client.delete(url, headers=auth_headers(owner)).status_code == 404
+
+
+def test_message_update_is_one_statement(client, chat_factory, statements, auth_headers):
+    chat_id, (user,) = chat_factory(["ripley"], message_count=1)
+    headers = auth_headers(user)
+    message_id = client.get(
+        f"/chats/{chat_id}/messages", headers=headers,
+    ).json()["messages"][0]["id"]
+    client.get("/users/me", headers=headers)
+
+    statements.clear()
+    client.put(
+        f"/chats/{chat_id}/messages/{message_id}", json={"text": "x"}, headers=headers,
+    )
+    # the bearer token's user is cached by /users/me (the chat routes read
+    # the claims only), leaving the guarded UPDATE
+    assert [s.split()[0] for s in statements] == ["UPDATE"]
+
+
+def test_message_search(client, chat_factory, auth_headers):
+    chat_id, (user, _) = chat_factory(["ripley", "bishop"])
+    other_chat_id, (outsider,) = chat_factory(["burke"])
+    headers = auth_headers(user)
+    for text in ["the alien is loose", "check the airlock", "alien alien alien"]:
+        client.post(f"/chats/{chat_id}/messages", json={"text": text}, headers=headers)
+    client.post(
+        f"/chats/{other_chat_id}/messages", json={"text": "alien specimen"},
+        headers=auth_headers(outsider),
+    )
+
+    response = client.get(
+        f"/chats/{chat_id}/messages/search", params={"q": "aliens", "limit": 1},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    page = response.json()
+    # stemmed, ranked, and paginated
+    assert [m["text"] for m in page["messages"]] == ["alien alien alien"]
+    assert page["meta"] == {"count": 1, "next_offset": 1}
+
+    response = client.get(
+        "/chats/messages/search", params={"q": 'alien "'}, headers=headers,
+    )
+    texts = [m["text"] for m in response.json()["messages"]]
+    assert sorted(texts) == ["alien alien alien", "the alien is loose"]
+    assert "next_offset" not in response.json()["meta"]
+
+    response = client.get(
+        f"/chats/{chat_id}/messages/search", params={"q": "alien"},
+        headers=auth_headers(outsider),
+    )
+    assert response.status_code == 403
+
+
+def test_message_search_follows_edits(client, chat_factory, auth_headers):
+    chat_id, (user,) = chat_factory(["ripley"])
+    headers = auth_headers(user)
+    message_id = client.post(
+        f"/chats/{chat_id}/messages", json={"text": "nostromo"}, headers=headers,
+    ).json()["message"]["id"]
+
+    def search(q):
+        response = client.get(
+            f"/chats/{chat_id}/messages/search", params={"q": q}, headers=headers,
+        )
+        return [m["id"] for m in response.json()["messages"]]
+
+    assert search("nostromo") == [message_id]
+    client.put(
+        f"/chats/{chat_id}/messages/{message_id}", json={"text": "sulaco"},
+        headers=headers,
+    )
+    assert search("nostromo") == []
+    assert search("sulaco") == [message_id]
+    client.delete(f"/chats/{chat_id}/messages/{message_id}", headers=headers)
+    assert search("sulaco") == []
+
+
+def test_create_messages_batch(client, chat_factory, statements, auth_headers):
+    chat_id, (user, _) = chat_factory(["ripley", "bishop"])
+    other_chat_id, (outsider,) = chat_factory(["burke"])
+    batch = {"messages": [{"text": f"line {i}"} for i in range(25)]}
+
+    statements.clear()
+    response = client.post(
+        f"/chats/{chat_id}/messages/batch", json=batch, headers=auth_headers(user),
+    )
+    assert response.status_code == 201
+    messages = response.json()["messages"]
+    assert [m["text"] for m in messages] == [f"line {i}" for i in range(25)]
+    assert {m["user"]["username"] for m in messages} == {"ripley"}
+    assert len([s for s in statements if s.startswith("INSERT")]) == 1
+
+    meta = client.get(f"/chats/{chat_id}", headers=auth_headers(user)).json()["meta"]
+    assert meta["message_count"] == 25
+
+    response = client.post(
+        f"/chats/{chat_id}/messages/batch", json=batch, headers=auth_headers(outsider),
+    )
+    assert response.status_code == 403
+
+    response = client.post(
+        f"/chats/{chat_id}/messages/batch", json={"messages": []},
+        headers=auth_headers(user),
+    )
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize("path, max_queries", [
+    ("/chats", 3),
+    ("/chats/{chat_id}", 4),
+    ("/chats/{chat_id}?include=users&include=messages", 6),
+    ("/chats/{chat_id}/messages", 5),
+    ("/chats/{chat_id}/messages?limit=10", 5),
+    ("/chats/{chat_id}/users", 4),
+])
+def test_chat_routes_query_bound(
+    client, chat_factory, query_bound, auth_headers, path, max_queries,
+):
+    def request(size):
+        members = [f"user{size}_{i}" for i in range(size)]
+        chat_id, users = chat_factory(members, message_count=size)
+        return client.get(path.format(chat_id=chat_id), headers=auth_headers(users[0]))
+
+    query_bound(request, max_queries)
+
+
+def test_query_headers_are_behind_a_flag(client, chat_factory, monkeypatch, auth_headers):
+    chat_id, (user,) = chat_factory(["ripley"])
+    monkeypatch.delenv("DB_QUERY_HEADERS", raising=False)
+    response = client.get("/chats", headers=auth_headers(user))
+    assert "X-DB-Queries" not in response.headers
+
+    monkeypatch.setenv("DB_QUERY_HEADERS", "1")
+    response = client.get("/chats", headers=auth_headers(user))
+    assert int(response.headers["X-DB-Queries"]) > 0
+    assert float(response.headers["X-DB-Time"]) > 0
@@ -0,0 +1,49 @@
+from sqlalchemy import select
+from sqlmodel import create_engine
+
+from backend import data_generator, migrations
+from backend.schema import ChatInDB, MessageInDB, UserChatLinkInDB
+
+
+def _engine(path):
+    engine = create_engine(f"sqlite:///{path}")
+    migrations.upgrade(engine)
+    return engine
+
+
+def _rows(engine, model):
+    table = model.__table__
+    with engine.connect() as conn:
+        return conn.execute(select(table).order_by(*table.primary_key)).all()
+
+
+def test_generate_is_deterministic_and_resumable(tmp_path):
+    shape = data_generator.Shape(
+        users=50, chats=10, messages=120, max_chat_size=20, chunk_size=25,
+    )
+    one_shot = _engine(tmp_path / "one_shot.db")
+    inserted = data_generator.generate(one_shot, shape)
+    assert inserted["users"] == 50
+    assert inserted["messages"] == 120
+
+    resumed = _engine(tmp_path / "resumed.db")
+    # stops in the middle of a chunk, like an interrupted run
+    partial = data_generator.Shape(**{**vars(shape), "messages": 60})
+    data_generator.generate(resumed, partial)
+    inserted = data_generator.generate(resumed, shape)
+    assert inserted["users"] == 0
+    assert inserted["messages"] == 60
+
+    for model in (ChatInDB, UserChatLinkInDB, MessageInDB):
+        assert _rows(one_shot, model) == _rows(resumed, model)
+
+
+def test_chat_sizes_are_skewed():
+    shape = data_generator.Shape(users=1000, chats=100, max_chat_size=200)
+    sizes = [data_generator.chat_size(shape, chat_id) for chat_id in range(1, 101)]
+    assert sizes[0] == 200
+    assert sizes == sorted(sizes, reverse=True)
+    assert sum(size <= 10 for size in sizes) > 50
+
+    members = data_generator.chat_members(shape, 1)
+    assert len(set(members)) == 200
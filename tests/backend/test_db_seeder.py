@@ -0,0 +1,45 @@
+from datetime import datetime
+
+from sqlalchemy import insert
+from sqlmodel import SQLModel, create_engine
+
+from backend import db_seeder, migrations
+from backend.schema import ChatInDB, MessageInDB, UserChatLinkInDB, UserInDB
+
+
+def test_seed_database_streams_and_can_be_rerun(tmp_path, monkeypatch):
+    monkeypatch.setenv("SEED_CHUNK_SIZE", "7")
+    source = create_engine(f"sqlite:///{tmp_path / 'source.db'}")
+    SQLModel.metadata.create_all(source)
+    with source.begin() as conn:
+        conn.execute(insert(UserInDB), [
+            {"id": i, "username": f"user{i}", "email": f"user{i}@example.com",
+             "hashed_password": "x", "created_at": datetime(2024, 1, 1)}
+            for i in range(1, 4)
+        ])
+        conn.execute(insert(ChatInDB), [
+            {"id": 10, "name": "nostromo", "owner_id": 1,
+             "created_at": datetime(2024, 1, 1)},
+        ])
+        conn.execute(insert(UserChatLinkInDB), [
+            {"user_id": i, "chat_id": 10} for i in range(1, 4)
+        ])
+        conn.execute(insert(MessageInDB), [
+            {"id": i, "text": f"message {i}", "user_id": i % 3 + 1, "chat_id": 10,
+             "created_at": datetime(2024, 1, 1)}
+            for i in range(1, 51)
+        ])
+
+    target = create_engine(f"sqlite:///{tmp_path / 'target.db'}")
+    migrations.upgrade(target)
+
+    result = db_seeder.seed_database(source, target)
+    assert result["message_count"]["local"] == 50
+    assert result["message_count"]["additions"] == 50
+    assert result["link_count"]["final"] == 3
+    assert result["reconcile"] == {"repaired_chats": 1}
+
+    result = db_seeder.seed_database(source, target)
+    assert result["user_count"]["additions"] == 0
+    assert result["message_count"]["additions"] == 0
+    assert result["message_count"]["final"] == 50
@@ -0,0 +1,115 @@
+import asyncio
+import contextlib
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from backend import live
+from backend.auth import _build_access_token
+
+
+@contextlib.contextmanager
+def _connect(client, chat_id: int, token: str):
+    with client.websocket_connect(f"/chats/{chat_id}/ws") as websocket:
+        websocket.send_json({"token": token})
+        assert websocket.receive_json() == {"type": "ready"}
+        yield websocket
+
+
+def _token(user) -> str:
+    return _build_access_token(user).access_token
+
+
+def test_members_receive_message_events(client, chat_factory, auth_headers):
+    chat_id, (ripley, bishop) = chat_factory(["ripley", "bishop"])
+    headers = auth_headers(ripley)
+
+    with _connect(client, chat_id, _token(bishop)) as websocket:
+        url = f"/chats/{chat_id}/messages"
+        message = client.post(url, json={"text": "hello"}, headers=headers).json()["message"]
+        event = websocket.receive_json()
+        assert event["type"] == "message.created"
+        assert event["message"]["text"] == "hello"
+        assert event["message"]["user"]["username"] == "ripley"
+
+        url = f"/chats/{chat_id}/messages/{message['id']}"
+        client.put(url, json={"text": "edited"}, headers=headers)
+        event = websocket.receive_json()
+        assert (event["type"], event["message"]["text"]) == ("message.updated", "edited")
+
+        client.delete(url, headers=headers)
+        assert websocket.receive_json() == {
+            "type": "message.deleted",
+            "message": {"id": message["id"], "chat_id": chat_id},
+        }
+    assert not live.hub.has_subscribers(chat_id)
+
+
+def test_only_members_may_connect(client, chat_factory):
+    chat_id, _ = chat_factory(["ripley"])
+    _other_chat, (bishop,) = chat_factory(["bishop"])
+
+    for token in (_token(bishop), "invalid"):
+        with pytest.raises(WebSocketDisconnect) as e:
+            with _connect(client, chat_id, token):
+                pass
+        assert e.value.code == live.POLICY_VIOLATION
+
+
+def test_the_token_must_be_the_first_message(client, chat_factory, monkeypatch):
+    monkeypatch.setenv("LIVE_AUTH_TIMEOUT_SECONDS", "0.01")
+    chat_id, (ripley,) = chat_factory(["ripley"])
+    token = _token(ripley)
+
+    with pytest.raises(WebSocketDisconnect) as e:
+        with client.websocket_connect(f"/chats/{chat_id}/ws?token={token}") as websocket:
+            websocket.receive_json()
+    assert e.value.code == live.POLICY_VIOLATION
+
+    with pytest.raises(WebSocketDisconnect) as e:
+        with client.websocket_connect(f"/chats/{chat_id}/ws") as websocket:
+            websocket.send_text(token)
+            websocket.receive_json()
+    assert e.value.code == live.POLICY_VIOLATION
+
+
+def test_batches_are_one_event(client, chat_factory, auth_headers, monkeypatch):
+    monkeypatch.setenv("LIVE_QUEUE_SIZE", "5")
+    chat_id, (ripley,) = chat_factory(["ripley"])
+    headers = auth_headers(ripley)
+
+    with _connect(client, chat_id, _token(ripley)) as websocket:
+        batch = {"messages": [{"text": f"message {i}"} for i in range(10)]}
+        url = f"/chats/{chat_id}/messages/batch"
+        assert client.post(url, json=batch, headers=headers).status_code == 201
+        event = websocket.receive_json()
+        assert event["type"] == "messages.created"
+        assert [m["text"] for m in event["messages"]] == [f"message {i}" for i in range(10)]
+
+        # still connected
+        client.post(f"/chats/{chat_id}/messages", json={"text": "after"}, headers=headers)
+        assert websocket.receive_json()["message"]["text"] == "after"
+
+
+def test_heartbeat(client, chat_factory, monkeypatch):
+    monkeypatch.setenv("LIVE_HEARTBEAT_SECONDS", "0.01")
+    chat_id, (ripley,) = chat_factory(["ripley"])
+
+    with _connect(client, chat_id, _token(ripley)) as websocket:
+        assert websocket.receive_json() == {"type": "ping"}
+
+
+def test_slow_subscribers_are_dropped():
+    async def scenario():
+        hub = live.Hub()
+        slow = hub.subscribe(1, maxsize=2)
+        for i in range(3):
+            hub.publish(1, {"n": i})
+        # the backlog is dropped for the sentinel that closes the connection
+        assert slow.overflowed
+        assert slow.queue.get_nowait() is None
+
+        hub.unsubscribe(slow)
+        assert not hub.has_subscribers(1)
+
+    asyncio.run(scenario())
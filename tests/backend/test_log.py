@@ -0,0 +1,76 @@
+import json
+import logging
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend import log
+
+
+class _Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def _app_with_logging() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: int):
+        logging.getLogger("backend.test").info("item", extra={"item_id": item_id})
+        return {"id": item_id}
+
+    app.add_middleware(log.RequestLoggingMiddleware)
+    return app
+
+
+def test_json_formatter_includes_request_id_and_extra():
+    record = logging.makeLogRecord({
+        "name": "backend.test", "levelname": "INFO", "msg": "hello %s",
+        "args": ("world",), "request_id": "abc", "user_id": 7,
+    })
+    entry = json.loads(log.JsonFormatter().format(record))
+    assert entry["message"] == "hello world"
+    assert entry["request_id"] == "abc"
+    assert entry["user_id"] == 7
+
+
+def test_request_ids_and_access_log(monkeypatch):
+    records = _Records()
+    records.addFilter(log.RequestIdFilter())
+    for name in ("backend.access", "backend.test"):
+        logging.getLogger(name).addHandler(records)
+    monkeypatch.setattr(logging.getLogger("backend"), "level", logging.INFO)
+    try:
+        client = TestClient(_app_with_logging())
+        response = client.get("/items/1", headers={"X-Request-ID": "req-1"})
+        assert response.headers["X-Request-ID"] == "req-1"
+        assert len(client.get("/items/2").headers["X-Request-ID"]) == 32
+    finally:
+        for name in ("backend.access", "backend.test"):
+            logging.getLogger(name).removeHandler(records)
+
+    item, access = records.records[:2]
+    assert (item.item_id, item.request_id) == (1, "req-1")
+    assert access.route == "/items/{item_id}"
+    assert access.status == 200
+    assert access.request_id == "req-1"
+
+
+def test_access_log_sampling(monkeypatch):
+    monkeypatch.setenv("LOG_SAMPLE_RATES", "/items/{item_id}=0")
+    records = _Records()
+    logging.getLogger("backend.access").addHandler(records)
+    monkeypatch.setattr(logging.getLogger("backend"), "level", logging.INFO)
+    try:
+        client = TestClient(_app_with_logging())
+        client.get("/items/1")
+        client.get("/missing")
+    finally:
+        logging.getLogger("backend.access").removeHandler(records)
+
+    assert [record.route for record in records.records] == ["unmatched"]
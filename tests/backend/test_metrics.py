@@ -0,0 +1,55 @@
+from backend import metrics
+
+
+def _requests_total(method: str, route: str, status: int) -> float:
+    return metrics.requests_total._values.get((method, route, status), 0)
+
+
+def test_metrics_are_keyed_by_route_template(client, monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    before = _requests_total("GET", "/chats/{chat_id}", 401)
+    client.get("/chats/1")
+    client.get("/chats/2")
+    client.get("/no/such/path")
+    assert _requests_total("GET", "/chats/{chat_id}", 401) == before + 2
+    assert _requests_total("GET", "unmatched", 404) >= 1
+
+    assert client.get("/metrics").status_code == 403
+    response = client.get("/metrics", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+
+    assert (
+        'http_requests_total{method="GET",route="/chats/{chat_id}",status="401"} '
+        f"{before + 2}"
+    ) in lines
+    assert any(
+        line.startswith('http_request_duration_seconds_count{method="GET",'
+                        'route="/chats/{chat_id}"}')
+        for line in lines
+    )
+    assert any(line.startswith('db_pool_in_use{pool="async"}') for line in lines)
+    assert "# TYPE db_pool_checkouts_total counter" in lines
+    assert any(line.startswith('auth_cache_hits_total{cache="users"}') for line in lines)
+
+
+def test_invalid_content_length_is_not_measured(client):
+    before = _requests_total("POST", "/auth/token", 422)
+    response = client.post("/auth/token", content=b"", headers={"Content-Length": "x"})
+    assert response.status_code == 422
+    assert _requests_total("POST", "/auth/token", 422) == before + 1
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("latency", "test", (0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(("GET",), value)
+
+    assert histogram.render(("method",))[2:] == [
+        'latency_bucket{method="GET",le="0.1"} 1',
+        'latency_bucket{method="GET",le="1.0"} 3',
+        'latency_bucket{method="GET",le="+Inf"} 4',
+        'latency_sum{method="GET"} 6.05',
+        'latency_count{method="GET"} 4',
+    ]
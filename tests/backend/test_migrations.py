@@ -0,0 +1,66 @@
+from sqlalchemy import inspect
+from sqlmodel import SQLModel, create_engine
+
+from backend import migrations, pool
+
+
+def _index_names(engine, table):
+    return {index["name"] for index in inspect(engine).get_indexes(table)}
+
+
+def test_upgrade_and_downgrade(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+
+    assert migrations.upgrade(engine) == [1, 2, 3, 4, 5, 6]
+    assert migrations.upgrade(engine) == []
+    assert migrations.current_version(engine) == 6
+    assert "ix_messages_chat_id_created_at_id" in _index_names(engine, "messages")
+    assert "messages_fts" in inspect(engine).get_table_names()
+
+    assert migrations.downgrade(engine, 1) == [6, 5, 4, 3, 2]
+    assert migrations.current_version(engine) == 1
+    assert _index_names(engine, "messages") == set()
+    assert "messages_fts" not in inspect(engine).get_table_names()
+
+    assert migrations.downgrade(engine, 0) == [1]
+    assert "messages" not in inspect(engine).get_table_names()
+
+
+def test_upgrade_adopts_existing_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    SQLModel.metadata.create_all(engine)
+
+    assert migrations.upgrade(engine) == [1, 2, 3, 4, 5, 6]
+    assert "ix_user_chat_links_chat_id_user_id" in _index_names(
+        engine, "user_chat_links"
+    )
+
+
+def test_migrations_fit_a_lambda_mode_pool(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_POOL_MODE", "lambda")
+    monkeypatch.setenv("DB_POOL_TIMEOUT", "1")
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", **pool.pool_options())
+
+    assert migrations.upgrade(engine) == [1, 2, 3, 4, 5, 6]
+    assert migrations.downgrade(engine, 5) == [6]
+    # one checkout per run, the version table included
+    assert engine.pool.stats.checkouts == 2
+
+
+def test_default_listings_read_in_index_order(tmp_path):
+    from backend import database as db
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    migrations.upgrade(engine)
+    queries = [
+        db.users_query(),
+        db.users_query("created_at"),
+        db.chat_messages_query(1),
+        db.chat_messages_query(1, "created_at"),
+        db.chat_users_query(1),
+    ]
+    with engine.connect() as conn:
+        for query in queries:
+            sql = str(query.compile(engine, compile_kwargs={"literal_binds": True}))
+            plan = [row[3] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+            assert not any("TEMP B-TREE" in step for step in plan), (sql, plan)
@@ -0,0 +1,106 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import auth, main, passwords
+
+
+def test_executor_rejects_work_beyond_its_queue():
+    executor = passwords.PasswordExecutor(max_workers=1, max_queued=1)
+    release = threading.Event()
+
+    async def scenario():
+        running = asyncio.ensure_future(executor.submit("hash", release.wait))
+        queued = asyncio.ensure_future(executor.submit("hash", lambda: "queued"))
+        await asyncio.sleep(0)
+        assert executor.pending == 2
+
+        with pytest.raises(passwords.PasswordWorkersBusy):
+            await executor.submit("hash", lambda: "rejected")
+
+        release.set()
+        assert await running is True
+        assert await queued == "queued"
+        assert executor.pending == 0
+
+    asyncio.run(scenario())
+
+
+def test_login_is_refused_while_the_workers_are_busy(client, chat_factory, monkeypatch):
+    _chat_id, (user,) = chat_factory(["ripley"])
+    monkeypatch.setattr(
+        passwords, "executor", passwords.PasswordExecutor(max_workers=1, max_queued=-1),
+    )
+
+    response = client.post(
+        "/auth/token", data={"username": user.username, "password": "x"},
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    metrics = client.get("/metrics", headers={"X-Admin-Token": "secret"})
+    assert "password_operations_rejected_total" in metrics.text
+
+
+def test_login_rehashes_passwords_of_another_cost(
+    client, chat_factory, session, monkeypatch,
+):
+    _chat_id, (user,) = chat_factory(["bishop"])
+    user.hashed_password = passwords.context(4).hash("synthetic")
+    session.add(user)
+    session.commit()
+    monkeypatch.setattr(auth, "pwd_context", passwords.context(5))
+
+    for _ in range(2):
+        response = client.post(
+            "/auth/token", data={"username": "bishop", "password": "synthetic"},
+        )
+        assert response.status_code == 200
+        session.refresh(user)
+        assert user.hashed_password.startswith("$2b$05$")
+
+    response = client.post(
+        "/auth/token", data={"username": "bishop", "password": "wrong"},
+    )
+    assert response.status_code == 401
+
+
+def test_bcrypt_runs_without_holding_a_connection(
+    single_connection_engine, chat_factory, session, monkeypatch,
+):
+    _chat_id, (user,) = chat_factory(["bishop"])
+    context = passwords.context(4)
+    user.hashed_password = context.hash("synthetic")
+    session.add(user)
+    session.commit()
+    in_use = []
+
+    class RecordingContext:
+        def hash(self, secret):
+            in_use.append(single_connection_engine.pool.checkedout())
+            return context.hash(secret)
+
+        def verify_and_update(self, secret, hashed):
+            in_use.append(single_connection_engine.pool.checkedout())
+            return context.verify_and_update(secret, hashed)
+
+    monkeypatch.setattr(auth, "pwd_context", RecordingContext())
+    with TestClient(main.app) as client:
+        response = client.post(
+            "/auth/token", data={"username": "bishop", "password": "synthetic"},
+        )
+        assert response.status_code == 200
+        registration = {"username": "hicks", "email": "hicks@example.com", "password": "pw"}
+        assert client.post("/auth/registration", json=registration).status_code == 200
+    assert in_use == [0, 0]
+
+
+def test_calibration_recommends_the_slowest_cost_within_the_target():
+    timings = [(4, 0.001), (5, 0.002), (6, 0.004)]
+    assert passwords.recommended_rounds(timings, 0.003) == 5
+    assert passwords.recommended_rounds(timings, 0.0001) == 4
+
+    measured = passwords.calibrate(0)
+    assert [cost for cost, _ in measured] == [4]
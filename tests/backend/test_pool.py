@@ -0,0 +1,47 @@
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from backend import main, pool, user_cache
+
+
+def test_lambda_mode_uses_a_single_pinged_connection(monkeypatch):
+    monkeypatch.setenv("DB_POOL_MODE", "lambda")
+    monkeypatch.setenv("DB_POOL_RECYCLE", "60")
+
+    options = pool.pool_options()
+    assert options["poolclass"] is pool.TimedQueuePool
+    assert options["pool_size"] == 1
+    assert options["max_overflow"] == 0
+    assert options["pool_pre_ping"] is True
+    assert options["pool_recycle"] == 60
+
+
+def test_pool_status_reports_usage(tmp_path, monkeypatch):
+    monkeypatch.delenv("DB_POOL_MODE", raising=False)
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", **pool.pool_options())
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        status = pool.pool_status(engine.pool)
+        assert status["in_use"] == 1
+        assert status["checkouts"] == 1
+
+    status = pool.pool_status(engine.pool)
+    assert status["in_use"] == 0
+    assert status["overflow"] == 0
+    assert status["wait_seconds_max"] >= 0
+
+
+def test_write_routes_fit_a_single_connection_pool(
+    single_connection_engine, chat_factory, auth_headers,
+):
+    _chat_id, (ripley,) = chat_factory(["ripley"])
+    # a cold cache makes authentication query the database
+    user_cache.clear()
+
+    with TestClient(main.app) as client:
+        response = client.put(
+            "/users/me", json={"email": "new@example.com"}, headers=auth_headers(ripley),
+        )
+    assert response.status_code == 200
+    assert response.json()["user"]["email"] == "new@example.com"
@@ -0,0 +1,85 @@
+import json
+from pathlib import Path
+
+from backend import profiling
+
+
+def test_profiling_requires_the_admin_token(
+    client, chat_factory, monkeypatch, auth_headers,
+):
+    chat_id, (user,) = chat_factory(["ripley"], message_count=3)
+    headers = {**auth_headers(user), "X-Profile": "inline"}
+
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    response = client.get(f"/chats/{chat_id}/messages", headers=headers)
+    assert response.json()["meta"]["count"] == 3
+
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    response = client.get(
+        f"/chats/{chat_id}/messages", headers={**headers, "X-Admin-Token": "wrong"},
+    )
+    assert response.json()["meta"]["count"] == 3
+
+
+def test_inline_profile(client, chat_factory, monkeypatch, auth_headers):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    chat_id, (user,) = chat_factory(["ripley"], message_count=3)
+
+    response = client.get(
+        f"/chats/{chat_id}/messages?profile=inline",
+        headers={**auth_headers(user), "X-Admin-Token": "secret"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "function calls" in response.text
+    assert "SQL statements" in response.text
+    assert "FROM messages" in response.text
+
+
+def test_profile_to_file(client, chat_factory, monkeypatch, tmp_path, auth_headers):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    monkeypatch.setenv("PROFILE_DIR", str(tmp_path))
+    chat_id, (user,) = chat_factory(["ripley"], message_count=3)
+
+    response = client.get(
+        f"/chats/{chat_id}",
+        headers={**auth_headers(user), "X-Admin-Token": "secret", "X-Profile": "file",
+                 "X-Request-ID": "slow-chat"},
+    )
+    assert response.json()["chat"]["id"] == chat_id
+    assert response.headers["X-Profile-Path"] == str(tmp_path / "slow-chat")
+    assert (tmp_path / "slow-chat.prof").exists()
+    statements = json.loads(Path(tmp_path / "slow-chat.sql.json").read_text())
+    assert statements and all("ms" in statement for statement in statements)
+
+
+def test_profile_file_names_stay_in_the_profile_dir(
+    client, chat_factory, monkeypatch, tmp_path, auth_headers,
+):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    monkeypatch.setenv("PROFILE_DIR", str(tmp_path / "profiles"))
+    chat_id, (user,) = chat_factory(["ripley"])
+
+    client.get(
+        f"/chats/{chat_id}",
+        headers={**auth_headers(user), "X-Admin-Token": "secret", "X-Profile": "file",
+                 "X-Request-ID": "../escaped"},
+    )
+    assert not (tmp_path / "escaped.prof").exists()
+    assert (tmp_path / "profiles" / "escaped.prof").exists()
+
+
+def test_overlapping_profiles_are_skipped(
+    client, chat_factory, monkeypatch, auth_headers,
+):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    chat_id, (user,) = chat_factory(["ripley"], message_count=3)
+
+    # as if another request was being profiled
+    with profiling._profiling:
+        response = client.get(
+            f"/chats/{chat_id}/messages?profile=inline",
+            headers={**auth_headers(user), "X-Admin-Token": "secret"},
+        )
+    assert response.status_code == 200
+    assert response.json()["meta"]["count"] == 3
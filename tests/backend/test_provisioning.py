@@ -0,0 +1,128 @@
+import asyncio
+import json
+import threading
+
+from backend import passwords, provisioning
+
+
+def _jsonl(*rows) -> str:
+    return "\n".join(row if isinstance(row, str) else json.dumps(row) for row in rows)
+
+
+def test_bulk_registration(client, chat_factory, monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(provisioning, "pwd_context", passwords.context(4))
+    monkeypatch.setenv("PROVISIONING_BATCH_SIZE", "2")
+    chat_factory(["ripley"])
+
+    body = _jsonl(
+        {"username": "bishop", "email": "bishop@example.com", "password": "pw"},
+        {"username": "ripley", "email": "other@example.com", "password": "pw"},
+        "",
+        {"username": "hicks", "email": "bishop@example.com", "password": "pw"},
+        {"username": "hudson"},
+        {"username": "vasquez", "email": "vasquez@example.com", "password": "pw"},
+    )
+    response = client.post(
+        "/users/bulk", content=body, headers={"X-Admin-Token": "secret"},
+    )
+    assert response.status_code == 200
+    report = response.json()
+
+    assert report["meta"] == {"count": 2, "error_count": 3}
+    assert [user["username"] for user in report["users"]] == ["bishop", "vasquez"]
+    errors = {error["line"]: error["detail"] for error in report["errors"]}
+    assert errors[2] == {
+        "type": "duplicate_value",
+        "entity_name": "User",
+        "entity_field": "username",
+        "entity_field_value": "ripley",
+    }
+    assert errors[4]["entity_field"] == "email"
+    assert errors[5]["type"] == "invalid_registration"
+
+    response = client.post(
+        "/auth/token", data={"username": "vasquez", "password": "pw"},
+    )
+    assert response.status_code == 200
+
+
+def test_bulk_hashing_waits_for_busy_password_workers(monkeypatch):
+    monkeypatch.setattr(provisioning, "pwd_context", passwords.context(4))
+    monkeypatch.setattr(provisioning, "BUSY_RETRY_SECONDS", 0.01)
+    # room for one operation: the login below, then the import
+    monkeypatch.setattr(
+        passwords, "executor", passwords.PasswordExecutor(max_workers=2, max_queued=-1),
+    )
+    release = threading.Event()
+
+    async def scenario():
+        login = asyncio.ensure_future(passwords.executor.submit("verify", release.wait))
+        await asyncio.sleep(0)
+        hashing = asyncio.ensure_future(provisioning._hash_on_password_workers(["a", "b"]))
+        await asyncio.sleep(0.05)
+        assert not hashing.done()
+
+        release.set()
+        assert await login is True
+        hashed = await hashing
+        assert [passwords.context(4).verify(p, h) for p, h in zip("ab", hashed)] == [True, True]
+
+    asyncio.run(scenario())
+
+
+def test_bulk_registration_is_admin_only(client, monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    body = _jsonl({"username": "bishop", "email": "bishop@example.com", "password": "pw"})
+
+    assert client.post("/users/bulk", content=body).status_code == 403
+    response = client.post("/users/bulk", content=body, headers={"X-Admin-Token": "x"})
+    assert response.status_code == 403
+
+
+def test_bulk_registration_rejects_large_bodies(client, monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(provisioning, "MAX_ROWS", 2)
+    body = _jsonl(*(
+        {"username": name, "email": f"{name}@example.com", "password": "pw"}
+        for name in ("bishop", "hicks", "vasquez")
+    ))
+
+    response = client.post("/users/bulk", content=body, headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 413
+
+    monkeypatch.setattr(provisioning, "MAX_BYTES", 10)
+    response = client.post(
+        "/users/bulk", content=body[:100], headers={"X-Admin-Token": "secret"},
+    )
+    assert response.status_code == 413
+
+
+def test_bulk_registration_rejects_invalid_content_length(client, monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+
+    response = client.post(
+        "/users/bulk",
+        content=b"{}",
+        headers={"X-Admin-Token": "secret", "Content-Length": "many"},
+    )
+    assert response.status_code == 400
+
+
+def test_bulk_registration_rejects_invalid_utf8(client, monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+
+    response = client.post(
+        "/users/bulk", content=b"\xff\xfe", headers={"X-Admin-Token": "secret"},
+    )
+    assert response.status_code == 422
+
+
+def test_read_lines_across_chunks():
+    async def chunks():
+        body = "{\"username\": \"bishöp\"}\r\n\n{}".encode()
+        for i in range(0, len(body), 3):
+            yield body[i:i + 3]
+
+    lines = asyncio.run(provisioning.read_lines(chunks()))
+    assert lines == ['{"username": "bishöp"}\r', "", "{}"]
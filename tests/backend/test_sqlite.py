@@ -0,0 +1,20 @@
+from sqlalchemy import create_engine, text
+
+from backend import sqlite
+
+
+def test_pragmas_are_applied_on_connect(tmp_path, monkeypatch):
+    monkeypatch.setenv("SQLITE_BUSY_TIMEOUT_MS", "1234")
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    sqlite.install(engine)
+
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        # NORMAL
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 1234
+        assert conn.execute(text("PRAGMA cache_size")).scalar() == -65536
+
+
+def test_writer_pool_is_a_single_connection():
+    assert sqlite.writer_pool_options() == {"pool_size": 1, "max_overflow": 0}
@@ -0,0 +1,52 @@
+from backend import user_cache
+
+
+def test_ttl_cache_expires_and_evicts():
+    now = [0.0]
+    cache = user_cache.TTLCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    cache.set(1, "ripley")
+    cache.set(2, "bishop")
+    assert cache.get(1) == "ripley"
+    cache.set(3, "hicks")
+    # 2 was the least recently used
+    assert cache.get(2) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.set(4, "hudson", ttl=1)
+    now[0] = 5
+    assert cache.get(4) is None
+    assert cache.get(3) == "hicks"
+    now[0] = 10
+    assert cache.get(3) is None
+
+
+def test_revoked_versions_last_for_the_token_lifetime():
+    now = [0.0]
+    revoked = user_cache.RevokedVersions(clock=lambda: now[0])
+    revoked.revoke(1, version=2, lifetime=3600)
+    assert revoked.is_revoked(1, 1)
+    assert not revoked.is_revoked(1, 2)
+    assert not revoked.is_revoked(2, 0)
+
+    now[0] = 3600
+    assert not revoked.is_revoked(1, 1)
+    revoked.revoke(3, version=1, lifetime=3600)
+    # expired entries are dropped on the next revocation
+    assert len(revoked) == 1
+
+
+def test_authentication_is_served_from_the_cache(
+    client, chat_factory, monkeypatch, auth_headers,
+):
+    monkeypatch.setenv("DB_QUERY_HEADERS", "1")
+    _chat_id, (user,) = chat_factory(["ripley"])
+    headers = auth_headers(user)
+
+    first = client.get("/users/me", headers=headers)
+    second = client.get("/users/me", headers=headers)
+    assert first.json() == second.json()
+    assert int(first.headers["X-DB-Queries"]) == 1
+    assert int(second.headers["X-DB-Queries"]) == 0
+
+    client.put("/users/me", json={"username": "ellen"}, headers=headers)
+    assert client.get("/users/me", headers=headers).json()["user"]["username"] == "ellen"
@@ -0,0 +1,23 @@
+from benchmarks.hot_paths import regressions
+
+
+def _run(**medians):
+    return {"results": {"small": {
+        name: {"median_ms": median, "p95_ms": median} for name, median in medians.items()
+    }}}
+
+
+def test_regressions_compare_with_recent_runs():
+    history = [_run(get_chat_by_id=10.0), _run(get_chat_by_id=2.0),
+               _run(get_chat_by_id=2.0, create_message=4.0)]
+    results = {"small": {
+        "get_chat_by_id": {"median_ms": 2.4, "p95_ms": 3.0},
+        "create_message": {"median_ms": 6.0, "p95_ms": 6.0},
+        "serialize_chats": {"median_ms": 1.0, "p95_ms": 1.0},
+    }}
+
+    found = regressions(history, results, threshold=0.25, baseline=2)
+    assert found == ["small/create_message: 6.0 ms, baseline 4.0 ms (+50%)"]
+
+    # the median of a longer baseline is not thrown off by the slow outlier
+    assert regressions(history, results, threshold=0.25, baseline=3) == found
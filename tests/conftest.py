@@ -1,30 +1,179 @@
+from datetime import datetime, timedelta
+
 import pytest
 from fastapi.testclient import TestClient
-from sqlmodel import Session, SQLModel, StaticPool, create_engine
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import Session, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from backend.main import app
 from backend import database as db
+from backend import main, migrations, pool, query_stats, user_cache
+from backend.auth import _build_access_token
+from backend.schema import ChatInDB, MessageInDB, UserChatLinkInDB, UserInDB
 
 
 @pytest.fixture
-def session():
+def db_path(tmp_path):
+    return tmp_path / "test.db"
+
+
+@pytest.fixture
+def engine(db_path):
     engine = create_engine(
-        "sqlite://",
+        f"sqlite:///{db_path}",
         connect_args={"check_same_thread": False},
-        poolclass=StaticPool,
     )
-    SQLModel.metadata.create_all(engine)
-    with Session(engine) as session:
+    migrations.upgrade(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session(engine):
+    """Blocking session on the test database, for setting up fixtures."""
+    with Session(engine, expire_on_commit=False) as session:
         yield session
 
 
 @pytest.fixture
-def client(session):
-    def _get_session_override():
-        return session
+def chat_factory(session):
+    """Create a chat with the given members and messages, return its id."""
+
+    def _create_chat(members: list[str], message_count: int = 0, name="chat"):
+        users = []
+        for username in members:
+            user = UserInDB(
+                username=username,
+                email=f"{username}@example.com",
+                hashed_password="not-a-real-hash",
+            )
+            session.add(user)
+            users.append(user)
+        session.commit()
+
+        chat = ChatInDB(name=name, owner_id=users[0].id)
+        session.add(chat)
+        session.commit()
+        for user in users:
+            session.add(UserChatLinkInDB(user_id=user.id, chat_id=chat.id))
+
+        start = datetime(2024, 1, 1)
+        for i in range(message_count):
+            session.add(MessageInDB(
+                text=f"message {i}",
+                user_id=users[i % len(users)].id,
+                chat_id=chat.id,
+                created_at=start + timedelta(minutes=i),
+            ))
+        session.commit()
+        chat_id = chat.id
+        for user in users:
+            session.refresh(user)
+        # start requests from an empty identity map, like a fresh session
+        session.close()
+        return chat_id, users
+
+    return _create_chat
+
+
+@pytest.fixture
+def auth_headers():
+    """Build the Authorization header of a user's access token."""
+
+    def _auth_headers(user: UserInDB) -> dict[str, str]:
+        token = _build_access_token(user).access_token
+        return {"Authorization": f"Bearer {token}"}
+
+    return _auth_headers
+
+
+@pytest.fixture
+def async_engine(engine, db_path):
+    # every TestClient request runs in a fresh event loop, so connections
+    # must not be pooled across requests
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}", poolclass=NullPool)
+    query_stats.install(engine.sync_engine)
+    return engine
+
 
+@pytest.fixture
+def statements(async_engine):
+    """List that collects every SQL statement the app executes."""
+    executed = []
+
+    def _record(conn, cursor, statement, *args):
+        executed.append(statement)
+
+    engine = async_engine.sync_engine
+    event.listen(engine, "before_cursor_execute", _record)
+    yield executed
+    event.remove(engine, "before_cursor_execute", _record)
+
+
+@pytest.fixture
+def client(async_engine):
+    async def _get_session_override():
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            yield session
+
+    # ids restart with every test database
+    user_cache.clear()
     app.dependency_overrides[db.get_session] = _get_session_override
+    app.dependency_overrides[db.get_read_session] = _get_session_override
 
     yield TestClient(app)
 
-    app.dependency_overrides.clear()
\ No newline at end of file
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def single_connection_engine(engine, db_path, monkeypatch):
+    """
+    Serve the app from a pool of one connection, like DB_POOL_MODE=lambda.
+
+    Use the app through `with TestClient(app)`, which keeps one event loop
+    for every request so that the pooled connection stays usable.
+    """
+    single = create_async_engine(
+        f"sqlite+aiosqlite:///{db_path}",
+        poolclass=pool.TimedAsyncAdaptedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=1,
+    )
+    monkeypatch.setattr(db, "async_engine", single)
+    monkeypatch.setattr(db, "read_engine", single)
+    monkeypatch.setattr(main, "create_db_and_tables", lambda: None)
+    user_cache.clear()
+    return single
+
+
+@pytest.fixture
+def query_bound(client, monkeypatch):
+    """
+    Assert that an endpoint runs a bounded number of SQL statements.
+
+    `query_bound(request, max_queries, sizes)` calls `request(size)` for
+    every fixture size; it must build fixtures of that size and return the
+    response. The X-DB-Queries count of every response must be at most
+    `max_queries` and must not grow with the size (no N+1 queries).
+    """
+    monkeypatch.setenv("DB_QUERY_HEADERS", "1")
+
+    def _query_bound(request, max_queries: int, sizes=(2, 10, 30)) -> list[int]:
+        counts = []
+        for size in sizes:
+            response = request(size)
+            assert response.status_code < 400, response.text
+            counts.append(int(response.headers["X-DB-Queries"]))
+
+        assert max(counts) <= max_queries, (
+            f"{max(counts)} queries, at most {max_queries} expected"
+        )
+        assert len(set(counts)) == 1, f"query count grows with the data: {counts}"
+        return counts
+
+    return _query_bound